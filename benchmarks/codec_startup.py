@@ -0,0 +1,121 @@
+"""
+Startup benchmark measuring the time-to-first-encoded-frame of the SBC
+codec, comparing the legacy per-codec `ffi.verify()` binding against the
+precompiled ``bt_manager._rtpsbc`` extension module.
+
+Each measurement is taken in a fresh interpreter so that it reflects what
+an A2DP endpoint pays when handling its first SelectConfiguration.
+
+Usage:
+
+    python benchmarks/codec_startup.py [--runs N] [--cold]
+
+The ``--cold`` option forces a compiler invocation for the legacy path by
+pointing `ffi.verify()` at an empty temporary directory.
+"""
+from __future__ import unicode_literals
+
+import argparse
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+MTU = 503
+FRAMES = 1
+
+
+def child_legacy(tmpdir):
+    start = time.time()
+    import cffi
+    import bt_manager
+    ffi = cffi.FFI()
+    header_file = os.path.join(os.path.dirname(bt_manager.__file__),
+                               'rtpsbc.h')
+    with open(header_file) as fh:
+        ffi.cdef(fh.read())
+    kwargs = {}
+    if (tmpdir):
+        kwargs['tmpdir'] = tmpdir
+    lib = ffi.verify(b'#include "rtpsbc.h"', libraries=[b'rtpsbc'],
+                     ext_package=b'rtpsbc', **kwargs)
+    sbc = ffi.new('sbc_t *')
+    lib.sbc_init(sbc, 0)
+    sbc.mode = lib.SBC_MODE_JOINT_STEREO
+    sbc.frequency = lib.SBC_FREQ_44100
+    sbc.allocation = lib.SBC_AM_LOUDNESS
+    sbc.subbands = lib.SBC_SB_8
+    sbc.blocks = lib.SBC_BLK_16
+    sbc.bitpool = 53
+    sbc.endian = lib.SBC_LE
+    data = b'\x00' * (lib.sbc_get_codesize(sbc) * FRAMES)
+    fd = os.open(os.devnull, os.O_WRONLY)
+    lib.rtp_sbc_encode_to_fd(sbc, ffi.new('char[]', data), len(data), MTU,
+                             ffi.new('rtp_sbc_stream_t *'), fd)
+    os.close(fd)
+    return time.time() - start
+
+
+def child_precompiled(tmpdir):
+    start = time.time()
+    import bt_manager
+    config = bt_manager.SBCCodecConfig(
+        bt_manager.SBCChannelMode.CHANNEL_MODE_JOINT_STEREO,
+        bt_manager.SBCSamplingFrequency.FREQ_44_1KHZ,
+        bt_manager.SBCAllocationMethod.LOUDNESS,
+        bt_manager.SBCSubbands.SUBBANDS_8,
+        bt_manager.SBCBlocks.BLOCKS_16,
+        2,
+        53)
+    codec = bt_manager.SBCCodec(config)
+    data = b'\x00' * (codec.codec.sbc_get_codesize(codec.config) * FRAMES)
+    fd = os.open(os.devnull, os.O_WRONLY)
+    codec.encode(fd, MTU, data)
+    os.close(fd)
+    return time.time() - start
+
+
+MODES = {'legacy': child_legacy,
+         'precompiled': child_precompiled,
+         }
+
+
+def run_parent(runs, cold):
+    script = os.path.abspath(__file__)
+    print '%-12s %10s %10s %10s' % ('mode', 'min (ms)', 'median', 'max')
+    for mode in ('legacy', 'precompiled'):
+        samples = []
+        for _ in range(runs):
+            tmpdir = tempfile.mkdtemp() if (cold and mode == 'legacy') \
+                else ''
+            try:
+                out = subprocess.check_output([sys.executable, script,
+                                               '--child', mode,
+                                               '--tmpdir', tmpdir])
+                samples.append(float(out.strip()) * 1000)
+            finally:
+                if (tmpdir):
+                    shutil.rmtree(tmpdir, ignore_errors=True)
+        samples.sort()
+        print '%-12s %10.2f %10.2f %10.2f' % (mode, samples[0],
+                                              samples[len(samples) // 2],
+                                              samples[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--runs', type=int, default=10)
+    parser.add_argument('--cold', action='store_true')
+    parser.add_argument('--child', choices=sorted(MODES.keys()))
+    parser.add_argument('--tmpdir', default='')
+    args = parser.parse_args()
+    if (args.child):
+        print repr(MODES[args.child](args.tmpdir))
+    else:
+        run_parent(args.runs, args.cold)
+
+
+if __name__ == '__main__':
+    main()
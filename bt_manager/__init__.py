@@ -1,21 +1,13 @@
 from __future__ import unicode_literals
 from distutils.version import StrictVersion
 import cffi
-import os
 
 __version__ = '0.3.1'
 
-if StrictVersion(cffi.__version__) < StrictVersion('0.7'):
+if StrictVersion(cffi.__version__) < StrictVersion('1.12'):
         raise RuntimeError(
-            'bt_manager requires cffi >= 0.7, but found %s' % cffi.__version__)
-
-ffi = cffi.FFI()
-cwd = os.path.dirname(__file__)
-header_file = os.path.join(cwd, 'rtpsbc.h')
-with open(header_file) as fh:
-    header = fh.read()
-    ffi.cdef(header)
-    fh.close()
+            'bt_manager requires cffi >= 1.12, but found %s' %
+            cffi.__version__)
 
 from bt_manager.adapter import BTAdapter                 # noqa
 from bt_manager.agent import BTAgent                     # noqa
@@ -23,20 +15,46 @@ from bt_manager.attributes import ATTRIBUTES             # noqa
 from bt_manager.audio import BTAudio, BTAudioSource      # noqa
 from bt_manager.audio import BTAudioSink, SBCAudioCodec  # noqa
 from bt_manager.audio import SBCAudioSource, SBCAudioSink  # noqa
+from bt_manager.bitpool import SBCBitpoolController, BitpoolChange  # noqa
+from bt_manager.bitpool import BitpoolStats                # noqa
+from bt_manager.broadcast import SBCBroadcastGroup, SBCBroadcastMember  # noqa
+from bt_manager.broadcast import BroadcastStats, BroadcastMemberStats  # noqa
 from bt_manager.cod import BTCoD                         # noqa
 from bt_manager.codecs import *                          # noqa
 from bt_manager.control import BTControl                 # noqa
 from bt_manager.device import BTGenericDevice, BTDevice  # noqa
+from bt_manager.deviceindex import DeviceIndex           # noqa
 from bt_manager.discovery import BTDiscoveryInfo         # noqa
+from bt_manager.discoverysession import DiscoverySession, DiscoveryDelta  # noqa
+from bt_manager.discoverysession import DiscoveryStats   # noqa
+from bt_manager.dispatch import SignalDispatcher, DispatchStats  # noqa
+from bt_manager.dispatch import dispatcher               # noqa
 from bt_manager.exceptions import *                      # noqa
 from bt_manager.headset import BTHeadset                 # noqa
 from bt_manager.headset import BTHeadsetGateway          # noqa
 from bt_manager.interface import BTSimpleInterface       # noqa
 from bt_manager.interface import BTInterface             # noqa
+from bt_manager.interface import PropertyCacheStats      # noqa
+from bt_manager.mainloop import BTMainLoopRunner, MainLoopStats  # noqa
+from bt_manager.mainloop import runner                   # noqa
 from bt_manager.manager import BTManager                 # noqa
+from bt_manager.registry import BTObjectRegistry, RegistryStats  # noqa
+from bt_manager.registry import registry                 # noqa
 from bt_manager.media import BTMedia, BTMediaTransport   # noqa
+from bt_manager.negotiation import SBCNegotiationPolicy      # noqa
+from bt_manager.negotiation import NegotiationReason         # noqa
+from bt_manager.pcmsink import PCMSinkPipeline, PCMSinkStats  # noqa
+from bt_manager.pcmsink import PCMConsumer, PCMConsumerStats  # noqa
+from bt_manager.pcmsink import RawFileConsumer, WAVConsumer  # noqa
+from bt_manager.pcmsink import CallbackConsumer, PipeConsumer  # noqa
+from bt_manager.pcmsink import ArrayConsumer                 # noqa
+from bt_manager.pcmsource import PCMSourcePipeline, PCMSourceStats  # noqa
+from bt_manager.pcmsource import PCMRingBuffer, FileProducer   # noqa
+from bt_manager.pcmsource import GeneratorProducer, ArrayProducer  # noqa
+from bt_manager.pending import BTPendingCall, BTCallLimiter  # noqa
 from bt_manager.input import BTInput                     # noqa
 from bt_manager.serviceuuids import SERVICES             # noqa
+from bt_manager.signalqueue import SignalQueue, SignalQueueStats  # noqa
 from bt_manager.uuid import BTUUID, BTUUID16, BTUUID32   # noqa
 from bt_manager.uuid import BASE_UUID                    # noqa
 from bt_manager.vendors import VENDORS                   # noqa
@@ -1,7 +1,12 @@
 from __future__ import unicode_literals
 
+import dbus
+
 from interface import BTInterface
 from manager import BTManager
+from registry import registry
+from deviceindex import DeviceIndex
+from discoverysession import DiscoverySession
 
 
 class BTAdapter(BTInterface):
@@ -108,8 +113,20 @@ class BTAdapter(BTInterface):
         Signal notifying when a device is now out-of-range
     """
 
+    PROPERTY_TYPES = {'Address': dbus.String,
+                      'Name': dbus.String,
+                      'Alias': dbus.String,
+                      'Class': dbus.UInt32,
+                      'Powered': dbus.Boolean,
+                      'Discoverable': dbus.Boolean,
+                      'Pairable': dbus.Boolean,
+                      'PairableTimeout': dbus.UInt32,
+                      'DiscoverableTimeout': dbus.UInt32,
+                      'Discovering': dbus.Boolean,
+                      'Modalias': dbus.String}
+
     def __init__(self, adapter_path=None, adapter_id=None):
-        manager = BTManager()
+        manager = registry.get_wrapper(BTManager, '/', pinned=True)
         if (adapter_path is None):
             if (adapter_id is None):
                 adapter_path = manager.default_adapter()
@@ -137,6 +154,16 @@ class BTAdapter(BTInterface):
         """
         return self._interface.StartDiscovery()
 
+    def start_discovery_async(self, **kwargs):
+        """
+        Non-blocking variant of :py:meth:`start_discovery`.  The keyword
+        arguments are those of :py:meth:`.BTSimpleInterface.call_async`.
+
+        :return: Handle for the pending call
+        :rtype: :py:class:`.BTPendingCall`
+        """
+        return self.call_async('StartDiscovery', **kwargs)
+
     def stop_discovery(self):
         """
         This method will cancel any previous :py:meth:`start_discovery`
@@ -153,6 +180,44 @@ class BTAdapter(BTInterface):
         """
         return self._interface.StopDiscovery()
 
+    def stop_discovery_async(self, **kwargs):
+        """
+        Non-blocking variant of :py:meth:`stop_discovery`.  The keyword
+        arguments are those of :py:meth:`.BTSimpleInterface.call_async`.
+
+        :return: Handle for the pending call
+        :rtype: :py:class:`.BTPendingCall`
+        """
+        return self.call_async('StopDiscovery', **kwargs)
+
+    def device_index(self):
+        """
+        Obtain the adapter's shared :py:class:`.DeviceIndex`, building
+        it on first use.  Once built, :py:meth:`find_device` and
+        device constructors given a `dev_id` resolve device object
+        paths from the index without a dbus call.
+
+        :return: device index of this adapter
+        :rtype: :py:class:`.DeviceIndex`
+        """
+        return registry.get_wrapper(DeviceIndex, self._path, pinned=True,
+                                    adapter=self)
+
+    def discovery_session(self, callback, window=0.5):
+        """
+        Create a :py:class:`.DiscoverySession` which delivers the
+        devices found by this adapter as coalesced batches rather than a
+        signal per inquiry result.  Call its `start` method to begin
+        discovery.
+
+        :param func callback: Function called with each
+            :py:class:`.DiscoveryDelta`
+        :param float window: Coalescing window in seconds
+        :return: discovery session
+        :rtype: :py:class:`.DiscoverySession`
+        """
+        return DiscoverySession(self, callback, window)
+
     def find_device(self, dev_id):
         """
         Returns the object path of device for given address.
@@ -160,6 +225,10 @@ class BTAdapter(BTInterface):
         :py:meth:`create_device` or
         :py:meth:`create_paired_device`
 
+        If a :py:meth:`device_index` has been built for the adapter the
+        path is taken from the index, falling back to dbus only for
+        devices which are not indexed.
+
         :param str dev_id: Device MAC address to look-up e.g.,
             '11:22:33:44:55:66'
         :return: Device object path e.g.,
@@ -168,6 +237,11 @@ class BTAdapter(BTInterface):
         :raises dbus.Exception: org.bluez.Error.DoesNotExist
         :raises dbus.Exception: org.bluez.Error.InvalidArguments
         """
+        index = registry.lookup(DeviceIndex, self._path)
+        if (index):
+            path = index.find(dev_id)
+            if (path):
+                return path
         return self._interface.FindDevice(dev_id)
 
     def list_devices(self):
@@ -236,7 +310,25 @@ class BTAdapter(BTInterface):
         :raises dbus.Exception: org.bluez.Error.InvalidArguments
         :raises dbus.Exception: org.bluez.Error.Failed
         """
-        return self._interface.RemoveDevice(dev_path)
+        ret = self._interface.RemoveDevice(dev_path)
+        registry.evict(dev_path)
+        return ret
+
+    def remove_device_async(self, dev_path, **kwargs):
+        """
+        Non-blocking variant of :py:meth:`remove_device`.  The keyword
+        arguments are those of :py:meth:`.BTSimpleInterface.call_async`.
+
+        :return: Handle for the pending call
+        :rtype: :py:class:`.BTPendingCall`
+        """
+        def evict(call):
+            if (call.exception is None):
+                registry.evict(dev_path)
+
+        call = self.call_async('RemoveDevice', dev_path, **kwargs)
+        call.add_done_callback(evict)
+        return call
 
     def register_agent(self, path, capability):
         """
@@ -259,6 +351,16 @@ class BTAdapter(BTInterface):
         """
         return self._interface.RegisterAgent(path, capability)
 
+    def register_agent_async(self, path, capability, **kwargs):
+        """
+        Non-blocking variant of :py:meth:`register_agent`.  The keyword
+        arguments are those of :py:meth:`.BTSimpleInterface.call_async`.
+
+        :return: Handle for the pending call
+        :rtype: :py:class:`.BTPendingCall`
+        """
+        return self.call_async('RegisterAgent', path, capability, **kwargs)
+
     def unregister_agent(self, path):
         """
         This unregisters the agent that has been previously
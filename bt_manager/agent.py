@@ -3,6 +3,7 @@ from __future__ import unicode_literals
 import dbus.service
 
 from exceptions import BTRejectedException
+from registry import registry
 
 
 class BTAgent(dbus.service.Object):
@@ -74,7 +75,7 @@ class BTAgent(dbus.service.Object):
         self.cb_notify_on_confirm_mode_change = \
             cb_notify_on_confirm_mode_change
         self.cb_notify_on_cancel = cb_notify_on_cancel
-        bus = dbus.SystemBus()
+        bus = registry.get_bus()
         super(BTAgent, self).__init__(bus, path)
 
     # Service object entry points defined below here
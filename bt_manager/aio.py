@@ -0,0 +1,399 @@
+"""
+asyncio front-end for bt_manager.
+
+The wrappers in this module mirror :py:class:`.BTManager`,
+:py:class:`.BTAdapter`, :py:class:`.BTDevice`, :py:class:`.BTMedia` and
+:py:class:`.BTMediaTransport` but return asyncio futures in place of
+blocking on dbus, and deliver signals through queues which are consumed
+by coroutines.  Since this package targets Python 2, the asyncio API
+is provided by `trollius`, which must be installed to use this module::
+
+    import trollius as asyncio
+    from trollius import From
+
+    @asyncio.coroutine
+    def scan(adapter):
+        found = adapter.signals(BTAdapter.SIGNAL_DEVICE_FOUND)
+        yield From(adapter.start_discovery())
+        while True:
+            (address, properties) = yield From(found.get())
+            print address, properties.get('Name')
+
+dbus-python still dispatches replies and signals from the GLib main
+loop, which must be running on another thread with dbus threading
+enabled, as set up by ``bt_manager.runner.start()``
+(see :py:class:`.BTMainLoopRunner`).  Results are handed to the
+asyncio loop with ``call_soon_threadsafe`` so that no polling timers are
+involved and a single asyncio loop can drive discovery, pairing and,
+using :py:meth:`.SBCAudioCodec.set_event_loop`, audio together.
+"""
+from __future__ import unicode_literals
+
+import trollius as asyncio
+
+from device import BTDevice, _find_adapter
+from deviceindex import DeviceIndex
+from dispatch import add_signal_receiver, remove_signal_receiver
+from exceptions import BTSignalNameNotRecognisedException
+from manager import BTManager
+from media import BTMedia, BTMediaTransport
+from pending import BTPendingCall
+from registry import registry
+
+
+def _set_future(future, call):
+    if (future.cancelled()):
+        return
+    if (call.exception is not None):
+        future.set_exception(call.exception)
+    else:
+        future.set_result(call.result)
+
+
+def wrap_pending_call(call, loop=None):
+    """
+    Convert a :py:class:`.BTPendingCall` into an asyncio future bound
+    to `loop`.  The call may complete on any thread.
+
+    :param call: Pending call handle
+    :param loop: Optional event loop, defaults to the current loop
+    :return: future completing with the call's result
+    :rtype: asyncio.Future
+    """
+    loop = loop or asyncio.get_event_loop()
+    future = asyncio.Future(loop=loop)
+    call.add_done_callback(
+        lambda c: loop.call_soon_threadsafe(_set_future, future, c))
+    return future
+
+
+class AioSignalStream:
+    """
+    Queue of signals received from one interface.  Each item is the
+    tuple of signal arguments, and is obtained with the :py:meth:`get`
+    coroutine.
+
+    :param interface: The :py:class:`.BTInterface` emitting the signal
+    :param str signal: Signal name
+    :param loop: Event loop on which the signals are delivered
+    :param int maxsize: Optional queue bound.  When the queue is full
+        the oldest signal is dropped to make room.
+    """
+    def __init__(self, interface, signal, loop, maxsize=0):
+        self.signal = signal
+        self.dropped = 0
+        self._bus = interface._bus
+        self._loop = loop
+        self._queue = asyncio.Queue(maxsize=maxsize, loop=loop)
+        self._subscription = add_signal_receiver(self._bus,
+                                                 self._signal_handler,
+                                                 signal,
+                                                 interface._dbus_addr,
+                                                 interface._path)
+
+    def _signal_handler(self, *args):
+        self._loop.call_soon_threadsafe(self._put, args)
+
+    def _put(self, args):
+        if (self._queue.full()):
+            self._queue.get_nowait()
+            self.dropped += 1
+        self._queue.put_nowait(args)
+
+    def get(self):
+        """
+        Coroutine returning the next signal's arguments.
+
+        :return: tuple of signal arguments
+        :rtype: tuple
+        """
+        return self._queue.get()
+
+    def qsize(self):
+        """
+        :return: number of signals queued
+        :rtype: int
+        """
+        return self._queue.qsize()
+
+    def close(self):
+        """
+        Stop receiving signals.
+
+        :return:
+        """
+        if (self._subscription):
+            remove_signal_receiver(self._bus, self._subscription)
+            self._subscription = None
+
+
+class AioBTInterface:
+    """
+    asyncio wrapper around an interface.  Refer to the concrete
+    sub-classes below.
+
+    :param interface: The :py:class:`.BTSimpleInterface` to wrap
+    :param loop: Optional event loop, defaults to the current loop
+    """
+    def __init__(self, interface, loop=None):
+        self.interface = interface
+        self.loop = loop or asyncio.get_event_loop()
+
+    def _done(self, result):
+        future = asyncio.Future(loop=self.loop)
+        future.set_result(result)
+        return future
+
+    def call(self, method, *args, **kwargs):
+        """
+        Call any dbus method of the interface.
+
+        :param str method: dbus method name e.g., 'DiscoverServices'
+        :param args: Method arguments
+        :param float timeout: Optional call timeout in seconds
+        :return: future completing with the method's return value
+        :rtype: asyncio.Future
+        """
+        return wrap_pending_call(self.interface.call_async(method, *args,
+                                                           **kwargs),
+                                 self.loop)
+
+    def get_property(self, name=None):
+        """
+        Get a property value by name or all properties as a
+        dictionary.  If the interface's property cache is enabled the
+        future is already complete.
+
+        :param str name: Optional property name
+        :return: future completing with the property value or dict
+        :rtype: asyncio.Future
+        """
+        if (getattr(self.interface, '_cache', None) is not None):
+            return self._done(self.interface.get_property(name))
+        call = BTPendingCall()
+
+        def got_properties(c):
+            if (c.exception is not None):
+                call.set_exception(c.exception)
+            elif (name):
+                try:
+                    call.set_result(c.result[name])
+                except KeyError as e:
+                    call.set_exception(e)
+            else:
+                call.set_result(c.result)
+
+        self.interface.call_async('GetProperties').add_done_callback(
+            got_properties)
+        return wrap_pending_call(call, self.loop)
+
+    def signals(self, signal, maxsize=0):
+        """
+        Open a stream of the given signal.
+
+        :param str signal: Signal name e.g.,
+            :py:attr:`.BTInterface.SIGNAL_PROPERTY_CHANGED`
+        :param int maxsize: Optional queue bound
+        :return: signal stream
+        :rtype: :py:class:`AioSignalStream`
+        :raises BTSignalNameNotRecognisedException: if the signal name is
+            not registered
+        """
+        if (signal not in getattr(self.interface, '_signal_names', ())):
+            raise BTSignalNameNotRecognisedException
+        return AioSignalStream(self.interface, signal, self.loop, maxsize)
+
+
+class AioBTManager(AioBTInterface):
+    """
+    asyncio wrapper for :py:class:`.BTManager`
+
+    :param loop: Optional event loop, defaults to the current loop
+    """
+    def __init__(self, loop=None):
+        AioBTInterface.__init__(self,
+                                registry.get_wrapper(BTManager, '/',
+                                                     pinned=True),
+                                loop)
+
+    def default_adapter(self):
+        """
+        Refer to :py:meth:`.BTManager.default_adapter`
+        """
+        return self.call('DefaultAdapter')
+
+    def find_adapter(self, pattern):
+        """
+        Refer to :py:meth:`.BTManager.find_adapter`
+        """
+        return self.call('FindAdapter', pattern)
+
+    def list_adapters(self):
+        """
+        Refer to :py:meth:`.BTManager.list_adapters`
+        """
+        return self.call('ListAdapters')
+
+
+class AioBTAdapter(AioBTInterface):
+    """
+    asyncio wrapper for :py:class:`.BTAdapter`
+
+    :param str adapter_path: Optional adapter object path
+    :param str adapter_id: Optional adapter device ID
+    :param loop: Optional event loop, defaults to the current loop
+    """
+    def __init__(self, adapter_path=None, adapter_id=None, loop=None):
+        AioBTInterface.__init__(self,
+                                _find_adapter(adapter_path, adapter_id),
+                                loop)
+
+    def start_discovery(self):
+        """
+        Refer to :py:meth:`.BTAdapter.start_discovery`
+        """
+        return wrap_pending_call(self.interface.start_discovery_async(),
+                                 self.loop)
+
+    def stop_discovery(self):
+        """
+        Refer to :py:meth:`.BTAdapter.stop_discovery`
+        """
+        return wrap_pending_call(self.interface.stop_discovery_async(),
+                                 self.loop)
+
+    def find_device(self, dev_id):
+        """
+        Look-up a device object path, straight from the adapter's
+        :py:class:`.DeviceIndex` if one knows the device.
+        """
+        index = registry.lookup(DeviceIndex, self.interface._path)
+        if (index):
+            path = index.find(dev_id)
+            if (path):
+                return self._done(path)
+        return self.call('FindDevice', dev_id)
+
+    def list_devices(self):
+        """
+        Refer to :py:meth:`.BTAdapter.list_devices`
+        """
+        return self.call('ListDevices')
+
+    def create_paired_device(self, dev_id, agent_path, capability):
+        """
+        Create and pair a device.  The future completes with the new
+        device's object path.
+        """
+        call = BTPendingCall()
+        self.interface.create_paired_device(dev_id, agent_path, capability,
+                                            call.reply_handler,
+                                            call.error_handler)
+        return wrap_pending_call(call, self.loop)
+
+    def remove_device(self, dev_path):
+        """
+        Refer to :py:meth:`.BTAdapter.remove_device`
+        """
+        return wrap_pending_call(self.interface.remove_device_async(dev_path),
+                                 self.loop)
+
+    def register_agent(self, path, capability):
+        """
+        Refer to :py:meth:`.BTAdapter.register_agent`
+        """
+        return wrap_pending_call(
+            self.interface.register_agent_async(path, capability), self.loop)
+
+    def unregister_agent(self, path):
+        """
+        Refer to :py:meth:`.BTAdapter.unregister_agent`
+        """
+        return self.call('UnregisterAgent', path)
+
+
+class AioBTDevice(AioBTInterface):
+    """
+    asyncio wrapper for :py:class:`.BTDevice`.  Refer to
+    :py:class:`.BTGenericDevice` for the keyword arguments.
+
+    :param loop: Optional event loop, defaults to the current loop
+    """
+    def __init__(self, loop=None, **kwargs):
+        AioBTInterface.__init__(self, BTDevice(**kwargs), loop)
+
+    def discover_services(self, pattern=''):
+        """
+        Refer to :py:meth:`.BTDevice.discover_services`
+        """
+        return wrap_pending_call(
+            self.interface.discover_services_async(pattern), self.loop)
+
+    def cancel_discovery(self):
+        """
+        Refer to :py:meth:`.BTDevice.cancel_discovery`
+        """
+        return wrap_pending_call(self.interface.cancel_discovery_async(),
+                                 self.loop)
+
+    def disconnect(self):
+        """
+        Refer to :py:meth:`.BTDevice.disconnect`
+        """
+        return wrap_pending_call(self.interface.disconnect_async(),
+                                 self.loop)
+
+
+class AioBTMedia(AioBTInterface):
+    """
+    asyncio wrapper for :py:class:`.BTMedia`
+
+    :param str adapter_id: Optional adapter device ID
+    :param loop: Optional event loop, defaults to the current loop
+    """
+    def __init__(self, adapter_id=None, loop=None):
+        AioBTInterface.__init__(self, BTMedia(adapter_id), loop)
+
+    def register_endpoint(self, path, properties):
+        """
+        Refer to :py:meth:`.BTMedia.register_endpoint`
+        """
+        return wrap_pending_call(
+            self.interface.register_endpoint_async(path, properties),
+            self.loop)
+
+    def unregister_endpoint(self, path):
+        """
+        Refer to :py:meth:`.BTMedia.unregister_endpoint`
+        """
+        return wrap_pending_call(
+            self.interface.unregister_endpoint_async(path), self.loop)
+
+
+class AioBTMediaTransport(AioBTInterface):
+    """
+    asyncio wrapper for :py:class:`.BTMediaTransport`
+
+    :param str path: Media transport object path
+    :param loop: Optional event loop, defaults to the current loop
+    """
+    def __init__(self, path, loop=None):
+        AioBTInterface.__init__(self,
+                                registry.get_wrapper(BTMediaTransport, path,
+                                                     path=path),
+                                loop)
+
+    def acquire(self, access_type):
+        """
+        Acquire the transport.  The future completes with the tuple
+        (fd, read_mtu, write_mtu).
+        """
+        return wrap_pending_call(self.interface.acquire_async(access_type),
+                                 self.loop)
+
+    def release(self, access_type):
+        """
+        Refer to :py:meth:`.BTMediaTransport.release`
+        """
+        return wrap_pending_call(self.interface.release_async(access_type),
+                                 self.loop)
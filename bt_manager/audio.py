@@ -10,9 +10,12 @@ from media import GenericEndpoint, BTMediaTransport
 from codecs import SBCChannelMode, SBCSamplingFrequency, \
     SBCAllocationMethod, SBCSubbands, SBCBlocks, A2DP_CODECS, \
     SBCCodecConfig, SBCCodec
+from negotiation import SBCNegotiationPolicy, default_bitpool
+from pcmsink import PCMSinkPipeline
+from pcmsource import PCMSourcePipeline
 from serviceuuids import SERVICES
-from exceptions import BTIncompatibleTransportAccessType, \
-    BTInvalidConfiguration
+from exceptions import BTIncompatibleTransportAccessType
+from registry import registry
 
 
 class BTAudio(BTGenericDevice):
@@ -37,6 +40,9 @@ class BTAudio(BTGenericDevice):
 
     See also: :py:class:`.BTGenericDevice` for setup params.
     """
+
+    PROPERTY_TYPES = {'State': dbus.String}
+
     def __init__(self, *args, **kwargs):
         BTGenericDevice.__init__(self, addr='org.bluez.Audio',
                                  *args, **kwargs)
@@ -52,6 +58,16 @@ class BTAudio(BTGenericDevice):
         """
         return self._interface.Connect()
 
+    def connect_async(self, **kwargs):
+        """
+        Non-blocking variant of :py:meth:`connect`.  The keyword
+        arguments are those of :py:meth:`.BTSimpleInterface.call_async`.
+
+        :return: Handle for the pending call
+        :rtype: :py:class:`.BTPendingCall`
+        """
+        return self.call_async('Connect', **kwargs)
+
     def disconnect(self):
         """
         Disconnect all audio profiles on the device
@@ -63,6 +79,16 @@ class BTAudio(BTGenericDevice):
         """
         return self._interface.Disconnect()
 
+    def disconnect_async(self, **kwargs):
+        """
+        Non-blocking variant of :py:meth:`disconnect`.  The keyword
+        arguments are those of :py:meth:`.BTSimpleInterface.call_async`.
+
+        :return: Handle for the pending call
+        :rtype: :py:class:`.BTPendingCall`
+        """
+        return self.call_async('Disconnect', **kwargs)
+
 
 class BTAudioSource(BTAudio):
     """
@@ -110,6 +136,10 @@ class BTAudioSink(BTAudio):
         remote device is suspended.
     """
 
+    PROPERTY_TYPES = {'State': dbus.String,
+                      'Connected': dbus.Boolean,
+                      'Playing': dbus.Boolean}
+
     def __init__(self, *args, **kwargs):
         BTGenericDevice.__init__(self, addr='org.bluez.AudioSink',
                                  *args, **kwargs)
@@ -145,7 +175,8 @@ class SBCAudioCodec(GenericEndpoint):
 
     * Populates `properties` with the capabilities of the codec.
     * `SelectConfiguration`: computes and returns best SBC codec
-        configuration parameters based on device capabilities
+        configuration parameters based on device capabilities, as
+        chosen by the endpoint's :py:class:`.SBCNegotiationPolicy`
     * `SetConfiguration`: a sub-class notifier function is called
     * `ClearConfiguration`: nothing is done
     * `Release`: nothing
@@ -159,8 +190,11 @@ class SBCAudioCodec(GenericEndpoint):
     properly synchronized.
 
     See also: :py:class:`SBCAudioSink` and :py:class:`SBCAudioSource`
+
+    :param policy: Optional :py:class:`.SBCNegotiationPolicy`.  The
+        default policy optimizes for quality.
     """
-    def __init__(self, uuid, path):
+    def __init__(self, uuid, path, policy=None):
         config = SBCCodecConfig(SBCChannelMode.ALL,
                                 SBCSamplingFrequency.ALL,
                                 SBCAllocationMethod.ALL,
@@ -173,6 +207,10 @@ class SBCAudioCodec(GenericEndpoint):
         delayed_reporting = dbus.Boolean(True)
         self.tag = None
         self.path = None
+        self.config = None
+        self.policy = policy or SBCNegotiationPolicy()
+        self._transport = None
+        self._event_loop = None
         self.user_cb = None
         self.user_arg = None
         self.properties = dbus.Dictionary({'UUID': uuid,
@@ -190,7 +228,24 @@ class SBCAudioCodec(GenericEndpoint):
             self.user_cb(self.user_arg)
         return True
 
+    def _loop_transport_ready_handler(self):
+        """
+        As above but called from an asyncio event loop
+        """
+        if(self.user_cb):
+            self.user_cb(self.user_arg)
+
     def _install_transport_ready(self):
+        if (self._event_loop):
+            if ('r' in self.access_type):
+                watch = self._event_loop.add_reader
+            else:
+                watch = self._event_loop.add_writer
+            self.tag = (self.fd, 'r' in self.access_type)
+            self._event_loop.call_soon_threadsafe(
+                watch, self.fd, self._loop_transport_ready_handler)
+            return
+
         if ('r' in self.access_type):
             io_event = gobject.IO_IN
         else:
@@ -200,10 +255,34 @@ class SBCAudioCodec(GenericEndpoint):
                                         self._transport_ready_handler)
 
     def _uninstall_transport_ready(self):
-        if (self.tag):
+        if (self.tag and self._event_loop):
+            (fd, reading) = self.tag
+            if (reading):
+                unwatch = self._event_loop.remove_reader
+            else:
+                unwatch = self._event_loop.remove_writer
+            self._event_loop.call_soon_threadsafe(unwatch, fd)
+            self.tag = None
+        elif (self.tag):
             gobject.source_remove(self.tag)
             self.tag = None
 
+    def set_event_loop(self, loop):
+        """
+        Drive transport ready events from an asyncio (trollius) event
+        loop using its `add_reader` or `add_writer` methods, in place of
+        a GLib IO watch.  The user callback registered with
+        :py:meth:`register_transport_ready_event` is then called on the
+        event loop's thread.  This must be set before the media
+        transport is acquired.
+
+        See also: :py:mod:`bt_manager.aio`
+
+        :param loop: asyncio event loop, or `None` to use GLib
+        :return:
+        """
+        self._event_loop = loop
+
     def register_transport_ready_event(self, user_cb, user_arg):
         """
         Register for transport ready events.  The `transport ready`
@@ -243,12 +322,28 @@ class SBCAudioCodec(GenericEndpoint):
 
         :return data: Payload data that has been decoded,
             with RTP encapsulation removed.
-        :rtype: array{byte}
+        :rtype: bytes
         """
         if ('r' not in self.access_type):
             raise BTIncompatibleTransportAccessType
         return self.codec.decode(self.fd, self.read_mtu)
 
+    def read_transport_into(self, buf):
+        """
+        Read data from media transport directly into a
+        caller-owned buffer.  The data is SBC decoded and
+        has all RTP encapsulation removed.
+
+        :param buf: Writable object supporting the buffer
+            protocol e.g., bytearray, memoryview or a slot in
+            a ring buffer.
+        :return: Number of decoded bytes written to `buf`
+        :rtype: int
+        """
+        if ('r' not in self.access_type):
+            raise BTIncompatibleTransportAccessType
+        return self.codec.decode_into(self.fd, self.read_mtu, buf)
+
     def write_transport(self, data):
         """
         Write data to media transport.  The data is
@@ -256,13 +351,80 @@ class SBCAudioCodec(GenericEndpoint):
         before being written to the transport file
         descriptor.
 
-        :param array{byte} data: Payload data to encode,
-            encapsulate and send.
+        :param data: Payload data to encode, encapsulate and
+            send.  Any object supporting the buffer protocol is
+            encoded in place without an intermediate copy.
+        :return: Number of bytes of `data` consumed.  Any
+            partial codesize tail is not consumed and should be
+            passed again with the next call.
+        :rtype: int
         """
         if ('w' not in self.access_type):
             raise BTIncompatibleTransportAccessType
         return self.codec.encode(self.fd, self.write_mtu, data)
 
+    def write_transport_batched(self, data, max_packets=16):
+        """
+        Write data to media transport, queueing up to
+        `max_packets` RTP packets within the codec and sending
+        them with a single system call per transport ready
+        event.  Packets the transport is not ready to accept
+        remain queued and are sent first on the next call.
+        See :py:meth:`.SBCCodec.encode_batch`
+
+        :param data: Payload data to encode, encapsulate and
+            send.
+        :param int max_packets: Optional.  Maximum number of
+            packets to queue.
+        :return: Number of bytes of `data` consumed.  Any
+            data not consumed should be passed again with the
+            next call.
+        :rtype: int
+        """
+        if ('w' not in self.access_type):
+            raise BTIncompatibleTransportAccessType
+        return self.codec.encode_batch(self.fd, self.write_mtu, data,
+                                       max_packets)
+
+    def read_transport_async(self, pool, user_cb, user_arg=None):
+        """
+        Read data from media transport on a worker thread of
+        a codec pool.  See :py:meth:`read_transport`
+
+        :param pool: :py:class:`.SBCCodecPool` to run the job on
+        :param func user_cb: Callback called on the worker thread
+            as `user_cb(user_arg, job)` once the decoded data is
+            available as `job.result`
+        :param user_arg: Optional user-defined callback argument
+        :return: The submitted job
+        :rtype: :py:class:`.SBCCodecJob`
+        """
+        if ('r' not in self.access_type):
+            raise BTIncompatibleTransportAccessType
+        return pool.decode(self.codec, self.fd, self.read_mtu,
+                           user_cb=user_cb, user_arg=user_arg)
+
+    def write_transport_async(self, pool, data, user_cb=None,
+                              user_arg=None):
+        """
+        Write data to media transport on a worker thread of
+        a codec pool.  See :py:meth:`write_transport`
+
+        :param pool: :py:class:`.SBCCodecPool` to run the job on
+        :param data: Payload data to encode, encapsulate and
+            send.  It must not be modified until the job completes.
+        :param func user_cb: Optional callback called on the worker
+            thread as `user_cb(user_arg, job)` once the data has
+            been sent.  `job.result` is the number of bytes consumed.
+        :param user_arg: Optional user-defined callback argument
+        :return: The submitted job
+        :rtype: :py:class:`.SBCCodecJob`
+        """
+        if ('w' not in self.access_type):
+            raise BTIncompatibleTransportAccessType
+        return pool.encode(self.codec, self.fd, self.write_mtu, data,
+                           user_cb=user_cb, user_arg=user_arg)
+
     def close_transport(self):
         """
         Forcibly close previously acquired media transport.
@@ -287,8 +449,9 @@ class SBCAudioCodec(GenericEndpoint):
         Should be called by subclass when it is ready
         to acquire the media transport file descriptor
         """
-        transport = BTMediaTransport(path=path)
+        transport = registry.get_wrapper(BTMediaTransport, path, path=path)
         (fd, read_mtu, write_mtu) = transport.acquire(access_type)
+        self._transport = transport
         self.fd = fd.take()   # We must do the clean-up later
         self.write_mtu = write_mtu
         self.read_mtu = read_mtu
@@ -304,50 +467,18 @@ class SBCAudioCodec(GenericEndpoint):
         try:
             self._uninstall_transport_ready()
             os.close(self.fd)   # Clean-up previously taken fd
-            transport = BTMediaTransport(path=path)
+            transport = self._transport
+            self._transport = None
+            if (transport is None):
+                transport = registry.get_wrapper(BTMediaTransport, path,
+                                                 path=path)
             transport.release(access_type)
         except:
             pass
 
     @staticmethod
     def _default_bitpool(frequency, channel_mode):
-        if (frequency ==
-                SBCSamplingFrequency.FREQ_16KHZ or
-            frequency ==
-                SBCSamplingFrequency.FREQ_32KHZ):
-            return 53
-        elif (frequency ==
-                SBCSamplingFrequency.FREQ_44_1KHZ):
-            if (channel_mode ==
-                    SBCChannelMode.CHANNEL_MODE_MONO or
-                channel_mode ==
-                    SBCChannelMode.CHANNEL_MODE_DUAL):
-                return 31
-            elif (channel_mode ==
-                    SBCChannelMode.CHANNEL_MODE_STEREO or
-                  channel_mode ==
-                    SBCChannelMode.CHANNEL_MODE_JOINT_STEREO):
-                return 53
-            else:
-                # TODO: Invalid channel_mode
-                return 53
-        elif (frequency == SBCSamplingFrequency.FREQ_48KHZ):
-            if (channel_mode ==
-                    SBCChannelMode.CHANNEL_MODE_MONO or
-                channel_mode ==
-                    SBCChannelMode.CHANNEL_MODE_DUAL):
-                return 29
-            elif (channel_mode ==
-                    SBCChannelMode.CHANNEL_MODE_STEREO or
-                  channel_mode ==
-                    SBCChannelMode.CHANNEL_MODE_JOINT_STEREO):
-                return 51
-            else:
-                # TODO: Invalid channel_mode
-                return 51
-        else:
-            # TODO: Invalid frequency
-            return 53
+        return default_bitpool(frequency, channel_mode)
 
     @staticmethod
     def _make_config(config):
@@ -399,70 +530,10 @@ class SBCAudioCodec(GenericEndpoint):
     def SelectConfiguration(self, caps):
         our_caps = SBCAudioCodec._parse_config(self.properties['Capabilities'])
         device_caps = SBCAudioCodec._parse_config(caps)
-        frequency = SBCSamplingFrequency.FREQ_44_1KHZ
-
-        if ((our_caps.channel_mode & device_caps.channel_mode) &
-                SBCChannelMode.CHANNEL_MODE_JOINT_STEREO):
-            channel_mode = SBCChannelMode.CHANNEL_MODE_JOINT_STEREO
-        elif ((our_caps.channel_mode & device_caps.channel_mode) &
-              SBCChannelMode.CHANNEL_MODE_STEREO):
-            channel_mode = SBCChannelMode.CHANNEL_MODE_STEREO
-        elif ((our_caps.channel_mode & device_caps.channel_mode) &
-              SBCChannelMode.CHANNEL_MODE_DUAL):
-            channel_mode = SBCChannelMode.CHANNEL_MODE_DUAL
-        elif ((our_caps.channel_mode & device_caps.channel_mode) &
-              SBCChannelMode.CHANNEL_MODE_MONO):
-            channel_mode = SBCChannelMode.CHANNEL_MODE_MONO
-        else:
-            raise BTInvalidConfiguration
-
-        if ((our_caps.block_length & device_caps.block_length) &
-                SBCBlocks.BLOCKS_16):
-            block_length = SBCBlocks.BLOCKS_16
-        elif ((our_caps.block_length & device_caps.block_length) &
-              SBCBlocks.BLOCKS_12):
-            block_length = SBCBlocks.BLOCKS_12
-        elif ((our_caps.block_length & device_caps.block_length) &
-              SBCBlocks.BLOCKS_8):
-            block_length = SBCBlocks.BLOCKS_8
-        elif ((our_caps.block_length & device_caps.block_length) &
-              SBCBlocks.BLOCKS_4):
-            block_length = SBCBlocks.BLOCKS_4
-        else:
-            raise BTInvalidConfiguration
-
-        if ((our_caps.subbands & device_caps.subbands) &
-                SBCSubbands.SUBBANDS_8):
-            subbands = SBCSubbands.SUBBANDS_8
-        elif ((our_caps.subbands & device_caps.subbands) &
-              SBCSubbands.SUBBANDS_4):
-            subbands = SBCSubbands.SUBBANDS_4
-        else:
-            raise BTInvalidConfiguration
-
-        if ((our_caps.allocation_method & device_caps.allocation_method) &
-                SBCAllocationMethod.LOUDNESS):
-            allocation_method = SBCAllocationMethod.LOUDNESS
-        elif ((our_caps.allocation_method & device_caps.allocation_method) &
-              SBCAllocationMethod.SNR):
-            allocation_method = SBCAllocationMethod.SNR
-        else:
-            raise BTInvalidConfiguration
-
-        min_bitpool = max(our_caps.min_bitpool, device_caps.min_bitpool)
-        max_bitpool = min(SBCAudioCodec._default_bitpool(frequency,
-                                                         channel_mode),
-                          device_caps.max_bitpool)
-
-        selected_config = SBCCodecConfig(channel_mode,
-                                         frequency,
-                                         allocation_method,
-                                         subbands,
-                                         block_length,
-                                         min_bitpool,
-                                         max_bitpool)
+        selected_config = self.policy.select(our_caps, device_caps)
 
         # Create SBC codec based on selected configuration
+        self.config = selected_config
         self.codec = SBCCodec(selected_config)
 
         dbus_val = SBCAudioCodec._make_config(selected_config)
@@ -489,9 +560,31 @@ class SBCAudioSink(SBCAudioCodec):
     endpoint steps
     """
     def __init__(self,
-                 path='/endpoint/a2dpsink'):
+                 path='/endpoint/a2dpsink', policy=None):
         uuid = dbus.String(SERVICES['AudioSink'].uuid)
-        SBCAudioCodec.__init__(self, uuid, path)
+        SBCAudioCodec.__init__(self, uuid, path, policy)
+
+    def pcm_sink(self, block_time=0.05, max_queue=32):
+        """
+        Create a pipeline which reads and decodes the media transport
+        on an I/O thread of its own and hands the PCM to consumers, in
+        place of reading from transport ready events.  The transport
+        ready IO watch is removed since the pipeline waits for data
+        itself.  The media transport must have been acquired.
+
+        See also: :py:class:`.PCMSinkPipeline`
+
+        :param float block_time: Duration of each PCM block in seconds
+        :param int max_queue: Maximum number of blocks queued per
+            consumer
+        :return: The pipeline, yet to be started
+        :rtype: :py:class:`.PCMSinkPipeline`
+        """
+        if ('r' not in self.access_type):
+            raise BTIncompatibleTransportAccessType
+        self._uninstall_transport_ready()
+        return PCMSinkPipeline(self.codec, self.fd, self.read_mtu,
+                               self.config, block_time, max_queue)
 
     def _property_change_event_handler(self, signal, transport, *args):
         """
@@ -529,9 +622,34 @@ class SBCAudioSource(SBCAudioCodec):
     endpoint steps
     """
     def __init__(self,
-                 path='/endpoint/a2dpsource'):
+                 path='/endpoint/a2dpsource', policy=None):
         uuid = dbus.String(SERVICES['AudioSource'].uuid)
-        SBCAudioCodec.__init__(self, uuid, path)
+        SBCAudioCodec.__init__(self, uuid, path, policy)
+
+    def pcm_source(self, buffer_time=0.2, max_packets=4, controller=None):
+        """
+        Create a pipeline which sends PCM from a producer to the media
+        transport at the real time rate of the stream, in place of
+        writing from transport ready events.  The transport ready IO
+        watch is removed since the pipeline paces itself.  The media
+        transport must have been acquired.
+
+        See also: :py:class:`.PCMSourcePipeline`
+
+        :param float buffer_time: Size of the PCM ring buffer in seconds
+        :param int max_packets: Maximum number of packets queued for
+            the transport
+        :param controller: Optional :py:class:`.SBCBitpoolController`
+            adapting the bitpool to the link
+        :return: The pipeline, yet to be started
+        :rtype: :py:class:`.PCMSourcePipeline`
+        """
+        if ('w' not in self.access_type):
+            raise BTIncompatibleTransportAccessType
+        self._uninstall_transport_ready()
+        return PCMSourcePipeline(self.codec, self.fd, self.write_mtu,
+                                 self.config, buffer_time, max_packets,
+                                 controller=controller)
 
     def _property_change_event_handler(self, signal, transport, *args):
         """
@@ -0,0 +1,208 @@
+from __future__ import unicode_literals
+
+from collections import namedtuple, deque
+import fcntl
+import struct
+import termios
+import time
+
+
+BitpoolChange = namedtuple('BitpoolChange', 'time old new delay reason')
+"""
+Named tuple describing one bitpool change made by a
+:py:class:`SBCBitpoolController`.  ``delay`` is the transport queue
+delay in seconds which caused it and ``reason`` is either
+:py:attr:`SBCBitpoolController.CONGESTED` or
+:py:attr:`SBCBitpoolController.RECOVERED`.
+"""
+
+BitpoolStats = namedtuple('BitpoolStats',
+                          'bitpool min_bitpool max_bitpool samples delay '
+                          'max_delay lowered raised')
+"""
+Named tuple collection of bitpool controller counters as returned by
+:py:meth:`SBCBitpoolController.stats`
+"""
+
+
+class SBCBitpoolController:
+    """
+    Adapts the bitpool of an SBC source to the capacity of its link.
+
+    Each :py:meth:`update` samples how much encoded audio is waiting to
+    be sent, being the bytes held in the transport socket's send
+    buffer (``SIOCOUTQ``) plus the packets queued by the codec, and
+    converts it to a queue delay at the current bit rate.  A delay of
+    at least `high_delay` for `hold` consecutive samples means the link
+    is congested, and the bitpool is lowered by `step_down`.  A delay
+    of at most `low_delay` for `recover` consecutive samples means it
+    has recovered, and the bitpool is raised by `step_up`.  Between
+    the two thresholds the bitpool is left alone.  It is kept within
+    the negotiated minimum and maximum.
+
+    The bitpool is changed with :py:meth:`.SBCCodec.set_bitpool` rather
+    than by reinitialising the codec, so no frames are dropped and the
+    sink follows the change from the frame headers.
+
+    :py:meth:`update` should be called from the thread encoding with
+    the codec, e.g., once per packet.  :py:class:`.PCMSourcePipeline`
+    does so when given a controller::
+
+        controller = SBCBitpoolController(source.codec, source.fd,
+                                          source.config)
+        controller.register_change_event(show_change, None)
+        pipeline = source.pcm_source(controller=controller)
+
+    :param codec: :py:class:`.SBCCodec` encoding the stream
+    :param int fd: Media transport file descriptor
+    :param namedtuple config: Negotiated :py:class:`.SBCCodecConfig`
+    :param float high_delay: Queue delay in seconds above which the
+        link is congested
+    :param float low_delay: Queue delay in seconds below which the
+        link has recovered
+    :param int hold: Consecutive congested samples before lowering
+    :param int recover: Consecutive recovered samples before raising
+    :param int step_down: Amount by which the bitpool is lowered
+    :param int step_up: Amount by which the bitpool is raised
+    :param int history: Number of changes kept by :py:meth:`changes`
+    """
+
+    CONGESTED = 'congested'
+    """The bitpool was lowered as the queue delay was high"""
+    RECOVERED = 'recovered'
+    """The bitpool was raised as the queue delay was low"""
+
+    def __init__(self, codec, fd, config, high_delay=0.1, low_delay=0.02,
+                 hold=3, recover=50, step_down=4, step_up=1, history=32):
+        self.codec = codec
+        self.fd = fd
+        self.min_bitpool = config.min_bitpool
+        self.max_bitpool = config.max_bitpool
+        self.high_delay = high_delay
+        self.low_delay = low_delay
+        self.hold = hold
+        self.recover = recover
+        self.step_down = step_down
+        self.step_up = step_up
+        self.user_cb = None
+        self.user_arg = None
+        self._history = deque(maxlen=history)
+        self._congested = 0
+        self._recovered = 0
+        self._samples = 0
+        self._delay = 0.0
+        self._max_delay = 0.0
+        self._lowered = 0
+        self._raised = 0
+
+    @property
+    def bitpool(self):
+        """
+        Current bitpool
+        """
+        return self.codec.config.bitpool
+
+    def _socket_queued(self):
+        try:
+            out = fcntl.ioctl(self.fd, termios.TIOCOUTQ, b'\0' * 4)
+            return struct.unpack(b'i', out)[0]
+        except IOError:
+            # Not a socket, e.g., a pipe in place of the transport
+            return 0
+
+    def queue_delay(self):
+        """
+        :return: Seconds of encoded audio waiting to be sent on the
+            transport at the current bit rate
+        :rtype: float
+        """
+        queued = self._socket_queued() + \
+            self.codec._tx_end - self.codec._tx_start
+        rate = self.codec.frame_length / self.codec.frame_duration
+        return queued / rate
+
+    def update(self):
+        """
+        Sample the transport queue delay and step the bitpool if the
+        link has been congested or recovered for long enough.
+
+        :return: The change made, or `None`
+        :rtype: :py:class:`BitpoolChange`
+        """
+        delay = self.queue_delay()
+        self._samples += 1
+        self._delay = delay
+        self._max_delay = max(self._max_delay, delay)
+        if (delay >= self.high_delay):
+            self._congested += 1
+            self._recovered = 0
+        elif (delay <= self.low_delay):
+            self._recovered += 1
+            self._congested = 0
+        else:
+            self._congested = 0
+            self._recovered = 0
+        bitpool = self.bitpool
+        if (self._congested >= self.hold and bitpool > self.min_bitpool):
+            self._lowered += 1
+            return self._set(max(bitpool - self.step_down, self.min_bitpool),
+                             delay, SBCBitpoolController.CONGESTED)
+        if (self._recovered >= self.recover and
+                bitpool < self.max_bitpool):
+            self._raised += 1
+            return self._set(min(bitpool + self.step_up, self.max_bitpool),
+                             delay, SBCBitpoolController.RECOVERED)
+
+    def _set(self, bitpool, delay, reason):
+        change = BitpoolChange(time.time(), self.bitpool, bitpool, delay,
+                               reason)
+        self.codec.set_bitpool(bitpool)
+        self._congested = 0
+        self._recovered = 0
+        self._history.append(change)
+        if (self.user_cb):
+            self.user_cb(self.user_arg, change)
+        return change
+
+    def register_change_event(self, user_cb, user_arg):
+        """
+        Register for bitpool change events.  The user callback is
+        called as `user_cb(user_arg, change)` on the thread calling
+        :py:meth:`update`, with a :py:class:`BitpoolChange`.
+
+        :param func user_cb: User defined callback function
+        :param user_arg: User defined callback argument
+        :return:
+
+        See also: :py:meth:`unregister_change_event`
+        """
+        self.user_cb = user_cb
+        self.user_arg = user_arg
+
+    def unregister_change_event(self):
+        """
+        Unregister previously registered bitpool change events.
+
+        See also: :py:meth:`register_change_event`
+        """
+        self.user_cb = None
+
+    def changes(self):
+        """
+        :return: The most recent bitpool changes, oldest first
+        :rtype: list
+        """
+        return list(self._history)
+
+    def stats(self):
+        """
+        Obtain bitpool controller counters.
+
+        :return: the current, minimum and maximum bitpool, the number
+            of samples taken, the last and largest queue delay and the
+            number of times the bitpool was lowered and raised
+        :rtype: :py:class:`BitpoolStats`
+        """
+        return BitpoolStats(self.bitpool, self.min_bitpool,
+                            self.max_bitpool, self._samples, self._delay,
+                            self._max_delay, self._lowered, self._raised)
@@ -0,0 +1,273 @@
+from __future__ import unicode_literals
+
+from collections import namedtuple, deque
+import os
+
+from codecs import SBCCodec, _load_rtpsbc
+
+
+BroadcastStats = namedtuple('BroadcastStats',
+                            'encoders members consumed packets')
+"""
+Named tuple collection of broadcast group counters as returned by
+:py:meth:`SBCBroadcastGroup.stats`.  ``consumed`` is the number of PCM
+bytes encoded by each encoder in total and ``packets`` the number of
+RTP packets they produced.
+"""
+
+BroadcastMemberStats = namedtuple('BroadcastMemberStats',
+                                  'queued sent dropped failed')
+"""
+Named tuple collection of broadcast member counters as returned by
+:py:meth:`SBCBroadcastMember.stats`
+"""
+
+# Most packets handed to the kernel by one rtp_sbc_send_packets() call
+_MAX_BATCH = 64
+
+
+class SBCBroadcastMember:
+    """
+    One media transport receiving the packets of a
+    :py:class:`SBCBroadcastGroup`, with its own bounded send queue.
+    Members are created by :py:meth:`SBCBroadcastGroup.add` and
+    :py:meth:`SBCBroadcastGroup.add_endpoint`.
+
+    :Attributes:
+
+    * **fd(int)**: Media transport file descriptor
+    * **mtu(int)**: Media transport write MTU
+    * **config(namedtuple)**: Negotiated :py:class:`.SBCCodecConfig`
+    * **error(OSError)**: Error which stopped sending to the member,
+        otherwise `None`
+    """
+    def __init__(self, fd, mtu, config, max_queue):
+        self.fd = fd
+        self.mtu = mtu
+        self.config = config
+        self.max_queue = max_queue
+        self.error = None
+        self._queue = deque()
+        self._offset = 0
+        self._sent = 0
+        self._dropped = 0
+
+    def _put(self, packets):
+        if (self.error):
+            return
+        self._queue.extend(packets)
+        while (len(self._queue) > self.max_queue):
+            if (self._offset):
+                # Keep the partly written packet at the head
+                head = self._queue.popleft()
+                self._queue.popleft()
+                self._queue.appendleft(head)
+            else:
+                self._queue.popleft()
+            self._dropped += 1
+
+    def _flush(self, ffi, lib):
+        if (self.error or not self._queue):
+            return 0
+        packets = [self._queue[i] for i in
+                   range(min(len(self._queue), _MAX_BATCH))]
+        packets[0] = packets[0][self._offset:]
+        lengths = [len(p) for p in packets]
+        buf = b''.join(packets)
+        sent = lib.rtp_sbc_send_packets(self.fd, ffi.from_buffer(buf),
+                                        lengths, len(lengths))
+        if (sent < 0):
+            self.error = OSError(-sent, os.strerror(-sent))
+            self._dropped += len(self._queue)
+            self._queue.clear()
+            return 0
+        count = 0
+        for length in lengths:
+            if (sent < length):
+                break
+            sent -= length
+            self._queue.popleft()
+            self._offset = 0
+            count += 1
+        self._offset += sent
+        self._sent += count
+        return count
+
+    def stats(self):
+        """
+        Obtain member counters.
+
+        :return: the number of packets queued for the member, sent to
+            it and dropped, either because its queue overflowed or it
+            failed, and whether sending to the member failed
+        :rtype: :py:class:`BroadcastMemberStats`
+        """
+        return BroadcastMemberStats(len(self._queue), self._sent,
+                                    self._dropped, self.error is not None)
+
+
+class _BroadcastEncoder:
+    """
+    Encoder shared by all members with the same configuration
+    """
+    def __init__(self, config):
+        self.codec = SBCCodec(config)
+        self.members = []
+        self.tail = bytearray()
+        self.consumed = 0
+        self.packets = 0
+
+    def encode(self, data):
+        mtu = min(m.mtu for m in self.members)
+        self.tail.extend(data)
+        out = bytearray(16 * mtu)
+        view = memoryview(self.tail)
+        offset = 0
+        packets = []
+        while (len(self.tail) - offset >= self.codec.codesize):
+            (consumed, lengths) = self.codec.encode_to_buffer(
+                mtu, view[offset:], out, 16)
+            if (not lengths):
+                break
+            offset += consumed
+            start = 0
+            for length in lengths:
+                packets.append(bytes(out[start:start + length]))
+                start += length
+        del view
+        del self.tail[:offset]
+        self.consumed += offset
+        self.packets += len(packets)
+        return packets
+
+
+class SBCBroadcastGroup:
+    """
+    Plays one PCM program to many A2DP sinks, encoding it once for
+    every distinct negotiated configuration rather than once per sink.
+
+    Members which negotiated the same :py:class:`.SBCCodecConfig`
+    share one :py:class:`.SBCCodec` whose RTP packets are written to
+    each of their transports.  The shared encoder packetizes for the
+    smallest MTU among its members.  Members with another configuration
+    are grouped under a further encoder.
+
+    Every member has its own bounded send queue, and packets are sent
+    without blocking, so a stalled speaker only fills and then drops
+    from its own queue.  A member whose transport fails is stopped
+    without affecting the others.
+
+    For example, to play a file to all connected sources::
+
+        group = SBCBroadcastGroup()
+        for source in sources:
+            group.add_endpoint(source)
+        while True:
+            group.write(pcm.read(4096))
+
+    The group should be fed at the real time rate of the program,
+    e.g., from a transport ready event or a clock, and
+    :py:meth:`flush` may be called in between to retry queued packets.
+
+    :param int max_queue: Maximum number of packets queued per member
+    """
+    def __init__(self, max_queue=32):
+        self.max_queue = max_queue
+        (self._ffi, self._lib) = _load_rtpsbc()
+        self._encoders = {}
+
+    def add(self, fd, mtu, config):
+        """
+        Add a media transport to the group.
+
+        :param int fd: Media transport file descriptor, acquired for
+            writing
+        :param int mtu: Media transport write MTU
+        :param namedtuple config: Negotiated configuration.  See
+            :py:class:`.SBCCodecConfig`
+        :return: the new member
+        :rtype: :py:class:`SBCBroadcastMember`
+        """
+        encoder = self._encoders.get(config)
+        if (encoder is None):
+            encoder = self._encoders[config] = _BroadcastEncoder(config)
+        member = SBCBroadcastMember(fd, mtu, config, self.max_queue)
+        encoder.members.append(member)
+        return member
+
+    def add_endpoint(self, endpoint):
+        """
+        Add an :py:class:`.SBCAudioSource` endpoint whose media
+        transport has been acquired.
+
+        :param endpoint: Audio source endpoint
+        :return: the new member
+        :rtype: :py:class:`SBCBroadcastMember`
+        """
+        return self.add(endpoint.fd, endpoint.write_mtu, endpoint.config)
+
+    def remove(self, member):
+        """
+        Remove a member from the group, discarding its queued packets.
+        An encoder is discarded along with its last member.
+
+        :param member: Member returned by :py:meth:`add`
+        :return:
+        """
+        encoder = self._encoders.get(member.config)
+        if (encoder and member in encoder.members):
+            encoder.members.remove(member)
+            if (not encoder.members):
+                del self._encoders[member.config]
+
+    def members(self):
+        """
+        :return: all members of the group
+        :rtype: list
+        """
+        return [m for e in self._encoders.values() for m in e.members]
+
+    def write(self, data):
+        """
+        Encode PCM data once per configuration, queue the packets for
+        every member and send as many as each transport accepts.
+        Data short of a whole SBC frame is kept and encoded with the
+        next call.
+
+        :param data: PCM data.  Any object supporting the buffer
+            protocol.
+        :return: Number of packets sent
+        :rtype: int
+        """
+        for encoder in self._encoders.values():
+            packets = encoder.encode(data)
+            for member in encoder.members:
+                member._put(packets)
+        return self.flush()
+
+    def flush(self):
+        """
+        Send queued packets to every member without blocking.
+
+        :return: Number of packets sent
+        :rtype: int
+        """
+        sent = 0
+        for encoder in self._encoders.values():
+            for member in encoder.members:
+                sent += member._flush(self._ffi, self._lib)
+        return sent
+
+    def stats(self):
+        """
+        Obtain group counters.
+
+        :return: the number of encoders and members, the number of PCM
+            bytes encoded and the number of RTP packets produced
+        :rtype: :py:class:`BroadcastStats`
+        """
+        encoders = self._encoders.values()
+        return BroadcastStats(len(encoders),
+                              sum(len(e.members) for e in encoders),
+                              sum(e.consumed for e in encoders),
+                              sum(e.packets for e in encoders))
@@ -1,6 +1,50 @@
 from __future__ import unicode_literals
 from collections import namedtuple
-from bt_manager import ffi
+import audioop
+import multiprocessing
+import random
+import struct
+import threading
+import time
+import traceback
+import weakref
+import Queue
+import cffi
+import os
+
+_rtpsbc = None
+_rtpsbc_lock = threading.Lock()
+
+
+def _load_rtpsbc():
+    """
+    Load the RTP/SBC codec bindings exactly once per process.
+
+    The precompiled ``bt_manager._rtpsbc`` extension module built by
+    setup.py is preferred.  If it is not available (e.g., when running
+    from a source checkout) the bindings are instead compiled on the fly
+    using `ffi.verify()`, but still only once per process.
+
+    :return: A tuple of the form (ffi, lib) shared by all codec instances
+    :rtype: tuple
+    """
+    global _rtpsbc
+    with _rtpsbc_lock:
+        if (_rtpsbc is None):
+            try:
+                from bt_manager._rtpsbc import ffi, lib
+            except ImportError:
+                ffi = cffi.FFI()
+                header_file = os.path.join(os.path.dirname(__file__),
+                                           'rtpsbc.h')
+                with open(header_file) as fh:
+                    ffi.cdef(fh.read())
+                lib = ffi.verify(b'#include "rtpsbc.h"',
+                                 libraries=[b'rtpsbc'],
+                                 ext_package=b'rtpsbc')
+            _rtpsbc = (ffi, lib)
+    return _rtpsbc
+
 
 A2DP_CODECS = {'SBC': 0x00,
                'MPEG12': 0x01,
@@ -19,6 +63,23 @@ SBCCodecConfig = namedtuple('SBCCodecConfig',
 Named tuple collection of SBC A2DP audio profile properties
 """
 
+RTPStreamStats = namedtuple('RTPStreamStats',
+                            'ssrc seq_num timestamp packets frames bytes '
+                            'fragments lost dropped frame_count_errors '
+                            'bitpool_changes timestamp_drift')
+"""
+Named tuple collection of RTP stream state and counters as returned
+by :py:meth:`SBCCodec.stats`
+"""
+
+JitterBufferStats = namedtuple('JitterBufferStats',
+                               'depth underruns late duplicates overflows '
+                               'concealed')
+"""
+Named tuple collection of jitter buffer counters as returned by
+:py:meth:`SBCJitterBuffer.stats`
+"""
+
 
 class SBCSamplingFrequency:
     """Indicates with which sampling frequency the SBC
@@ -84,29 +145,66 @@ class SBCCodec:
         the underlying C implementation requires separate
         `sbc_t` instances.
 
+    .. note:: The GIL is released for the duration of every
+        call into the C codec, including the blocking read or
+        write on the media transport, so codecs for different
+        endpoints may run concurrently on separate threads.
+        A single instance must not be used from more than one
+        thread at a time.  See :py:class:`SBCCodecPool`.
+
     :param namedtuple config: Media endpoint negotiated
         configuration parameters.  These are not used
         directly by the codec here but translated to
         parameters usable by the codec. See
         :py:class:`.SBCCodecConfig`
-    """
+    :param int ssrc: Optional.  RTP synchronization source
+        identifier of the encoded stream.  Random if not given.
+    :param int seq_num: Optional.  RTP sequence number of the
+        first packet encoded.  Random if not given.
+    :param int timestamp: Optional.  RTP timestamp of the first
+        packet encoded, in samples.  Random if not given.
 
-    def __init__(self, config):
+    :Attributes:
 
-        import sys
+    * **codesize(int)**: Number of PCM bytes consumed per
+        encoded SBC frame.
+    * **frame_length(int)**: Size in bytes of one encoded SBC
+        frame.
+    * **frame_duration(float)**: Duration in seconds of the audio
+        carried by one SBC frame.
+    """
 
-        try:
-            self.codec = ffi.verify(b'#include "rtpsbc.h"',
-                                    libraries=[b'rtpsbc'],
-                                    ext_package=b'rtpsbc')
-        except:
-            print 'Exception:', sys.exc_info()[0]
-
-        self.config = ffi.new('sbc_t *')
-        self.ts = ffi.new('unsigned int *', 0)
-        self.seq_num = ffi.new('unsigned int *', 0)
-        self._init_sbc_config(config)
+    def __init__(self, config, ssrc=None, seq_num=None, timestamp=None):
+
+        (self.ffi, self.codec) = _load_rtpsbc()
+        self.config = self.ffi.new('sbc_t *')
+        self.rtp = self.ffi.new('rtp_sbc_stream_t *')
+        self.rtp.ssrc = random.getrandbits(32) if ssrc is None else ssrc
+        self.rtp.seq_num = random.getrandbits(16) if seq_num is None \
+            else seq_num
+        self.rtp.ts = random.getrandbits(32) if timestamp is None \
+            else timestamp
+        self._rate = {SBCSamplingFrequency.FREQ_16KHZ: 16000,
+                      SBCSamplingFrequency.FREQ_32KHZ: 32000,
+                      SBCSamplingFrequency.FREQ_44_1KHZ: 44100,
+                      SBCSamplingFrequency.FREQ_48KHZ: 48000,
+                      }.get(config.frequency)
+        self._clock_start = None
+        # sbc_init() resets the sbc_t to its defaults, so it must be
+        # called before applying the negotiated configuration
         self.codec.sbc_init(self.config, 0)
+        self._init_sbc_config(config)
+        self.codesize = self.codec.sbc_get_codesize(self.config)
+        self.frame_length = self.codec.sbc_get_frame_length(self.config)
+        frame_samples = (8 if self.config.subbands == self.codec.SBC_SB_8
+                         else 4) * (4 + self.config.blocks * 4)
+        self.frame_duration = float(frame_samples) / self._rate \
+            if self._rate else 0.0
+        self._decode_buffer = None
+        self._tx_buffer = None
+        self._tx_start = 0
+        self._tx_end = 0
+        self._tx_lengths = []
 
     def _init_sbc_config(self, config):
         """
@@ -156,6 +254,30 @@ class SBCCodec:
         self.config.bitpool = config.max_bitpool
         self.config.endian = self.codec.SBC_LE
 
+    def _start_clock(self):
+        """
+        Note the wall clock time of the first packet of the
+        stream, against which the timestamp drift is measured.
+        """
+        if (self._clock_start is None):
+            self._clock_start = time.time()
+
+    def _input_buffer(self, data):
+        """
+        Helper to obtain a `char[]` view of the caller's data.
+        Objects supporting the buffer protocol are referenced in
+        place without copying.  Anything else (e.g., a list of
+        bytes) falls back to a copy.
+
+        :return: A tuple of the form (buffer, size_in_bytes)
+        :rtype: tuple
+        """
+        try:
+            buf = self.ffi.from_buffer(data)
+            return (buf, self.ffi.sizeof(buf))
+        except TypeError:
+            return (self.ffi.new('char[]', data), len(data))
+
     def encode(self, fd, mtu, data):
         """
         Encode the supplied data (byte array) and write to
@@ -164,21 +286,29 @@ class SBCCodec:
         required number of SBC frames and encapsulate as
         RTP to fit the MTU size.
 
+        Only whole multiples of :py:attr:`codesize` bytes are
+        encoded.  Any remaining tail is not consumed and should
+        be carried forward by the caller and prepended to the
+        data passed on the next call.
+
         :param int fd: Media transport file descriptor
         :param int mtu: Media transport MTU size as returned
             when the media transport was acquired.
-        :param array{byte} data: Data to encode and send
-            over the media transport.
-        :return:
-        """
-        self.codec.rtp_sbc_encode_to_fd(self.config,
-                                        ffi.new('char[]',
-                                                data),
-                                        len(data),
-                                        mtu,
-                                        self.ts,
-                                        self.seq_num,
-                                        fd)
+        :param data: Data to encode and send over the media
+            transport.  Any object supporting the buffer protocol
+            e.g., bytes, bytearray, memoryview, array.array or a
+            NumPy int16 array, is encoded without being copied.
+        :return: Number of bytes of `data` consumed.
+        :rtype: int
+        """
+        self._start_clock()
+        (buf, size) = self._input_buffer(data)
+        return self.codec.rtp_sbc_encode_to_fd(self.config,
+                                               buf,
+                                               size,
+                                               mtu,
+                                               self.rtp,
+                                               fd)
 
     def decode(self, fd, mtu, max_len=2560):
         """
@@ -188,18 +318,694 @@ class SBCCodec:
         be returned may be passed as an argument and all
         available bytes are returned to the caller.
 
+        The SBC frames are decoded into a scratch buffer
+        owned by the codec which is reused between calls.
+        Use :py:meth:`decode_into` to avoid the final copy
+        into the returned bytes.
+
+        Each RTP packet is read whole, up to `mtu` bytes, and
+        every frame is parsed from its own header, so the
+        source may change bitpool at any time.  Once some data
+        has been decoded, a packet whose frames would not fit
+        in the remaining space is left on the transport for
+        the next call, and the call returns rather than wait
+        for a packet which has not yet arrived.
+
         :param int fd: Media transport file descriptor
-        :param int mtu: Media transport MTU size as returned
-            when the media transport was acquired.
+        :param int mtu: Media transport read MTU size as
+            returned when the media transport was acquired.
         :param int max_len: Optional.  Set maximum number of
             bytes to read.
         :return data: Decoded data bytes as an array.
-        :rtype: array{byte}
+        :rtype: bytes
         """
-        output_buffer = ffi.new('char[]', max_len)
+        self._start_clock()
+        if (self._decode_buffer is None or
+                len(self._decode_buffer) < max_len):
+            self._decode_buffer = self.ffi.new('char[]', max_len)
         sz = self.codec.rtp_sbc_decode_from_fd(self.config,
-                                               output_buffer,
+                                               self._decode_buffer,
                                                max_len,
                                                mtu,
+                                               self.rtp,
                                                fd)
-        return ffi.buffer(output_buffer[0:sz])
+        return self.ffi.buffer(self._decode_buffer, sz)[:]
+
+    def decode_into(self, fd, mtu, buf):
+        """
+        Read the media transport descriptor, depay the RTP
+        payload and decode the SBC frames directly into a
+        caller-owned buffer.  No intermediate buffers are
+        allocated.  Packets are read as for :py:meth:`decode`
+
+        :param int fd: Media transport file descriptor
+        :param int mtu: Media transport read MTU size as
+            returned when the media transport was acquired.
+        :param buf: Writable object supporting the buffer
+            protocol e.g., bytearray, memoryview or NumPy array.
+            At most its size in bytes is decoded.
+        :return: Number of decoded bytes written to `buf`
+        :rtype: int
+        :raises TypeError: if `buf` is not a writable buffer
+        """
+        self._start_clock()
+        output_buffer = self.ffi.from_buffer(buf, require_writable=True)
+        return self.codec.rtp_sbc_decode_from_fd(self.config,
+                                                 output_buffer,
+                                                 self.ffi.sizeof(output_buffer),  # noqa
+                                                 mtu,
+                                                 self.rtp,
+                                                 fd)
+
+    def encode_to_buffer(self, mtu, data, buf, max_packets=None):
+        """
+        Encode the supplied data into complete RTP packets
+        written back-to-back into a caller-owned buffer rather
+        than to a media transport.  This allows encoding to be
+        done ahead of time, the packets to be sent to several
+        transports, or the codec to be exercised without a
+        bluetooth socket.
+
+        Packets are at most `mtu` bytes long and encoding stops
+        when either the data or the buffer is exhausted.  As
+        with :py:meth:`encode`, the RTP timestamp and sequence
+        number carry on from one call to the next.
+
+        :param int mtu: Media transport MTU size as returned
+            when the media transport was acquired.
+        :param data: Data to encode.  Any object supporting
+            the buffer protocol is encoded without being copied.
+        :param buf: Writable object supporting the buffer
+            protocol to receive the RTP packets.
+        :param int max_packets: Optional.  Maximum number of
+            packets to encode.
+        :return: A tuple of the form (consumed, packet_lengths)
+            giving the number of bytes of `data` consumed and
+            the length of each packet written to `buf`.
+        :rtype: tuple
+        :raises TypeError: if `buf` is not a writable buffer
+        """
+        self._start_clock()
+        (ip, ip_size) = self._input_buffer(data)
+        op = self.ffi.from_buffer(buf, require_writable=True)
+        # Every packet carries at least one frame, or one fragment
+        # of a frame too large for the MTU.  Fragments left over
+        # from the previous call are sent first.
+        payload = mtu - self.codec.RTP_SBC_HEADER_SIZE
+        frame_length = self.codec.sbc_get_frame_length(self.config)
+        fragments = max(-(-frame_length // payload), 1) if payload > 0 else 1
+        limit = (ip_size // self.codesize + 1) * fragments
+        if (max_packets is None or max_packets > limit):
+            max_packets = limit
+        packet_lens = self.ffi.new('size_t[]', max(max_packets, 1))
+        npackets = self.ffi.new('size_t *', 0)
+        consumed = self.codec.rtp_sbc_encode_to_buffer(self.config,
+                                                       ip,
+                                                       ip_size,
+                                                       mtu,
+                                                       self.rtp,
+                                                       op,
+                                                       self.ffi.sizeof(op),
+                                                       packet_lens,
+                                                       max_packets,
+                                                       npackets)
+        return (consumed, list(packet_lens[0:npackets[0]]))
+
+    def decode_from_buffer(self, data, buf, packet_lengths=None):
+        """
+        Depay and decode RTP packets held in memory, e.g.,
+        as produced by :py:meth:`encode_to_buffer`, into a
+        caller-owned buffer.
+
+        A packet is only decoded if all of its frames fit in
+        the remaining space of `buf`, so that any packets left
+        over may be passed again on the next call.
+
+        :param data: Object supporting the buffer protocol
+            holding one or more RTP packets back-to-back.
+        :param buf: Writable object supporting the buffer
+            protocol to receive the decoded data.
+        :param list packet_lengths: Optional.  The length of
+            each packet in `data`.  By default `data` is taken
+            to be a single packet.
+        :return: A tuple of the form (written, packets) giving
+            the number of decoded bytes written to `buf` and
+            the number of packets decoded.
+        :rtype: tuple
+        :raises TypeError: if `buf` is not a writable buffer
+        """
+        self._start_clock()
+        (ip, ip_size) = self._input_buffer(data)
+        if (packet_lengths is None):
+            packet_lengths = [ip_size]
+        if (sum(packet_lengths) > ip_size):
+            raise ValueError('packet lengths exceed the data size')
+        op = self.ffi.from_buffer(buf, require_writable=True)
+        decoded = self.ffi.new('size_t *', 0)
+        written = self.codec.rtp_sbc_decode_from_buffer(self.config,
+                                                        self.rtp,
+                                                        ip,
+                                                        packet_lengths,
+                                                        len(packet_lengths),
+                                                        op,
+                                                        self.ffi.sizeof(op),
+                                                        decoded)
+        return (written, decoded[0])
+
+    def set_marker(self):
+        """
+        Set the RTP marker bit on the next packet encoded
+        e.g., to flag the first packet after a period of
+        silence.
+        """
+        self.rtp.marker = 1
+
+    def set_bitpool(self, bitpool):
+        """
+        Change the bitpool of the frames encoded from now on,
+        e.g., to lower the bit rate while the link is congested.
+        The encoder carries its state over, so no frames are
+        dropped and the stream stays continuous.  The bitpool
+        should lie within the negotiated minimum and maximum.
+
+        :param int bitpool: New bitpool
+        """
+        self.config.bitpool = bitpool
+        self.frame_length = self.codec.sbc_get_frame_length(self.config)
+
+    def stats(self):
+        """
+        Get the RTP stream state and counters.  For an encoder
+        these describe the packets produced, with `seq_num` and
+        `timestamp` those of the next packet.  For a decoder
+        they describe the packets received, with `ssrc`,
+        `seq_num` and `timestamp` those of the last packet.
+
+        A decoder also counts the frames `dropped` for lack of
+        room in the output buffer, packets whose frame count
+        header disagrees with the frames they carry in
+        `frame_count_errors`, and `bitpool_changes` made by the
+        source mid-stream.
+
+        `timestamp_drift` is the audio time encoded or decoded
+        less the wall clock time elapsed since the first packet,
+        in seconds.  A stream being encoded faster than real
+        time drifts positive, while a source falling behind or
+        a sink losing packets drifts negative.
+
+        :return: Stream state and counters
+        :rtype: :py:class:`RTPStreamStats`
+        """
+        if (self._clock_start is None or not self._rate):
+            drift = 0.0
+        else:
+            drift = float(self.rtp.samples) / self._rate - \
+                (time.time() - self._clock_start)
+        if (self.rtp.started):
+            seq_num = (self.rtp.seq_num - 1) & 0xFFFF
+        else:
+            seq_num = self.rtp.seq_num
+        return RTPStreamStats(self.rtp.ssrc,
+                              seq_num,
+                              self.rtp.ts,
+                              self.rtp.packets,
+                              self.rtp.frames,
+                              self.rtp.bytes,
+                              self.rtp.fragments,
+                              self.rtp.lost,
+                              self.rtp.dropped,
+                              self.rtp.frame_count_errors,
+                              self.rtp.bitpool_changes,
+                              drift)
+
+    @property
+    def pending(self):
+        """
+        Number of RTP packets queued by :py:meth:`encode_batch`
+        which are yet to be sent.
+        """
+        return len(self._tx_lengths)
+
+    def _reserve_tx(self, size):
+        """
+        Make room for `size` bytes of packets at the end of
+        the transmit queue, moving any unsent packets to the
+        front of the queue buffer.
+        """
+        queued = self._tx_end - self._tx_start
+        if (self._tx_buffer is None or
+                len(self._tx_buffer) < queued + size):
+            tx_buffer = bytearray(queued + size)
+        else:
+            tx_buffer = self._tx_buffer
+        if (queued and (tx_buffer is not self._tx_buffer or
+                        self._tx_start)):
+            tx_buffer[0:queued] = self._tx_buffer[self._tx_start:
+                                                  self._tx_end]
+        self._tx_buffer = tx_buffer
+        self._tx_start = 0
+        self._tx_end = queued
+
+    def encode_batch(self, fd, mtu, data, max_packets=16):
+        """
+        Encode the supplied data into a queue of RTP packets
+        held by the codec, then flush as many of the queued
+        packets as the media transport accepts using a single
+        system call.  See :py:meth:`flush`.
+
+        At most `max_packets` packets are queued at once.
+        Once the queue is full no further data is consumed
+        until the transport has accepted some packets, so the
+        caller should carry the unconsumed data forward to
+        the next transport ready event, as with
+        :py:meth:`encode`.
+
+        :param int fd: Media transport file descriptor
+        :param int mtu: Media transport MTU size as returned
+            when the media transport was acquired.
+        :param data: Data to encode.  Any object supporting the
+            buffer protocol is encoded without being copied.
+        :param int max_packets: Optional.  Maximum number of
+            packets to hold in the queue.
+        :return: Number of bytes of `data` consumed.
+        :rtype: int
+        :raises OSError: if the media transport write fails
+        """
+        consumed = 0
+        free = max_packets - len(self._tx_lengths)
+        if (free > 0):
+            self._reserve_tx(free * mtu)
+            view = memoryview(self._tx_buffer)[self._tx_end:]
+            (consumed, lengths) = self.encode_to_buffer(mtu, data, view,
+                                                        free)
+            self._tx_end += sum(lengths)
+            self._tx_lengths.extend(lengths)
+        self.flush(fd)
+        return consumed
+
+    def flush(self, fd):
+        """
+        Send RTP packets queued by :py:meth:`encode_batch` to
+        the media transport.  Up to 64 packets are handed to
+        the kernel with a single ``sendmmsg()``, or ``writev()``
+        if `fd` is not a socket, without blocking.  Packets the
+        transport could not accept, including the remainder
+        of a packet only partly written to a stream, are kept
+        queued for the next call.
+
+        :param int fd: Media transport file descriptor
+        :return: Number of packets completely sent.
+        :rtype: int
+        :raises OSError: if the media transport write fails
+        """
+        if (not self._tx_lengths):
+            return 0
+        view = memoryview(self._tx_buffer)[self._tx_start:self._tx_end]
+        sent = self.codec.rtp_sbc_send_packets(fd,
+                                               self.ffi.from_buffer(view),
+                                               self._tx_lengths,
+                                               len(self._tx_lengths))
+        if (sent < 0):
+            raise OSError(-sent, os.strerror(-sent))
+        self._tx_start += sent
+        packets = 0
+        while (self._tx_lengths and sent >= self._tx_lengths[0]):
+            sent -= self._tx_lengths.pop(0)
+            packets += 1
+        if (sent):
+            self._tx_lengths[0] -= sent
+        if (not self._tx_lengths):
+            self._tx_start = self._tx_end = 0
+        return packets
+
+
+class SBCConcealment:
+    """How :py:class:`SBCJitterBuffer` fills in for missing packets"""
+    SILENCE = 0
+    REPEAT = 1
+    FADE = 2
+
+
+class SBCJitterBuffer:
+    """
+    Jitter buffer in front of an :py:class:`SBCCodec` used to
+    decode an A2DP sink stream.  RTP packets received from the
+    media transport are held and reordered by sequence number,
+    and decoded PCM is pulled from the buffer at the playback
+    rate.  Whenever the next packet is missing, concealment
+    audio of the same duration as the last packet is produced
+    instead so that the output stays continuous.
+
+    Output starts once `depth` packets are buffered, giving
+    packets that long to arrive out of order.  If the buffer
+    runs dry the underrun is concealed and output resumes once
+    `depth` packets are buffered again.  A packet is given up
+    for lost once the buffer is primed and a later packet is
+    available, and any packet arriving after its slot has been
+    played or concealed is dropped as late.
+
+    :param codec: :py:class:`SBCCodec` instance configured for
+        decoding.  It must not be used directly while the jitter
+        buffer is in use.
+    :param int depth: Optional.  Target buffer depth in packets.
+    :param int concealment: Optional.  See
+        :py:class:`SBCConcealment`.  With `FADE` the last packet
+        is repeated with a fade out over `fade_packets` packets,
+        followed by silence.
+    :param int fade_packets: Optional.  Number of packets over
+        which concealment fades out.
+    :param int max_depth: Optional.  Maximum number of packets
+        held, beyond which the oldest are dropped to catch up.
+        Defaults to four times `depth`.
+    """
+    def __init__(self, codec, depth=4, concealment=SBCConcealment.FADE,
+                 fade_packets=4, max_depth=None):
+        self.codec = codec
+        self.depth = depth
+        self.max_depth = max_depth or depth * 4
+        self.concealment = concealment
+        self.fade_packets = fade_packets
+        self._packets = {}
+        self._expected = None
+        self._primed = False
+        self._started = False
+        self._decode_buffer = bytearray(15 * codec.codesize)
+        self._last_pcm = None
+        self._concealed_run = 0
+        self._underruns = 0
+        self._late = 0
+        self._duplicates = 0
+        self._overflows = 0
+        self._concealed = 0
+
+    def put(self, packet):
+        """
+        Add a received RTP packet to the buffer.
+
+        :param bytes packet: Complete RTP packet.
+        :return: True if the packet was buffered, False if it
+            was dropped as late, duplicate or malformed.
+        :rtype: bool
+        """
+        if (len(packet) <= self.codec.codec.RTP_SBC_HEADER_SIZE):
+            return False
+        seq_num = struct.unpack_from(str('!H'), packet, 2)[0]
+        if (self._expected is None):
+            self._expected = seq_num
+        elif ((seq_num - self._expected) & 0xFFFF >= 0x8000):
+            # Until playback starts the stream may still begin earlier
+            if (self._started):
+                self._late += 1
+                return False
+            self._expected = seq_num
+        if (seq_num in self._packets):
+            self._duplicates += 1
+            return False
+        self._packets[seq_num] = packet
+        while (len(self._packets) > self.max_depth):
+            # Skip straight past the oldest packet held, however far
+            # ahead of the expected one it is
+            oldest = min(self._packets,
+                         key=lambda s: (s - self._expected) & 0xFFFF)
+            del self._packets[oldest]
+            self._overflows += 1
+            self._expected = (oldest + 1) & 0xFFFF
+        return True
+
+    def receive(self, fd, mtu):
+        """
+        Read one RTP packet from the media transport file
+        descriptor into the buffer.  Call this whenever the
+        transport is ready to read.
+
+        :param int fd: Media transport file descriptor
+        :param int mtu: Media transport read MTU size
+        :return: True if the packet was buffered.
+        :rtype: bool
+        """
+        packet = os.read(fd, mtu)
+        if (not packet):
+            return False
+        return self.put(packet)
+
+    def _conceal(self):
+        """
+        Produce audio standing in for one missing packet.
+        """
+        self._concealed_run += 1
+        if (self._last_pcm is None):
+            return b''
+        frames = len(self._last_pcm) // self.codec.codesize
+        self._concealed += frames
+        if (self.concealment == SBCConcealment.REPEAT):
+            return self._last_pcm
+        if (self.concealment == SBCConcealment.SILENCE or
+                self._concealed_run > self.fade_packets):
+            return b'\x00' * len(self._last_pcm)
+        # Fade out a frame at a time from the last good packet
+        steps = float(self.fade_packets * frames)
+        start = (self._concealed_run - 1) * frames
+        size = self.codec.codesize
+        return b''.join(audioop.mul(self._last_pcm[i * size:(i + 1) * size],
+                                    2, 1.0 - (start + i + 1) / steps)
+                        for i in range(frames))
+
+    def get(self):
+        """
+        Get the decoded PCM for the next packet slot, or the
+        concealment audio standing in for it.  Call this at
+        the playback rate.
+
+        :return: Decoded PCM data.  Empty until the first packet
+            has been decoded.
+        :rtype: bytes
+        """
+        if (not self._primed):
+            if (len(self._packets) < self.depth):
+                return self._conceal()
+            self._primed = True
+            self._started = True
+        packet = self._packets.pop(self._expected, None)
+        if (packet is None):
+            if (not self._packets):
+                self._underruns += 1
+                self._primed = False
+            else:
+                self._expected = (self._expected + 1) & 0xFFFF
+            return self._conceal()
+        self._expected = (self._expected + 1) & 0xFFFF
+        (written, _) = self.codec.decode_from_buffer(packet,
+                                                     self._decode_buffer)
+        if (not written):
+            # Leading fragments of a frame only decode with the last
+            if (struct.unpack_from(str('B'), packet, 12)[0] & 0xA0 == 0x80):
+                return self.get()
+            return self._conceal()
+        self._last_pcm = bytes(self._decode_buffer[:written])
+        self._concealed_run = 0
+        return self._last_pcm
+
+    def stats(self):
+        """
+        Get the jitter buffer counters.  `concealed` counts
+        concealed frames, the others count packets.
+
+        :return: Jitter buffer counters
+        :rtype: :py:class:`JitterBufferStats`
+        """
+        return JitterBufferStats(len(self._packets),
+                                 self._underruns,
+                                 self._late,
+                                 self._duplicates,
+                                 self._overflows,
+                                 self._concealed)
+
+
+class SBCCodecJob:
+    """
+    Handle for an encode or decode job submitted to a
+    :py:class:`SBCCodecPool`.
+
+    :Attributes:
+
+    * **result**: Return value of the codec operation once
+        the job has completed.
+    * **exception**: Exception raised by the codec operation,
+        otherwise `None`.
+    * **callback_exception**: Exception raised by the user
+        callback, otherwise `None`.
+    * **user_arg**: User-defined argument supplied when the
+        job was submitted.
+    """
+    def __init__(self, func, args, user_cb, user_arg):
+        self.func = func
+        self.args = args
+        self.user_cb = user_cb
+        self.user_arg = user_arg
+        self.result = None
+        self.exception = None
+        self.callback_exception = None
+        self._done = threading.Event()
+
+    def _run(self):
+        try:
+            self.result = self.func(*self.args)
+        except Exception as e:
+            self.exception = e
+        self._done.set()
+        if (self.user_cb):
+            try:
+                self.user_cb(self.user_arg, self)
+            except Exception as e:
+                # A failing callback must not stop the codecs bound
+                # to this worker
+                self.callback_exception = e
+                traceback.print_exc()
+
+    def done(self):
+        """
+        :return: `True` if the job has completed
+        :rtype: boolean
+        """
+        return self._done.is_set()
+
+    def wait(self, timeout=None):
+        """
+        Block until the job completes.
+
+        :param float timeout: Optional timeout in seconds
+        :return: Return value of the codec operation, or `None`
+            if the timeout expired.
+        :raises Exception: any exception raised by the codec
+            operation is re-raised here.
+        """
+        self._done.wait(timeout)
+        if (self.exception):
+            raise self.exception
+        return self.result
+
+
+class SBCCodecPool:
+    """
+    Pool of worker threads running SBC encode and decode jobs
+    on behalf of many :py:class:`SBCCodec` instances, allowing
+    a single process with several media endpoints to scale
+    across CPU cores.
+
+    Each codec is bound to a single worker on first use so that
+    its jobs run in submission order and its `sbc_t` and RTP
+    state are never touched by two threads at once.  Jobs for
+    different codecs run in parallel since the codec releases
+    the GIL while it is encoding, decoding or blocked on the
+    media transport.
+
+    :param int num_workers: Optional number of worker threads.
+        Defaults to the number of CPUs.
+    :param int max_pending: Optional maximum number of jobs
+        queued per worker.  Submitting to a full worker blocks.
+        Defaults to 0 (unbounded).
+
+    .. note:: User callbacks are called on the worker thread.
+        An exception raised by a callback is reported and kept in
+        the job's `callback_exception`.
+        Data passed to :py:meth:`encode` is not copied and must
+        not be modified until the job has completed.
+    """
+    def __init__(self, num_workers=None, max_pending=0):
+        if (num_workers is None):
+            num_workers = multiprocessing.cpu_count()
+        self._queues = [Queue.Queue(max_pending) for _ in range(num_workers)]
+        self._affinity = weakref.WeakKeyDictionary()
+        self._next_worker = 0
+        self._lock = threading.Condition()
+        self._submitting = 0
+        self._workers = []
+        for q in self._queues:
+            t = threading.Thread(target=self._worker, args=(q,))
+            t.daemon = True
+            t.start()
+            self._workers.append(t)
+
+    @staticmethod
+    def _worker(q):
+        while True:
+            job = q.get()
+            if (job is None):
+                break
+            try:
+                job._run()
+            except Exception:
+                traceback.print_exc()
+
+    def _submit(self, codec, func, args, user_cb, user_arg):
+        with self._lock:
+            if (not self._workers):
+                raise RuntimeError('SBCCodecPool has been shut down')
+            index = self._affinity.get(codec)
+            if (index is None):
+                index = self._next_worker
+                self._next_worker = (index + 1) % len(self._queues)
+                self._affinity[codec] = index
+            # Holds back shutdown until the job is queued ahead of
+            # the worker's sentinel
+            self._submitting += 1
+        job = SBCCodecJob(func, args, user_cb, user_arg)
+        try:
+            self._queues[index].put(job)
+        finally:
+            with self._lock:
+                self._submitting -= 1
+                self._lock.notify_all()
+        return job
+
+    def encode(self, codec, fd, mtu, data, user_cb=None, user_arg=None):
+        """
+        Submit an encode job.  See :py:meth:`SBCCodec.encode`
+
+        :param codec: :py:class:`SBCCodec` instance to use
+        :param int fd: Media transport file descriptor
+        :param int mtu: Media transport MTU size
+        :param data: Data to encode and send
+        :param func user_cb: Optional callback called on completion
+            as `user_cb(user_arg, job)`
+        :param user_arg: Optional user-defined callback argument
+        :return: The submitted job
+        :rtype: :py:class:`SBCCodecJob`
+        """
+        return self._submit(codec, codec.encode, (fd, mtu, data),
+                            user_cb, user_arg)
+
+    def decode(self, codec, fd, mtu, max_len=2560, user_cb=None,
+               user_arg=None):
+        """
+        Submit a decode job.  See :py:meth:`SBCCodec.decode`
+
+        :param codec: :py:class:`SBCCodec` instance to use
+        :param int fd: Media transport file descriptor
+        :param int mtu: Media transport MTU size
+        :param int max_len: Optional maximum number of bytes to decode
+        :param func user_cb: Optional callback called on completion
+            as `user_cb(user_arg, job)`
+        :param user_arg: Optional user-defined callback argument
+        :return: The submitted job, whose result is the decoded data
+        :rtype: :py:class:`SBCCodecJob`
+        """
+        return self._submit(codec, codec.decode, (fd, mtu, max_len),
+                            user_cb, user_arg)
+
+    def shutdown(self, wait=True):
+        """
+        Stop the worker threads once all queued jobs have run.
+
+        :param boolean wait: Optional, wait for the workers to exit
+        """
+        with self._lock:
+            workers = self._workers
+            self._workers = []
+            while (self._submitting):
+                self._lock.wait()
+        for q in self._queues:
+            q.put(None)
+        if (wait):
+            for t in workers:
+                t.join()
@@ -1,8 +1,41 @@
 from __future__ import unicode_literals
 
+import dbus
+
 from interface import BTInterface
 from adapter import BTAdapter
+from manager import BTManager
 from exceptions import BTDeviceNotSpecifiedException
+from registry import registry
+from deviceindex import find_device_path
+
+
+def _find_adapter(adapter_path=None, adapter_id=None):
+    """
+    Helper to obtain a shared adapter wrapper for device look-ups
+    from the :py:data:`.registry`
+    """
+    if (adapter_path is None):
+        manager = registry.get_wrapper(BTManager, '/', pinned=True)
+        if (adapter_id is None):
+            adapter_path = manager.default_adapter()
+        else:
+            adapter_path = manager.find_adapter(adapter_id)
+    return registry.get_wrapper(BTAdapter, adapter_path, pinned=True,
+                                adapter_path=adapter_path)
+
+
+def _find_device(dev_id, adapter_path=None, adapter_id=None):
+    """
+    Helper to resolve a device object path from its device ID, using
+    a shared :py:class:`.DeviceIndex` if one knows the device and
+    the adapter's FindDevice method otherwise
+    """
+    path = find_device_path(dev_id, adapter_path, adapter_id)
+    if (path is None):
+        adapter = _find_adapter(adapter_path, adapter_id)
+        path = adapter.find_device(dev_id)
+    return path
 
 
 class BTGenericDevice(BTInterface):
@@ -30,12 +63,7 @@ class BTGenericDevice(BTInterface):
         if (dev_path):
             path = dev_path
         elif (dev_id):
-            if (adapter_id or adapter_path):
-                adapter = BTAdapter(adapter_path=adapter_path,
-                                    adapter_id=adapter_id)
-            else:
-                adapter = BTAdapter()
-            path = adapter.find_device(dev_id)
+            path = _find_device(dev_id, adapter_path, adapter_id)
         else:
             raise BTDeviceNotSpecifiedException
         BTInterface.__init__(self, path, addr)
@@ -102,6 +130,21 @@ class BTDevice(BTGenericDevice):
         when a device node has been removed.
     """
 
+    PROPERTY_TYPES = {'Address': dbus.String,
+                      'Name': dbus.String,
+                      'Icon': dbus.String,
+                      'Class': dbus.UInt32,
+                      'Paired': dbus.Boolean,
+                      'Connected': dbus.Boolean,
+                      'Trusted': dbus.Boolean,
+                      'Alias': dbus.String,
+                      'Adapter': dbus.ObjectPath,
+                      'LegacyPairing': dbus.Boolean,
+                      'Blocked': dbus.Boolean,
+                      'Product': dbus.UInt16,
+                      'Vendor': dbus.UInt16,
+                      'Version': dbus.UInt16}
+
     def __init__(self, *args, **kwargs):
         BTGenericDevice.__init__(self, addr='org.bluez.Device',
                                  *args, **kwargs)
@@ -129,6 +172,18 @@ class BTDevice(BTGenericDevice):
         """
         return self._interface.DiscoverServices(pattern)
 
+    def discover_services_async(self, pattern='', **kwargs):
+        """
+        Non-blocking variant of :py:meth:`discover_services`.  The keyword
+        arguments are those of :py:meth:`.BTSimpleInterface.call_async`.
+
+        The call's result is the dictionary of service records.
+
+        :return: Handle for the pending call
+        :rtype: :py:class:`.BTPendingCall`
+        """
+        return self.call_async('DiscoverServices', pattern, **kwargs)
+
     def cancel_discovery(self):
         """
         This method will cancel any previous :py:meth:`discover_services`
@@ -141,6 +196,16 @@ class BTDevice(BTGenericDevice):
         """
         return self._interface.CancelDiscovery()
 
+    def cancel_discovery_async(self, **kwargs):
+        """
+        Non-blocking variant of :py:meth:`cancel_discovery`.  The keyword
+        arguments are those of :py:meth:`.BTSimpleInterface.call_async`.
+
+        :return: Handle for the pending call
+        :rtype: :py:class:`.BTPendingCall`
+        """
+        return self.call_async('CancelDiscovery', **kwargs)
+
     def disconnect(self):
         """
         This method disconnects a specific remote device by
@@ -159,3 +224,13 @@ class BTDevice(BTGenericDevice):
         :raises dbus.Exception: org.bluez.Error.NotConnected
         """
         return self._interface.Disconnect()
+
+    def disconnect_async(self, **kwargs):
+        """
+        Non-blocking variant of :py:meth:`disconnect`.  The keyword
+        arguments are those of :py:meth:`.BTSimpleInterface.call_async`.
+
+        :return: Handle for the pending call
+        :rtype: :py:class:`.BTPendingCall`
+        """
+        return self.call_async('Disconnect', **kwargs)
@@ -0,0 +1,188 @@
+from __future__ import unicode_literals
+
+import dbus
+
+from registry import registry
+from dispatch import add_signal_receiver, remove_signal_receiver
+
+
+class DeviceIndex:
+    """
+    In-process index of the devices known to an adapter, mapping
+    each device object path to its address and alias and back again.
+
+    The index is built once using ListDevices and one GetProperties
+    call per device.  Thereafter it is kept current from the adapter's
+    DeviceCreated, DeviceRemoved and PropertyChanged (Devices) signals
+    and from the devices' PropertyChanged (Alias) signal, so that
+    look-ups never go over dbus.
+
+    An index should be obtained with :py:meth:`.BTAdapter.device_index`
+    so that it is shared through the :py:data:`.registry` and used by
+    :py:meth:`.BTAdapter.find_device` and by device constructors given
+    a `dev_id`.
+
+    :param adapter: The :py:class:`.BTAdapter` instance to index.
+
+    .. note:: Aliases need not be unique.  Looking up an alias
+        shared by several devices returns the most recently indexed.
+    """
+    def __init__(self, adapter):
+        self.adapter_path = adapter._path
+        self.adapter_address = adapter.Address
+        self._bus = adapter._bus
+        self._devices = {}
+        self._by_address = {}
+        self._by_alias = {}
+        self._subscriptions = [
+            add_signal_receiver(self._bus, self._device_created_handler,
+                                'DeviceCreated', 'org.bluez.Adapter',
+                                self.adapter_path),
+            add_signal_receiver(self._bus, self._device_removed_handler,
+                                'DeviceRemoved', 'org.bluez.Adapter',
+                                self.adapter_path),
+            add_signal_receiver(self._bus, self._adapter_property_handler,
+                                'PropertyChanged', 'org.bluez.Adapter',
+                                self.adapter_path),
+            add_signal_receiver(self._bus, self._device_property_handler,
+                                'PropertyChanged', 'org.bluez.Device',
+                                path_keyword='path')]
+        for path in adapter.list_devices():
+            self._add(path)
+
+    def _add(self, path):
+        if (path in self._devices):
+            return
+        props = dbus.Interface(registry.get_object(path),
+                               'org.bluez.Device').GetProperties()
+        address = props['Address'].upper()
+        alias = props.get('Alias', props.get('Name'))
+        self._devices[path] = [address, alias]
+        self._by_address[address] = path
+        if (alias is not None):
+            self._by_alias[alias] = path
+
+    def _remove(self, path):
+        entry = self._devices.pop(path, None)
+        if (entry):
+            (address, alias) = entry
+            if (self._by_address.get(address) == path):
+                del self._by_address[address]
+            if (self._by_alias.get(alias) == path):
+                del self._by_alias[alias]
+
+    def _device_created_handler(self, path):
+        self._add(path)
+
+    def _device_removed_handler(self, path):
+        self._remove(path)
+
+    def _adapter_property_handler(self, name, value):
+        if (name == 'Devices'):
+            for path in self._devices.keys():
+                if (path not in value):
+                    self._remove(path)
+            for path in value:
+                self._add(path)
+
+    def _device_property_handler(self, name, value, path=None):
+        entry = self._devices.get(path)
+        if (entry and name == 'Alias'):
+            if (self._by_alias.get(entry[1]) == path):
+                del self._by_alias[entry[1]]
+            entry[1] = value
+            self._by_alias[value] = path
+
+    def find(self, dev_id):
+        """
+        Look-up a device object path by address or alias.
+
+        :param str dev_id: Device MAC address e.g., '11:22:33:44:55:66'
+            or alias
+        :return: Device object path or None if not indexed
+        :rtype: str
+        """
+        path = self._by_address.get(dev_id.upper())
+        if (path is None):
+            path = self._by_alias.get(dev_id)
+        return path
+
+    def address(self, path):
+        """
+        :param str path: Device object path
+        :return: Device MAC address or None if not indexed
+        :rtype: str
+        """
+        entry = self._devices.get(path)
+        if (entry):
+            return entry[0]
+
+    def alias(self, path):
+        """
+        :param str path: Device object path
+        :return: Device alias or None if not indexed
+        :rtype: str
+        """
+        entry = self._devices.get(path)
+        if (entry):
+            return entry[1]
+
+    def paths(self):
+        """
+        :return: List of indexed device object paths
+        :rtype: list
+        """
+        return self._devices.keys()
+
+    def matches(self, adapter_path=None, adapter_id=None):
+        """
+        Helper to check if this index belongs to the adapter given by
+        object path or device ID (e.g., 'hci0' or '11:22:33:44:55:66').
+        An adapter which isn't specified matches any index.
+
+        :return: True if the index matches
+        :rtype: bool
+        """
+        if (adapter_path and adapter_path != self.adapter_path):
+            return False
+        if (adapter_id and
+                adapter_id.upper() != self.adapter_address.upper() and
+                adapter_id != self.adapter_path.split('/')[-1]):
+            return False
+        return True
+
+    def close(self):
+        """
+        Remove the index's signal receivers and drop it from the
+        :py:data:`.registry`.
+
+        :return:
+        """
+        for s in self._subscriptions:
+            remove_signal_receiver(self._bus, s)
+        self._subscriptions = []
+        registry.forget(self.adapter_path, DeviceIndex)
+
+    def __len__(self):
+        return len(self._devices)
+
+    def __contains__(self, dev_id):
+        return dev_id in self._devices or self.find(dev_id) is not None
+
+
+def find_device_path(dev_id, adapter_path=None, adapter_id=None):
+    """
+    Look-up a device object path in the shared device indexes.
+
+    :param str dev_id: Device MAC address or alias
+    :param str adapter_path: Optional adapter object path
+    :param str adapter_id: Optional adapter device ID e.g., 'hci0'
+    :return: Device object path or None if no index for a matching
+        adapter knows the device
+    :rtype: str
+    """
+    for index in registry.get_wrappers(DeviceIndex):
+        if (index.matches(adapter_path, adapter_id)):
+            path = index.find(dev_id)
+            if (path):
+                return path
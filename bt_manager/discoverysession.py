@@ -0,0 +1,239 @@
+from __future__ import unicode_literals
+
+from collections import namedtuple
+import gobject
+
+from dispatch import add_signal_receiver, remove_signal_receiver
+
+
+DiscoveryDelta = namedtuple('DiscoveryDelta', 'added updated lost')
+"""
+Named tuple collection of the device changes seen by a
+:py:class:`DiscoverySession` during one window.  ``added`` maps each new
+device address to its properties, ``updated`` maps the address of each
+known device to only those properties which changed and ``lost`` is a
+list of addresses of devices which disappeared.
+"""
+
+DiscoveryStats = namedtuple('DiscoveryStats',
+                            'events delivered merged dropped batches devices')
+"""
+Named tuple collection of discovery session counters as returned by
+:py:meth:`DiscoverySession.stats`
+"""
+
+
+def _device_address(path):
+    # bluez device object paths end in e.g., 'dev_00_11_67_D2_AB_EE'
+    name = path.rsplit('/', 1)[-1]
+    if (name.startswith('dev_')):
+        return name[4:].replace('_', ':')
+
+
+class DiscoverySession:
+    """
+    Coalesces the adapter's device discovery signals into batches.
+
+    During discovery bluez raises DeviceFound for every inquiry result
+    and RSSI update, and devices raise PropertyChanged as they are
+    resolved.  Rather than a callback per signal, the session
+    deduplicates them by device address and delivers at most one
+    :py:class:`DiscoveryDelta` per `window`, holding the devices added,
+    the properties which changed and the devices lost since the last
+    delta.  A signal repeating a device's known properties is dropped
+    and one updating a device already in the pending delta is merged
+    into it.
+
+    The window timer is only armed while changes are pending, so an
+    idle session adds no wake-ups.
+
+    A session should be obtained with
+    :py:meth:`.BTAdapter.discovery_session`::
+
+        def found(delta):
+            for (address, props) in delta.added.items():
+                print address, props.get('Name'), props.get('RSSI')
+
+        session = adapter.discovery_session(found, window=0.5)
+        session.start()
+
+    :param adapter: The :py:class:`.BTAdapter` to discover devices on
+    :param func callback: Function called on the main loop with each
+        :py:class:`DiscoveryDelta`
+    :param float window: Coalescing window in seconds
+    """
+    def __init__(self, adapter, callback, window=0.5):
+        self.adapter = adapter
+        self.callback = callback
+        self.window = window
+        self._bus = adapter._bus
+        self._subscriptions = []
+        self._timer = None
+        self._devices = {}
+        self._added = {}
+        self._updated = {}
+        self._lost = set()
+        self._events = 0
+        self._delivered = 0
+        self._merged = 0
+        self._dropped = 0
+        self._batches = 0
+
+    def _arm(self):
+        if (self._timer is None):
+            self._timer = gobject.timeout_add(int(self.window * 1000),
+                                              self._timeout_handler)
+
+    def _timeout_handler(self):
+        self._timer = None
+        self.flush()
+        return False
+
+    def _update(self, address, props):
+        self._events += 1
+        if (address in self._added):
+            self._added[address].update(props)
+            self._merged += 1
+            return
+        known = self._devices.get(address)
+        if (known is None):
+            self._added[address] = dict(props)
+            self._arm()
+            return
+        changed = dict((k, v) for (k, v) in props.items()
+                       if known.get(k) != v)
+        if (address in self._lost):
+            # Back in range before the loss was delivered
+            self._lost.discard(address)
+            self._merged += 1
+            if (not changed):
+                return
+        elif (not changed):
+            self._dropped += 1
+            return
+        if (address in self._updated):
+            self._updated[address].update(changed)
+            self._merged += 1
+        else:
+            self._updated[address] = changed
+            self._arm()
+
+    def _device_found_handler(self, address, props):
+        self._update(address.upper(), props)
+
+    def _device_disappeared_handler(self, address):
+        address = address.upper()
+        self._events += 1
+        if (address in self._added):
+            # Came and went within one window
+            del self._added[address]
+            self._merged += 1
+        elif (address in self._devices and address not in self._lost):
+            self._updated.pop(address, None)
+            self._lost.add(address)
+            self._arm()
+        else:
+            self._dropped += 1
+
+    def _device_property_handler(self, name, value, path=None):
+        if (not path or not path.startswith(self.adapter._path + '/')):
+            return
+        address = _device_address(path)
+        if (address in self._devices or address in self._added):
+            self._update(address, {name: value})
+
+    def start(self):
+        """
+        Subscribe to the discovery signals and start device discovery
+        on the adapter.
+
+        :return:
+        :raises dbus.Exception: org.bluez.Error.NotReady
+        :raises dbus.Exception: org.bluez.Error.Failed
+        """
+        if (not self._subscriptions):
+            path = self.adapter._path
+            self._subscriptions = [
+                add_signal_receiver(self._bus, self._device_found_handler,
+                                    'DeviceFound', 'org.bluez.Adapter',
+                                    path),
+                add_signal_receiver(self._bus,
+                                    self._device_disappeared_handler,
+                                    'DeviceDisappeared', 'org.bluez.Adapter',
+                                    path),
+                add_signal_receiver(self._bus,
+                                    self._device_property_handler,
+                                    'PropertyChanged', 'org.bluez.Device',
+                                    path_keyword='path')]
+        self.adapter.start_discovery()
+
+    def stop(self):
+        """
+        Stop device discovery, deliver any pending changes and
+        unsubscribe from the discovery signals.  The session may be
+        started again and keeps its device snapshot.
+
+        :return:
+        :raises dbus.Exception: org.bluez.Error.NotReady
+        :raises dbus.Exception: org.bluez.Error.Failed
+        :raises dbus.Exception: org.bluez.Error.NotAuthorized
+        """
+        try:
+            self.adapter.stop_discovery()
+        finally:
+            self.flush()
+            for s in self._subscriptions:
+                remove_signal_receiver(self._bus, s)
+            self._subscriptions = []
+
+    def flush(self):
+        """
+        Deliver pending changes to the callback straight away rather
+        than at the end of the window.  Nothing is delivered if there
+        are no changes.
+
+        :return:
+        """
+        if (self._timer is not None):
+            gobject.source_remove(self._timer)
+            self._timer = None
+        if (not (self._added or self._updated or self._lost)):
+            return
+        delta = DiscoveryDelta(self._added, self._updated,
+                               sorted(self._lost))
+        self._added = {}
+        self._updated = {}
+        self._lost = set()
+        for (address, props) in delta.added.items():
+            self._devices[address] = dict(props)
+        for (address, props) in delta.updated.items():
+            self._devices[address].update(props)
+        for address in delta.lost:
+            del self._devices[address]
+        self._delivered += (len(delta.added) + len(delta.updated) +
+                            len(delta.lost))
+        self._batches += 1
+        self.callback(delta)
+
+    def devices(self):
+        """
+        :return: Dictionary of the address of each device currently
+            in range to its properties, as of the last delta
+        :rtype: dict
+        """
+        return dict((k, dict(v)) for (k, v) in self._devices.items())
+
+    def stats(self):
+        """
+        Obtain discovery session counters.
+
+        :return: the number of discovery signals received, the number
+            of device changes delivered, the number of signals merged
+            into a pending change or cancelled by a later one, the number
+            of signals dropped as repeating known properties, the number
+            of deltas delivered and the number of devices in range
+        :rtype: :py:class:`DiscoveryStats`
+        """
+        return DiscoveryStats(self._events, self._delivered, self._merged,
+                              self._dropped, self._batches,
+                              len(self._devices))
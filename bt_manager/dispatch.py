@@ -0,0 +1,246 @@
+from __future__ import unicode_literals
+
+from collections import namedtuple
+
+from registry import registry
+
+
+DispatchStats = namedtuple('DispatchStats',
+                           'rules routes subscribers dispatched unrouted')
+"""
+Named tuple collection of signal dispatcher counters as returned by
+:py:meth:`SignalDispatcher.stats`
+"""
+
+
+class SignalSubscription:
+    """
+    Handle for a signal receiver installed with
+    :py:func:`add_signal_receiver` or :py:meth:`SignalDispatcher.subscribe`
+    which is used to remove it again.
+    """
+    def __init__(self, handler, signal, dbus_interface, path,
+                 path_keyword):
+        self.handler = handler
+        self.signal = signal
+        self.dbus_interface = dbus_interface
+        self.path = path
+        self.path_keyword = path_keyword
+        self.dispatched = False
+
+    def __call__(self, args, path):
+        if (self.path_keyword):
+            self.handler(*args, **{self.path_keyword: path})
+        else:
+            self.handler(*args)
+
+
+class SignalDispatcher:
+    """
+    In-process signal dispatcher which installs a single match rule
+    on the system bus for each interface (e.g., 'org.bluez.Device')
+    rather than one per signal and object path.
+
+    Incoming signals are routed through a table keyed by (interface,
+    signal, path) so that any number of subscribers may share one
+    signal, and subscribers may be removed in constant time.
+    Subscribers which gave no path receive the signal from all objects
+    implementing the interface.
+
+    Dispatch is off by default.  Once :py:meth:`enable` is called
+    all signal receivers installed by the interface wrappers (see
+    :py:func:`add_signal_receiver`) are routed through the dispatcher.
+    It should therefore be enabled before any interfaces are created.
+    """
+    def __init__(self):
+        self.enabled = False
+        self._bus = None
+        self._routes = {}
+        self._interfaces = {}
+        self._dispatched = 0
+        self._unrouted = 0
+
+    def enable(self):
+        """
+        Route signal receivers through the dispatcher from now on.
+
+        :return:
+        """
+        self.enabled = True
+
+    def disable(self):
+        """
+        Stop routing signal receivers through the dispatcher.  All
+        match rules are removed, all subscriptions are dropped and the
+        counters are reset.
+
+        :return:
+        """
+        if (self._bus is not None):
+            for interface in self._interfaces.keys():
+                self._remove_rule(interface)
+        self.enabled = False
+        self._bus = None
+        self._routes.clear()
+        self._interfaces.clear()
+        self._dispatched = 0
+        self._unrouted = 0
+
+    def _get_bus(self):
+        bus = registry.get_bus()
+        if (bus is not self._bus):
+            # Re-install our match rules on a new bus connection
+            self._bus = bus
+            for interface in self._interfaces.keys():
+                self._add_rule(interface)
+        return bus
+
+    def _add_rule(self, interface):
+        self._bus.add_signal_receiver(self._dispatch,
+                                      dbus_interface=interface,
+                                      member_keyword='member',
+                                      path_keyword='path',
+                                      interface_keyword='interface')
+
+    def _remove_rule(self, interface):
+        self._bus.remove_signal_receiver(self._dispatch,
+                                         dbus_interface=interface)
+
+    def _dispatch(self, *args, **kwargs):
+        interface = kwargs.get('interface')
+        member = kwargs.get('member')
+        path = kwargs.get('path')
+        routed = False
+        for key in ((interface, member, path), (interface, member, None)):
+            subscribers = self._routes.get(key)
+            if (subscribers):
+                routed = True
+                for s in subscribers.keys():
+                    s(args, path)
+        if (routed):
+            self._dispatched += 1
+        else:
+            self._unrouted += 1
+
+    def subscribe(self, handler, signal, dbus_interface, path=None,
+                  path_keyword=None):
+        """
+        Subscribe a handler to a signal.
+
+        :param func handler: Function called with the signal arguments
+        :param str signal: Signal name e.g., 'PropertyChanged'
+        :param str dbus_interface: Interface e.g., 'org.bluez.Adapter'
+        :param str path: Optional object path.  If omitted the handler
+            receives the signal from all objects.
+        :param str path_keyword: Optional keyword argument name used to
+            pass the object path to the handler
+        :return: subscription handle for :py:meth:`unsubscribe`
+        :rtype: :py:class:`SignalSubscription`
+        """
+        s = SignalSubscription(handler, signal, dbus_interface, path,
+                               path_keyword)
+        s.dispatched = True
+        self._get_bus()
+        key = (dbus_interface, signal, path)
+        subscribers = self._routes.get(key)
+        if (subscribers is None):
+            subscribers = self._routes[key] = {}
+        subscribers[s] = True
+        count = self._interfaces.get(dbus_interface, 0)
+        if (count == 0):
+            self._add_rule(dbus_interface)
+        self._interfaces[dbus_interface] = count + 1
+        return s
+
+    def unsubscribe(self, subscription):
+        """
+        Remove a subscription.  The interface's match rule is removed
+        along with its last subscriber.
+
+        :param subscription: handle returned by :py:meth:`subscribe`
+        :return:
+        """
+        key = (subscription.dbus_interface, subscription.signal,
+               subscription.path)
+        subscribers = self._routes.get(key)
+        if (subscribers is None or subscription not in subscribers):
+            return
+        del subscribers[subscription]
+        if (not subscribers):
+            del self._routes[key]
+        count = self._interfaces[subscription.dbus_interface] - 1
+        if (count == 0):
+            del self._interfaces[subscription.dbus_interface]
+            if (self._bus is not None):
+                self._remove_rule(subscription.dbus_interface)
+        else:
+            self._interfaces[subscription.dbus_interface] = count
+
+    def stats(self):
+        """
+        Obtain dispatcher counters.
+
+        :return: the number of installed match rules, routing table
+            entries and subscribers, and the number of signals which
+            were dispatched and which had no subscriber
+        :rtype: :py:class:`DispatchStats`
+        """
+        return DispatchStats(len(self._interfaces), len(self._routes),
+                             sum(self._interfaces.values()),
+                             self._dispatched, self._unrouted)
+
+
+dispatcher = SignalDispatcher()
+"""
+The process-wide :py:class:`SignalDispatcher` instance
+"""
+
+
+def add_signal_receiver(bus, handler, signal, dbus_interface, path=None,
+                        path_keyword=None):
+    """
+    Install a signal receiver, through the :py:data:`dispatcher` if it
+    is enabled or else as its own match rule on the bus.
+
+    :param bus: Bus connection used when the dispatcher is disabled
+    :param func handler: Function called with the signal arguments
+    :param str signal: Signal name e.g., 'PropertyChanged'
+    :param str dbus_interface: Interface e.g., 'org.bluez.Adapter'
+    :param str path: Optional object path
+    :param str path_keyword: Optional keyword argument name used to
+        pass the object path to the handler
+    :return: subscription handle for :py:func:`remove_signal_receiver`
+    :rtype: :py:class:`SignalSubscription`
+    """
+    if (dispatcher.enabled):
+        return dispatcher.subscribe(handler, signal, dbus_interface, path,
+                                    path_keyword)
+    kwargs = {}
+    if (path):
+        kwargs['path'] = path
+    if (path_keyword):
+        kwargs['path_keyword'] = path_keyword
+    bus.add_signal_receiver(handler, signal, dbus_interface=dbus_interface,
+                            **kwargs)
+    return SignalSubscription(handler, signal, dbus_interface, path,
+                              path_keyword)
+
+
+def remove_signal_receiver(bus, subscription):
+    """
+    Remove a signal receiver installed with :py:func:`add_signal_receiver`
+
+    :param bus: Bus connection the receiver was installed on
+    :param subscription: handle returned by :py:func:`add_signal_receiver`
+    :return:
+    """
+    if (subscription.dispatched):
+        dispatcher.unsubscribe(subscription)
+    else:
+        kwargs = {}
+        if (subscription.path):
+            kwargs['path'] = subscription.path
+        bus.remove_signal_receiver(subscription.handler,
+                                   subscription.signal,
+                                   dbus_interface=subscription.dbus_interface,  # noqa
+                                   **kwargs)
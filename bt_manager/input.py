@@ -29,6 +29,16 @@ class BTInput(BTGenericDevice):
         """
         return self._interface.Connect()
 
+    def connect_async(self, **kwargs):
+        """
+        Non-blocking variant of :py:meth:`connect`.  The keyword
+        arguments are those of :py:meth:`.BTSimpleInterface.call_async`.
+
+        :return: Handle for the pending call
+        :rtype: :py:class:`.BTPendingCall`
+        """
+        return self.call_async('Connect', **kwargs)
+
     def disconnect(self):
         """
         Disconnect from the input device.
@@ -40,3 +50,13 @@ class BTInput(BTGenericDevice):
         :raises dbus.Exception: org.bluez.Error.Failed
         """
         return self._interface.Disconnect()
+
+    def disconnect_async(self, **kwargs):
+        """
+        Non-blocking variant of :py:meth:`disconnect`.  The keyword
+        arguments are those of :py:meth:`.BTSimpleInterface.call_async`.
+
+        :return: Handle for the pending call
+        :rtype: :py:class:`.BTPendingCall`
+        """
+        return self.call_async('Disconnect', **kwargs)
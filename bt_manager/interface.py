@@ -1,27 +1,65 @@
 from __future__ import unicode_literals
 
+import ast
+from collections import namedtuple
 import dbus
 import types
 import pprint
+import time
 
 from exceptions import BTSignalNameNotRecognisedException
+from registry import registry
+from dispatch import add_signal_receiver, remove_signal_receiver
+from pending import BTPendingCall, BTCallLimiter
+
+
+PropertyCacheStats = namedtuple('PropertyCacheStats',
+                                'enabled hits updates refreshes age')
+"""
+Named tuple collection of property cache counters as returned by
+:py:meth:`BTInterface.property_cache_stats`.  ``age`` is the number of
+seconds since the cache was last refreshed in full from ``GetProperties``.
+"""
+
+
+def _parse_string(typeof, value):
+    """
+    Parse a string into the native Python value expected by the
+    constructor of dbus type 'typeof'.
+    """
+    if (issubclass(typeof, dbus.Boolean)):
+        lowered = value.strip().lower()
+        if (lowered in ('true', 'yes', 'on', '1')):
+            return True
+        elif (lowered in ('false', 'no', 'off', '0')):
+            return False
+        raise ValueError('Invalid boolean: ' + value)
+    elif (issubclass(typeof, (int, long))):
+        return int(value, 0)
+    elif (issubclass(typeof, float)):
+        return float(value)
+    elif (issubclass(typeof, types.StringTypes)):
+        return value
+    else:
+        # Containers e.g., "['a', 'b']" are parsed as literals only
+        return ast.literal_eval(value)
 
 
 def translate_to_dbus_type(typeof, value):
     """
     Helper function to map values from their native Python types
-    to Dbus types.
+    to Dbus types.  Strings are parsed according to the target
+    type, so that e.g., 'True' gives a dbus.Boolean and '0x10' a
+    dbus.UInt32, without being evaluated.
 
     :param type typeof: Target for type conversion e.g., 'dbus.Dictionary'
     :param value: Value to assign using type 'typeof'
     :return: 'value' converted to type 'typeof'
     :rtype: typeof
+    :raises ValueError: if a string can not be parsed as 'typeof'
     """
-    if ((isinstance(value, types.UnicodeType) or
-         isinstance(value, str)) and typeof is not dbus.String):
-        # FIXME: This is potentially dangerous since it evaluates
-        # a string in-situ
-        return typeof(eval(value))
+    if (isinstance(value, types.StringTypes)):
+        return typeof(_parse_string(typeof, value))
     else:
         return typeof(value)
 
@@ -37,11 +75,15 @@ class Signal():
         call when the signal triggers
     :param user_arg: User-defined callback argument to be passed
         as callback function
+    :param queue: Optional :py:class:`.SignalQueue` through which the
+        user callback is called on a worker thread
     """
-    def __init__(self, signal, user_callback, user_arg):
+    def __init__(self, signal, user_callback, user_arg, queue=None):
         self.signal = signal
         self.user_callback = user_callback
         self.user_arg = user_arg
+        self.queue = queue
+        self.subscription = None
 
     def signal_handler(self, *args):
         """
@@ -50,6 +92,12 @@ class Signal():
         :param args: list of signal-dependent arguments
         :return:
         """
+        if (self.queue is not None):
+            self.queue.put(self._deliver, self.signal, args)
+        else:
+            self._deliver(*args)
+
+    def _deliver(self, *args):
         self.user_callback(self.signal, self.user_arg, *args)
 
 
@@ -63,17 +111,56 @@ class BTSimpleInterface:
     :param str addr: dbus address of the interface instance to open
                      e.g., 'org.bluez.Adapter'
 
+    The bus connection and proxy object are shared with all other
+    interfaces through :py:data:`.registry`.
+
     .. note:: This class should always be sub-classed with a concrete
         implementation of a bluez interface which has no signals or
         properties.
     """
     def __init__(self, path, addr):
         self._dbus_addr = addr
-        self._bus = dbus.SystemBus()
-        self._object = self._bus.get_object('org.bluez', path)
+        self._bus = registry.get_bus()
+        self._object = registry.get_object(path)
         self._interface = dbus.Interface(self._object, addr)
         self._path = path
 
+    def call_async(self, method, *args, **kwargs):
+        """
+        Call a dbus method on the interface without blocking.  The
+        ``*_async`` variants of the wrapper methods are built on this.
+
+        :param str method: dbus method name e.g., 'DiscoverServices'
+        :param args: Method arguments
+        :param func reply_handler: Optional keyword argument giving a
+            function called with the method's return value(s)
+        :param func error_handler: Optional keyword argument giving a
+            function called with the exception if the call fails
+        :param float timeout: Optional keyword argument giving the
+            call timeout in seconds
+        :return: Handle for the pending call
+        :rtype: :py:class:`.BTPendingCall`
+        """
+        call = BTPendingCall()
+        reply_handler = kwargs.pop('reply_handler', None)
+        error_handler = kwargs.pop('error_handler', None)
+
+        def on_reply(*ret):
+            call.reply_handler(*ret)
+            if (reply_handler):
+                reply_handler(*ret)
+
+        def on_error(e):
+            call.error_handler(e)
+            if (error_handler):
+                error_handler(e)
+
+        getattr(self._interface, method)(*args,
+                                         reply_handler=on_reply,
+                                         error_handler=on_error,
+                                         **kwargs)
+        return call
+
 
 # This class is not intended to be instantiated directly and should be
 # sub-classed with a concrete implementation for an interface
@@ -98,10 +185,25 @@ class BTInterface(BTSimpleInterface):
         Signal notifying when a property has changed.
     """
 
+    PROPERTY_TYPES = {}
+    """
+    Schema of property names to dbus types used by
+    :py:meth:`set_property` and :py:meth:`set_properties` to convert
+    new values.  Sub-classes list their interface's properties here.
+    The type of a property missing from the schema is taken from its
+    current value instead.
+    """
+
     def __init__(self, path, addr):
         BTSimpleInterface.__init__(self, path, addr)
         self._signals = {}
         self._signal_names = []
+        self._cache = None
+        self._cache_subscription = None
+        self._cache_hits = 0
+        self._cache_updates = 0
+        self._cache_refreshes = 0
+        self._cache_time = None
         self._properties = self._interface.GetProperties().keys()
         self._register_signal_name(BTInterface.SIGNAL_PROPERTY_CHANGED)
 
@@ -117,7 +219,7 @@ class BTInterface(BTSimpleInterface):
         """
         self._signal_names.append(name)
 
-    def add_signal_receiver(self, callback_fn, signal, user_arg):
+    def add_signal_receiver(self, callback_fn, signal, user_arg, queue=None):
         """
         Add a signal receiver callback with user argument
 
@@ -130,17 +232,24 @@ class BTInterface(BTSimpleInterface):
             :py:attr:`.BTInterface.SIGNAL_PROPERTY_CHANGED`
         :param user_arg: User-defined callback argument to be passed with
             callback function
+        :param queue: Optional :py:class:`.SignalQueue`.  If given the
+            callback is called from the queue's worker thread rather
+            than from the main loop, and must be thread-safe.
         :return:
         :raises BTSignalNameNotRecognisedException: if the signal name is
             not registered
         """
         if (signal in self._signal_names):
-            s = Signal(signal, callback_fn, user_arg)
+            s = self._signals.get(signal)
+            if (s):
+                remove_signal_receiver(self._bus, s.subscription)
+            s = Signal(signal, callback_fn, user_arg, queue)
             self._signals[signal] = s
-            self._bus.add_signal_receiver(s.signal_handler,
-                                          signal,
-                                          dbus_interface=self._dbus_addr,
-                                          path=self._path)
+            s.subscription = add_signal_receiver(self._bus,
+                                                 s.signal_handler,
+                                                 signal,
+                                                 self._dbus_addr,
+                                                 self._path)
         else:
             raise BTSignalNameNotRecognisedException
 
@@ -158,15 +267,101 @@ class BTInterface(BTSimpleInterface):
             not registered
         """
         if (signal in self._signal_names):
-            s = self._signals.get(signal)
+            s = self._signals.pop(signal, None)
             if (s):
-                self._bus.remove_signal_receiver(s.signal_handler,
-                                                 signal,
-                                                 dbus_interface=self._dbus_addr)  # noqa
-                self._signals.pop(signal)
+                remove_signal_receiver(self._bus, s.subscription)
         else:
             raise BTSignalNameNotRecognisedException
 
+    def _property_cache_handler(self, name, value):
+        """
+        Internal PropertyChanged receiver which applies each change
+        to the local property snapshot.
+        """
+        if (self._cache is not None):
+            self._cache[name] = value
+            self._cache_updates += 1
+            if (name not in self._properties):
+                self._properties.append(name)
+
+    def enable_property_cache(self):
+        """
+        Enable cached property access.  A snapshot of all properties is
+        taken with a single ``GetProperties`` call and is thereafter kept
+        up to date from this interface's own ``PropertyChanged`` signal,
+        so that :py:meth:`get_property` and attribute reads no longer
+        go over dbus.
+
+        The cache is independent of any user callback installed for
+        :py:attr:`SIGNAL_PROPERTY_CHANGED` using
+        :py:meth:`add_signal_receiver`.
+
+        See also :py:meth:`disable_property_cache`, :py:meth:`refresh`
+
+        :return:
+        """
+        if (self._cache is None):
+            self._cache_subscription = \
+                add_signal_receiver(self._bus,
+                                    self._property_cache_handler,
+                                    BTInterface.SIGNAL_PROPERTY_CHANGED,
+                                    self._dbus_addr,
+                                    self._path)
+            self._cache = {}
+        self.refresh()
+
+    def disable_property_cache(self):
+        """
+        Disable cached property access and discard the local property
+        snapshot.  Subsequent property reads go over dbus again.
+
+        See also :py:meth:`enable_property_cache`
+
+        :return:
+        """
+        if (self._cache is not None):
+            remove_signal_receiver(self._bus, self._cache_subscription)
+            self._cache_subscription = None
+            self._cache = None
+            self._cache_time = None
+
+    def refresh(self):
+        """
+        Re-read all properties from dbus, replacing the local property
+        snapshot if the property cache is enabled.  Properties which
+        have appeared since the interface was opened become accessible
+        as attributes.
+
+        :return: dictionary of all properties
+        """
+        props = self._interface.GetProperties()
+        self._properties = props.keys()
+        if (self._cache is not None):
+            self._cache = dict(props)
+        self._cache_refreshes += 1
+        self._cache_time = time.time()
+        return props
+
+    def property_cache_stats(self):
+        """
+        Obtain property cache counters.
+
+        :return: cache enabled state, the number of property reads served
+            from the cache, the number of updates applied from
+            ``PropertyChanged`` signals, the number of full refreshes and
+            the age in seconds of the last full refresh (None if the
+            cache has never been refreshed)
+        :rtype: :py:class:`PropertyCacheStats`
+        """
+        age = None
+        if (self._cache_time is not None):
+            age = time.time() - self._cache_time
+        return PropertyCacheStats(self._cache is not None,
+                                  self._cache_hits,
+                                  self._cache_updates,
+                                  self._cache_refreshes,
+                                  age)
+
     def get_property(self, name=None):
         """
         Helper to get a property value by name or all
@@ -184,18 +379,50 @@ class BTInterface(BTSimpleInterface):
             object's dictionary
         :raises dbus.Exception: org.bluez.Error.DoesNotExist
         :raises dbus.Exception: org.bluez.Error.InvalidArguments
+
+        .. note:: When the property cache is enabled the value is
+            returned from the local snapshot without a dbus call.
         """
+        if (self._cache is not None):
+            self._cache_hits += 1
+            if (name):
+                return self._cache[name]
+            else:
+                return dict(self._cache)
         if (name):
             return self._interface.GetProperties()[name]
         else:
             return self._interface.GetProperties()
 
+    def _translate_properties(self, properties):
+        """
+        Convert new property values to their dbus types using
+        :py:attr:`PROPERTY_TYPES`.  Current values are fetched, at most
+        once, only for properties missing from the schema.
+        """
+        if (hasattr(properties, 'items')):
+            properties = properties.items()
+        current = None
+        translated = []
+        for (name, value) in properties:
+            typeof = self.PROPERTY_TYPES.get(name)
+            if (typeof is None):
+                if (current is None):
+                    current = self.get_property()
+                typeof = type(current[name])
+            translated.append((name, translate_to_dbus_type(typeof, value)))
+        return translated
+
+    def _property_set(self, name, value):
+        if (self._cache is not None):
+            self._cache[name] = value
+
     def set_property(self, name, value):
         """
         Helper to set a property value by name, translating to correct
         dbus type
 
-        See also :py:meth:`get_property`
+        See also :py:meth:`get_property`, :py:meth:`set_properties`
 
         :param str name: The property name in the object's dictionary
             whose value shall be set.
@@ -203,12 +430,58 @@ class BTInterface(BTSimpleInterface):
         :return:
         :raises KeyError: if the property key is not found in the
             object's dictionary
+        :raises ValueError: if a string value can not be converted
         :raises dbus.Exception: org.bluez.Error.DoesNotExist
         :raises dbus.Exception: org.bluez.Error.InvalidArguments
         """
-        typeof = type(self.get_property(name))
-        self._interface.SetProperty(name,
-                                    translate_to_dbus_type(typeof, value))
+        self.set_properties([(name, value)])
+
+    def set_properties(self, properties):
+        """
+        Helper to set several property values at once.  All values are
+        converted to their dbus types before any is set, so a value
+        which fails to convert leaves every property unchanged.  One
+        SetProperty call is then made per property.
+
+        See also :py:meth:`set_property`, :py:meth:`set_properties_async`
+
+        :param properties: Dictionary of property names to new values,
+            or a list of (name, value) tuples if the properties must be
+            set in order (e.g., 'Powered' before 'Discoverable')
+        :return:
+        :raises KeyError: if a property key is not found in the
+            object's dictionary
+        :raises ValueError: if a string value can not be converted
+        :raises dbus.Exception: org.bluez.Error.DoesNotExist
+        :raises dbus.Exception: org.bluez.Error.InvalidArguments
+        """
+        for (name, value) in self._translate_properties(properties):
+            self._interface.SetProperty(name, value)
+            self._property_set(name, value)
+
+    def set_properties_async(self, properties):
+        """
+        Non-blocking variant of :py:meth:`set_properties` which issues
+        all SetProperty calls without waiting for each reply.
+
+        :param properties: Dictionary of property names to new values,
+            or a list of (name, value) tuples
+        :return: Handle whose result is the list of each SetProperty
+            call's result (None) or its exception, in order
+        :rtype: :py:class:`.BTPendingCall`
+        :raises KeyError: if a property key is not found in the
+            object's dictionary
+        :raises ValueError: if a string value can not be converted
+        """
+        def property_set(name, value):
+            return lambda *args: self._property_set(name, value)
+
+        calls = []
+        for (name, value) in self._translate_properties(properties):
+            calls.append(self.call_async('SetProperty', name, value,
+                                         reply_handler=property_set(name,
+                                                                    value)))
+        return BTCallLimiter.gather(calls)
 
     def __getattr__(self, name):
         """Override default getattr behaviours to allow DBus object
@@ -232,4 +505,6 @@ class BTInterface(BTSimpleInterface):
 
     def __str__(self):
         """Stringify the Dbus interface properties in a nice format"""
+        if (self._cache is not None):
+            return pprint.pformat(self._cache)
         return pprint.pformat(self._interface.GetProperties())
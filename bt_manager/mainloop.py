@@ -0,0 +1,180 @@
+from __future__ import unicode_literals
+
+from collections import namedtuple
+import dbus.mainloop.glib
+import gobject
+import threading
+import time
+
+from pending import BTPendingCall
+
+
+MainLoopStats = namedtuple('MainLoopStats',
+                           'running calls max_latency mean_latency')
+"""
+Named tuple collection of main loop runner counters as returned by
+:py:meth:`BTMainLoopRunner.stats`.  Latencies are the number of seconds
+between a call being queued with :py:meth:`BTMainLoopRunner.call_soon`
+and it starting on the main loop thread.
+"""
+
+
+class BTMainLoopRunner:
+    """
+    Runs the GLib main loop on a dedicated thread, on which all dbus
+    signals, method replies, agent requests and media transport events
+    are then dispatched.
+
+    The thread sleeps in the GLib poll until there is work to do, so
+    that an idle process makes no periodic wake-ups and events are
+    handled as soon as they arrive.  This replaces iterating the main
+    loop context from a timer.
+
+    Other threads (e.g., a command line reading user input) should hand
+    work over to the main loop thread with :py:meth:`call` or
+    :py:meth:`call_soon` rather than touching signal receivers, IO
+    watches or wrappers directly::
+
+        runner.start()
+        while True:
+            text = raw_input('> ')
+            runner.call(run_command, text)
+
+    The runner should be started before any interfaces are created
+    since it installs the dbus GLib main loop as the default.
+    """
+    def __init__(self):
+        self._loop = None
+        self._thread = None
+        self._thread_ident = None
+        self._lock = threading.Lock()
+        self._calls = 0
+        self._total_latency = 0.0
+        self._max_latency = 0.0
+
+    def _run(self, started):
+        self._thread_ident = threading.current_thread().ident
+        started.set()
+        self._loop.run()
+        self._thread_ident = None
+
+    def start(self):
+        """
+        Install the dbus GLib main loop as the default, enable threading
+        support in GLib and dbus and start the main loop thread.  Does
+        nothing if the runner is already running.
+
+        :return:
+        """
+        if (self.is_running()):
+            return
+        dbus.mainloop.glib.DBusGMainLoop(set_as_default=True)
+        gobject.threads_init()
+        dbus.mainloop.glib.threads_init()
+        self._loop = gobject.MainLoop()
+        started = threading.Event()
+        self._thread = threading.Thread(target=self._run, args=(started,),
+                                        name='bt-manager-mainloop')
+        self._thread.daemon = True
+        self._thread.start()
+        started.wait()
+
+    def stop(self, timeout=None):
+        """
+        Quit the main loop and wait for its thread to exit.
+
+        :param float timeout: Optional time in seconds to wait for
+            the thread
+        :return:
+        """
+        if (not self.is_running()):
+            return
+        gobject.idle_add(self._quit)
+        if (not self.in_loop_thread()):
+            self._thread.join(timeout)
+        self._thread = None
+
+    def _quit(self):
+        self._loop.quit()
+        return False
+
+    def is_running(self):
+        """
+        :return: `True` if the main loop thread is running
+        :rtype: boolean
+        """
+        return self._thread is not None and self._thread.is_alive()
+
+    def in_loop_thread(self):
+        """
+        :return: `True` if called on the main loop thread
+        :rtype: boolean
+        """
+        return threading.current_thread().ident == self._thread_ident
+
+    def _invoke(self, call, queued, fn, args, kwargs):
+        latency = time.time() - queued
+        with self._lock:
+            self._calls += 1
+            self._total_latency += latency
+            self._max_latency = max(self._max_latency, latency)
+        try:
+            call.set_result(fn(*args, **kwargs))
+        except BaseException as e:
+            # Includes SystemExit so that it reaches the calling thread
+            call.set_exception(e)
+        return False
+
+    def call_soon(self, fn, *args, **kwargs):
+        """
+        Queue a function to be called on the main loop thread and return
+        without waiting for it.  The function is called straight away if
+        this is the main loop thread or the runner is not running.
+
+        :param func fn: Function to call
+        :param args: Arguments passed to `fn`
+        :param kwargs: Keyword arguments passed to `fn`
+        :return: Handle completing with the function's return value
+            or exception
+        :rtype: :py:class:`.BTPendingCall`
+        """
+        call = BTPendingCall()
+        if (self.in_loop_thread() or not self.is_running()):
+            self._invoke(call, time.time(), fn, args, kwargs)
+        else:
+            gobject.idle_add(self._invoke, call, time.time(), fn, args,
+                             kwargs)
+        return call
+
+    def call(self, fn, *args, **kwargs):
+        """
+        Call a function on the main loop thread and wait for it to
+        return.
+
+        :param func fn: Function to call
+        :param args: Arguments passed to `fn`
+        :param kwargs: Keyword arguments passed to `fn`
+        :return: `fn`'s return value
+        :raises Exception: any exception raised by `fn` (including
+            `SystemExit`) is re-raised here
+        """
+        return self.call_soon(fn, *args, **kwargs).wait()
+
+    def stats(self):
+        """
+        Obtain runner counters.
+
+        :return: whether the runner is running, the number of calls
+            made through it and their maximum and mean queueing latency
+        :rtype: :py:class:`MainLoopStats`
+        """
+        with self._lock:
+            mean = self._total_latency / self._calls if self._calls else 0.0
+            return MainLoopStats(self.is_running(), self._calls,
+                                 self._max_latency, mean)
+
+
+runner = BTMainLoopRunner()
+"""
+The process-wide :py:class:`BTMainLoopRunner` instance
+"""
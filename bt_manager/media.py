@@ -2,8 +2,9 @@ from __future__ import unicode_literals
 
 from interface import BTSimpleInterface, BTInterface
 from manager import BTManager
-from adapter import BTAdapter
+from device import _find_device
 from exceptions import BTDeviceNotSpecifiedException
+from registry import registry
 import dbus.service
 
 
@@ -29,7 +30,7 @@ class BTMedia(BTSimpleInterface):
     See also: :py:class:`.GenericEndpoint`
     """
     def __init__(self, adapter_id=None):
-        manager = BTManager()
+        manager = registry.get_wrapper(BTManager, '/', pinned=True)
         if (adapter_id is None):
             adapter_path = manager.default_adapter()
         else:
@@ -68,6 +69,16 @@ class BTMedia(BTSimpleInterface):
         """
         self._interface.RegisterEndpoint(path, properties)
 
+    def register_endpoint_async(self, path, properties, **kwargs):
+        """
+        Non-blocking variant of :py:meth:`register_endpoint`.  The keyword
+        arguments are those of :py:meth:`.BTSimpleInterface.call_async`.
+
+        :return: Handle for the pending call
+        :rtype: :py:class:`.BTPendingCall`
+        """
+        return self.call_async('RegisterEndpoint', path, properties, **kwargs)
+
     def unregister_endpoint(self, path):
         """
         Unregister sender end point.
@@ -78,6 +89,16 @@ class BTMedia(BTSimpleInterface):
         """
         self._interface.UnregisterEndpoint(path)
 
+    def unregister_endpoint_async(self, path, **kwargs):
+        """
+        Non-blocking variant of :py:meth:`unregister_endpoint`.  The keyword
+        arguments are those of :py:meth:`.BTSimpleInterface.call_async`.
+
+        :return: Handle for the pending call
+        :rtype: :py:class:`.BTPendingCall`
+        """
+        return self.call_async('UnregisterEndpoint', path, **kwargs)
+
 
 class BTMediaTransport(BTInterface):
     """
@@ -139,6 +160,15 @@ class BTMediaTransport(BTInterface):
     * **Routing(str) [readonly]**: Optional. Indicates where is the
         transport being routed and may be 'HCI' or 'PCM'.
     """
+
+    PROPERTY_TYPES = {'Device': dbus.ObjectPath,
+                      'UUID': dbus.String,
+                      'Codec': dbus.Byte,
+                      'Delay': dbus.UInt16,
+                      'NREC': dbus.Boolean,
+                      'InbandRingtone': dbus.Boolean,
+                      'Routing': dbus.String}
+
     def __init__(self, path, fd=None, adapter_id=None,
                  dev_path=None, dev_id=None):
         if (not path):
@@ -146,11 +176,8 @@ class BTMediaTransport(BTInterface):
             if (dev_path):
                 path = dev_path + fd_suffix
             elif (dev_id):
-                if (adapter_id):
-                    adapter = BTAdapter(adapter_id)
-                else:
-                    adapter = BTAdapter()
-                    path = adapter.find_device(dev_id) + fd_suffix
+                path = _find_device(dev_id, adapter_id=adapter_id) + \
+                    fd_suffix
             else:
                 raise BTDeviceNotSpecifiedException
         BTInterface.__init__(self, path, 'org.bluez.MediaTransport')
@@ -170,6 +197,18 @@ class BTMediaTransport(BTInterface):
         """
         return self._interface.Acquire(access_type)
 
+    def acquire_async(self, access_type, **kwargs):
+        """
+        Non-blocking variant of :py:meth:`acquire`.  The keyword
+        arguments are those of :py:meth:`.BTSimpleInterface.call_async`.
+
+        The call's result is the tuple (fd, read_mtu, write_mtu).
+
+        :return: Handle for the pending call
+        :rtype: :py:class:`.BTPendingCall`
+        """
+        return self.call_async('Acquire', access_type, **kwargs)
+
     def release(self, access_type):
         """
         Releases file descriptor.
@@ -184,6 +223,16 @@ class BTMediaTransport(BTInterface):
         """
         return self._interface.Release(access_type)
 
+    def release_async(self, access_type, **kwargs):
+        """
+        Non-blocking variant of :py:meth:`release`.  The keyword
+        arguments are those of :py:meth:`.BTSimpleInterface.call_async`.
+
+        :return: Handle for the pending call
+        :rtype: :py:class:`.BTPendingCall`
+        """
+        return self.call_async('Release', access_type, **kwargs)
+
 
 class GenericEndpoint(dbus.service.Object):
     """
@@ -197,7 +246,7 @@ class GenericEndpoint(dbus.service.Object):
         media endpoint e.g., '/endpoint/a2dpsink'.
     """
     def __init__(self, path):
-        bus = dbus.SystemBus()
+        bus = registry.get_bus()
         super(GenericEndpoint, self).__init__(bus, path)
 
     def get_properties(self):
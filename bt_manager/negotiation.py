@@ -0,0 +1,254 @@
+from __future__ import unicode_literals
+
+from collections import namedtuple
+
+from codecs import SBCChannelMode, SBCSamplingFrequency, \
+    SBCAllocationMethod, SBCSubbands, SBCBlocks, SBCCodecConfig
+from exceptions import BTInvalidConfiguration
+
+
+NegotiationReason = namedtuple('NegotiationReason', 'parameter value reason')
+"""
+Named tuple recording why a :py:class:`SBCNegotiationPolicy` chose the
+value of one configuration parameter
+"""
+
+_NAMES = {
+    'frequency': {SBCSamplingFrequency.FREQ_16KHZ: '16 kHz',
+                  SBCSamplingFrequency.FREQ_32KHZ: '32 kHz',
+                  SBCSamplingFrequency.FREQ_44_1KHZ: '44.1 kHz',
+                  SBCSamplingFrequency.FREQ_48KHZ: '48 kHz'},
+    'channel_mode': {SBCChannelMode.CHANNEL_MODE_MONO: 'mono',
+                     SBCChannelMode.CHANNEL_MODE_DUAL: 'dual channel',
+                     SBCChannelMode.CHANNEL_MODE_STEREO: 'stereo',
+                     SBCChannelMode.CHANNEL_MODE_JOINT_STEREO:
+                         'joint stereo'},
+    'allocation_method': {SBCAllocationMethod.LOUDNESS: 'loudness',
+                          SBCAllocationMethod.SNR: 'SNR'},
+    'subbands': {SBCSubbands.SUBBANDS_4: '4 subbands',
+                 SBCSubbands.SUBBANDS_8: '8 subbands'},
+    'block_length': {SBCBlocks.BLOCKS_4: '4 blocks',
+                     SBCBlocks.BLOCKS_8: '8 blocks',
+                     SBCBlocks.BLOCKS_12: '12 blocks',
+                     SBCBlocks.BLOCKS_16: '16 blocks'},
+}
+
+
+def default_bitpool(frequency, channel_mode):
+    """
+    The A2DP specification's recommended maximum bitpool for high
+    quality at a given sampling frequency and channel mode.
+
+    :param int frequency: :py:class:`.SBCSamplingFrequency` value
+    :param int channel_mode: :py:class:`.SBCChannelMode` value
+    :return: bitpool
+    :rtype: int
+    """
+    if (frequency == SBCSamplingFrequency.FREQ_44_1KHZ):
+        if (channel_mode in (SBCChannelMode.CHANNEL_MODE_MONO,
+                             SBCChannelMode.CHANNEL_MODE_DUAL)):
+            return 31
+        return 53
+    elif (frequency == SBCSamplingFrequency.FREQ_48KHZ):
+        if (channel_mode in (SBCChannelMode.CHANNEL_MODE_MONO,
+                             SBCChannelMode.CHANNEL_MODE_DUAL)):
+            return 29
+        return 51
+    return 53
+
+
+class SBCNegotiationPolicy:
+    """
+    Chooses the SBC configuration of a stream from the capabilities
+    of both endpoints, as bluez asks an endpoint to do through
+    `SelectConfiguration`.  A policy is passed to
+    :py:class:`.SBCAudioSink` or :py:class:`.SBCAudioSource`.
+
+    Every parameter, including the sampling frequency, is taken from
+    the intersection of the two sets of capabilities, in order of
+    preference.  The preferences follow the `optimize` goal:
+
+    * :py:attr:`QUALITY`: 44.1 kHz, joint stereo, 16 blocks and
+      8 subbands, i.e., the most widely supported high quality
+      configuration.
+    * :py:attr:`LATENCY`: 48 kHz, 4 blocks and 8 subbands, giving
+      the shortest frames and so the least audio held per packet.
+    * :py:attr:`CPU`: 32 kHz, plain stereo, 8 blocks and 4 subbands,
+      giving the fewest samples to filter and no joint stereo
+      analysis, e.g., for low power nodes.
+
+    Any preference may instead be given explicitly as a list of
+    values, most preferred first.  Values missing from a list are
+    never chosen.  The maximum bitpool is the recommended high quality
+    bitpool for the chosen frequency and channel mode (see
+    :py:func:`default_bitpool`), optionally capped by `max_bitpool`,
+    and limited to the range both endpoints support.
+
+    The reason for each choice of the last negotiation is kept in
+    :py:attr:`reasons`::
+
+        policy = SBCNegotiationPolicy(SBCNegotiationPolicy.CPU)
+        sink = SBCAudioSink(policy=policy)
+        ...
+        for reason in policy.reasons:
+            print reason.parameter, reason.reason
+
+    :param str optimize: Optimization goal
+    :param list frequencies: Optional :py:class:`.SBCSamplingFrequency`
+        preferences
+    :param list channel_modes: Optional :py:class:`.SBCChannelMode`
+        preferences
+    :param list block_lengths: Optional :py:class:`.SBCBlocks`
+        preferences
+    :param list subbands: Optional :py:class:`.SBCSubbands` preferences
+    :param list allocation_methods: Optional
+        :py:class:`.SBCAllocationMethod` preferences
+    :param int max_bitpool: Optional cap on the maximum bitpool
+
+    :Attributes:
+
+    * **reasons(list)**: :py:class:`NegotiationReason` for each
+        parameter chosen by the last call to :py:meth:`select`
+    """
+
+    QUALITY = 'quality'
+    """Prefer the highest audio quality"""
+    LATENCY = 'latency'
+    """Prefer the shortest SBC frames"""
+    CPU = 'cpu'
+    """Prefer the least encoding and decoding work"""
+
+    _PREFERENCES = {
+        QUALITY: {
+            'frequency': [SBCSamplingFrequency.FREQ_44_1KHZ,
+                          SBCSamplingFrequency.FREQ_48KHZ,
+                          SBCSamplingFrequency.FREQ_32KHZ,
+                          SBCSamplingFrequency.FREQ_16KHZ],
+            'channel_mode': [SBCChannelMode.CHANNEL_MODE_JOINT_STEREO,
+                             SBCChannelMode.CHANNEL_MODE_STEREO,
+                             SBCChannelMode.CHANNEL_MODE_DUAL,
+                             SBCChannelMode.CHANNEL_MODE_MONO],
+            'block_length': [SBCBlocks.BLOCKS_16, SBCBlocks.BLOCKS_12,
+                             SBCBlocks.BLOCKS_8, SBCBlocks.BLOCKS_4],
+            'subbands': [SBCSubbands.SUBBANDS_8, SBCSubbands.SUBBANDS_4],
+            'allocation_method': [SBCAllocationMethod.LOUDNESS,
+                                  SBCAllocationMethod.SNR],
+        },
+        LATENCY: {
+            'frequency': [SBCSamplingFrequency.FREQ_48KHZ,
+                          SBCSamplingFrequency.FREQ_44_1KHZ,
+                          SBCSamplingFrequency.FREQ_32KHZ,
+                          SBCSamplingFrequency.FREQ_16KHZ],
+            'channel_mode': [SBCChannelMode.CHANNEL_MODE_JOINT_STEREO,
+                             SBCChannelMode.CHANNEL_MODE_STEREO,
+                             SBCChannelMode.CHANNEL_MODE_DUAL,
+                             SBCChannelMode.CHANNEL_MODE_MONO],
+            'block_length': [SBCBlocks.BLOCKS_4, SBCBlocks.BLOCKS_8,
+                             SBCBlocks.BLOCKS_12, SBCBlocks.BLOCKS_16],
+            'subbands': [SBCSubbands.SUBBANDS_8, SBCSubbands.SUBBANDS_4],
+            'allocation_method': [SBCAllocationMethod.LOUDNESS,
+                                  SBCAllocationMethod.SNR],
+        },
+        CPU: {
+            'frequency': [SBCSamplingFrequency.FREQ_32KHZ,
+                          SBCSamplingFrequency.FREQ_44_1KHZ,
+                          SBCSamplingFrequency.FREQ_48KHZ,
+                          SBCSamplingFrequency.FREQ_16KHZ],
+            'channel_mode': [SBCChannelMode.CHANNEL_MODE_STEREO,
+                             SBCChannelMode.CHANNEL_MODE_JOINT_STEREO,
+                             SBCChannelMode.CHANNEL_MODE_DUAL,
+                             SBCChannelMode.CHANNEL_MODE_MONO],
+            'block_length': [SBCBlocks.BLOCKS_8, SBCBlocks.BLOCKS_12,
+                             SBCBlocks.BLOCKS_16, SBCBlocks.BLOCKS_4],
+            'subbands': [SBCSubbands.SUBBANDS_4, SBCSubbands.SUBBANDS_8],
+            'allocation_method': [SBCAllocationMethod.LOUDNESS,
+                                  SBCAllocationMethod.SNR],
+        },
+    }
+
+    def __init__(self, optimize=QUALITY, frequencies=None,
+                 channel_modes=None, block_lengths=None, subbands=None,
+                 allocation_methods=None, max_bitpool=None):
+        if (optimize not in SBCNegotiationPolicy._PREFERENCES):
+            raise ValueError('Unknown optimization goal %r' % optimize)
+        self.optimize = optimize
+        self.preferences = dict(SBCNegotiationPolicy._PREFERENCES[optimize])
+        self._explicit = set()
+        for (name, values) in (('frequency', frequencies),
+                               ('channel_mode', channel_modes),
+                               ('block_length', block_lengths),
+                               ('subbands', subbands),
+                               ('allocation_method', allocation_methods)):
+            if (values is not None):
+                self.preferences[name] = list(values)
+                self._explicit.add(name)
+        self.max_bitpool = max_bitpool
+        self.reasons = []
+
+    def _choose(self, name, ours, theirs, reasons):
+        preferred = self.preferences[name]
+        names = _NAMES[name]
+        source = 'configured' if name in self._explicit else self.optimize
+        for (rank, value) in enumerate(preferred):
+            if (not value & ours):
+                continue
+            if (not value & theirs):
+                continue
+            skipped = [names[v] for v in preferred[:rank]]
+            reason = '%s is the first %s preference supported by both ' \
+                'endpoints' % (names[value], source)
+            if (skipped):
+                reason += '; %s not common to both' % ', '.join(skipped)
+            reasons.append(NegotiationReason(name, value, reason))
+            return value
+        raise BTInvalidConfiguration('No common %s among %s preferences' %
+                                     (name.replace('_', ' '), source))
+
+    def select(self, our_caps, device_caps):
+        """
+        Choose a configuration and record the reasons in
+        :py:attr:`reasons`.
+
+        :param namedtuple our_caps: Local :py:class:`.SBCCodecConfig`
+            capabilities
+        :param namedtuple device_caps: Remote device's capabilities
+        :return: The chosen configuration
+        :rtype: :py:class:`.SBCCodecConfig`
+        :raises BTInvalidConfiguration: if the endpoints have no
+            acceptable value of a parameter in common
+        """
+        reasons = []
+        chosen = {}
+        for name in ('frequency', 'channel_mode', 'block_length',
+                     'subbands', 'allocation_method'):
+            chosen[name] = self._choose(name, getattr(our_caps, name),
+                                        getattr(device_caps, name), reasons)
+
+        min_bitpool = max(our_caps.min_bitpool, device_caps.min_bitpool)
+        max_bitpool = default_bitpool(chosen['frequency'],
+                                      chosen['channel_mode'])
+        reason = 'recommended for %s %s' % (
+            _NAMES['frequency'][chosen['frequency']],
+            _NAMES['channel_mode'][chosen['channel_mode']])
+        if (self.max_bitpool is not None and
+                self.max_bitpool < max_bitpool):
+            max_bitpool = self.max_bitpool
+            reason = 'capped by the policy'
+        if (device_caps.max_bitpool < max_bitpool):
+            max_bitpool = device_caps.max_bitpool
+            reason = 'limited by the device'
+        if (max_bitpool < min_bitpool):
+            raise BTInvalidConfiguration('No common bitpool range')
+        reasons.append(NegotiationReason('min_bitpool', min_bitpool,
+                                         'highest minimum of both '
+                                         'endpoints'))
+        reasons.append(NegotiationReason('max_bitpool', max_bitpool,
+                                         reason))
+        self.reasons = reasons
+        return SBCCodecConfig(chosen['channel_mode'],
+                              chosen['frequency'],
+                              chosen['allocation_method'],
+                              chosen['subbands'],
+                              chosen['block_length'],
+                              min_bitpool,
+                              max_bitpool)
@@ -0,0 +1,455 @@
+from __future__ import unicode_literals
+
+from collections import namedtuple, deque
+import fcntl
+import os
+import Queue
+import select
+import subprocess
+import threading
+import wave
+
+from codecs import SBCChannelMode
+
+
+PCMSinkStats = namedtuple('PCMSinkStats', 'blocks bytes consumers')
+"""
+Named tuple collection of PCM sink pipeline counters as returned by
+:py:meth:`PCMSinkPipeline.stats`
+"""
+
+PCMConsumerStats = namedtuple('PCMConsumerStats',
+                              'queued delivered dropped failed')
+"""
+Named tuple collection of PCM consumer counters as returned by
+:py:meth:`PCMSinkPipeline.consumer_stats`
+"""
+
+
+class PCMConsumer:
+    """
+    Base class of the consumers of a :py:class:`PCMSinkPipeline`.
+    Each consumer's methods are called on a thread of its own.
+    """
+    def open(self, rate, channels):
+        """
+        Called once before the first block.
+
+        :param int rate: Sampling frequency in Hz
+        :param int channels: Number of interleaved channels
+        :return:
+        """
+        pass
+
+    def write(self, block):
+        """
+        Called with each block of 16-bit little endian PCM.  An
+        exception stops any further blocks being delivered.
+
+        :param bytes block: PCM data
+        :return:
+        """
+        pass
+
+    def close(self):
+        """
+        Called once after the last block.
+
+        :return:
+        """
+        pass
+
+
+class RawFileConsumer(PCMConsumer):
+    """
+    Writes raw PCM to a file.
+
+    :param f: File name, or file object opened for writing in binary
+        mode.  A file opened here is closed at the end of the stream.
+    """
+    def __init__(self, f):
+        self._close = not hasattr(f, 'write')
+        self._file = open(f, 'wb') if self._close else f
+
+    def write(self, block):
+        self._file.write(block)
+
+    def close(self):
+        if (self._close):
+            self._file.close()
+        else:
+            self._file.flush()
+
+
+class WAVConsumer(PCMConsumer):
+    """
+    Writes PCM to a WAV file.
+
+    :param f: File name, or seekable file object opened for writing
+        in binary mode
+    """
+    def __init__(self, f):
+        self._f = f
+        self._wave = None
+
+    def open(self, rate, channels):
+        self._wave = wave.open(self._f, 'wb')
+        self._wave.setnchannels(channels)
+        self._wave.setsampwidth(2)
+        self._wave.setframerate(rate)
+
+    def write(self, block):
+        self._wave.writeframesraw(block)
+
+    def close(self):
+        if (self._wave):
+            self._wave.close()
+
+
+class CallbackConsumer(PCMConsumer):
+    """
+    Calls a function with each block.
+
+    :param func callback: Function called as `callback(block)`
+    """
+    def __init__(self, callback):
+        self.callback = callback
+
+    def write(self, block):
+        self.callback(block)
+
+
+class PipeConsumer(PCMConsumer):
+    """
+    Writes PCM to the standard input of another process, e.g.,
+    ``PipeConsumer(['aplay', '-q', '-f', 'cd'])``.  The process is
+    started when the consumer is added and waited for at the end of
+    the stream.  Unless `close_fds` is given, the process does not
+    inherit the media transport or any other file descriptor.
+
+    :param list args: Program and arguments
+    :param kwargs: Further arguments to :py:class:`subprocess.Popen`
+    """
+    def __init__(self, args, **kwargs):
+        self.args = args
+        self.kwargs = kwargs
+        self.kwargs.setdefault('close_fds', True)
+        self.process = None
+
+    def open(self, rate, channels):
+        self.process = subprocess.Popen(self.args, stdin=subprocess.PIPE,
+                                        **self.kwargs)
+
+    def write(self, block):
+        self.process.stdin.write(block)
+
+    def close(self):
+        if (self.process):
+            try:
+                self.process.stdin.close()
+            finally:
+                self.process.wait()
+
+
+class ArrayConsumer(PCMConsumer):
+    """
+    Iterable yielding each block as a NumPy int16 array of the shape
+    (samples, channels), for which NumPy is required.  Iteration ends
+    with the stream.  Blocks wait in a queue of `max_blocks` for the
+    iterating thread, after which the consumer's own queue in the
+    pipeline starts dropping::
+
+        consumer = pipeline.add(ArrayConsumer())
+        for samples in consumer:
+            print abs(samples).max()
+
+    :param int max_blocks: Maximum number of blocks waiting to be
+        iterated
+    """
+    def __init__(self, max_blocks=8):
+        self.channels = None
+        self._queue = Queue.Queue(max_blocks)
+
+    def open(self, rate, channels):
+        self.channels = channels
+
+    def write(self, block):
+        self._queue.put(block)
+
+    def close(self):
+        self._queue.put(None)
+
+    def __iter__(self):
+        import numpy
+        while True:
+            block = self._queue.get()
+            if (block is None):
+                return
+            yield numpy.frombuffer(block, dtype='<i2').reshape(
+                -1, self.channels)
+
+
+class _ConsumerQueue:
+    """
+    Bounded queue and thread delivering blocks to one consumer
+    """
+    def __init__(self, consumer, max_queue, rate, channels):
+        self.consumer = consumer
+        self.max_queue = max_queue
+        self.error = None
+        self._format = (rate, channels)
+        self._queue = deque()
+        self._cond = threading.Condition()
+        self._closed = False
+        self._delivered = 0
+        self._dropped = 0
+        self._thread = threading.Thread(target=self._run,
+                                        name='bt-manager-pcm-consumer')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def put(self, block):
+        with self._cond:
+            if (self._closed or self.error):
+                return
+            self._queue.append(block)
+            if (len(self._queue) > self.max_queue):
+                self._queue.popleft()
+                self._dropped += 1
+            self._cond.notify()
+
+    def _fail(self, e):
+        with self._cond:
+            self.error = e
+            self._dropped += len(self._queue)
+            self._queue.clear()
+
+    def _run(self):
+        try:
+            self.consumer.open(*self._format)
+        except Exception as e:
+            self._fail(e)
+        while True:
+            with self._cond:
+                while (not self._queue and not self._closed):
+                    self._cond.wait()
+                if (not self._queue):
+                    break
+                block = self._queue.popleft()
+            try:
+                self.consumer.write(block)
+                self._delivered += 1
+            except Exception as e:
+                self._fail(e)
+        try:
+            self.consumer.close()
+        except Exception as e:
+            if (self.error is None):
+                self.error = e
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+        if (self._thread is not threading.current_thread()):
+            self._thread.join()
+
+    def stats(self):
+        with self._cond:
+            return PCMConsumerStats(len(self._queue), self._delivered,
+                                    self._dropped, self.error is not None)
+
+
+class PCMSinkPipeline:
+    """
+    Drains an :py:class:`.SBCAudioSink` media transport on a dedicated
+    I/O thread and hands the decoded PCM to any number of consumers.
+
+    The I/O thread waits for the transport to become readable, decodes
+    every packet available straight into its block buffer and cuts it
+    into blocks of `block_time` seconds.  Each block is handed, as one
+    immutable bytes object shared by all, to the bounded queue of every
+    consumer, which is served by a thread of the consumer's own.  A
+    consumer stalled on a disk or a slow process only fills its own
+    queue, after which its oldest blocks are dropped, so it never holds
+    up reading the transport or the other consumers.  A consumer which
+    raises is stopped on its own.
+
+    The transport file descriptor is made non-blocking.
+
+    A pipeline should be obtained from an endpoint whose media
+    transport has been acquired with :py:meth:`.SBCAudioSink.pcm_sink`::
+
+        pipeline = sink.pcm_sink()
+        pipeline.add(WAVConsumer('capture.wav'))
+        pipeline.add(PipeConsumer(['aplay', '-q', '-f', 'cd']))
+        pipeline.start()
+
+    :param codec: :py:class:`.SBCCodec` configured for the stream.  It
+        must not be used by anything else while the pipeline runs.
+    :param int fd: Media transport file descriptor
+    :param int mtu: Media transport read MTU
+    :param namedtuple config: Negotiated :py:class:`.SBCCodecConfig`
+    :param float block_time: Duration of each block in seconds
+    :param int max_queue: Default maximum number of blocks queued per
+        consumer
+    """
+    def __init__(self, codec, fd, mtu, config, block_time=0.05,
+                 max_queue=32):
+        self.codec = codec
+        self.fd = fd
+        self.mtu = mtu
+        self.max_queue = max_queue
+        self.error = None
+        self.rate = codec._rate
+        self.channels = 1 if (config.channel_mode ==
+                              SBCChannelMode.CHANNEL_MODE_MONO) else 2
+        frames = max(int(block_time * self.rate * self.channels * 2 //
+                         codec.codesize), 1)
+        self.block_size = frames * codec.codesize
+        # Room for one more packet of at most 15 frames past a block
+        self._buf = bytearray(self.block_size + 15 * codec.codesize)
+        self._fill = 0
+        self._consumers = []
+        self._lock = threading.Lock()
+        self._thread = None
+        self._running = False
+        self._blocks = 0
+        self._bytes = 0
+
+    def add(self, consumer, max_queue=None):
+        """
+        Add a consumer.  Consumers may be added while the pipeline
+        runs, in which case they receive blocks from then on.
+
+        :param consumer: :py:class:`PCMConsumer` instance
+        :param int max_queue: Optional maximum number of blocks queued
+            for the consumer
+        :return: `consumer`
+        """
+        queue = _ConsumerQueue(consumer, max_queue or self.max_queue,
+                               self.rate, self.channels)
+        with self._lock:
+            self._consumers.append(queue)
+        return consumer
+
+    def remove(self, consumer):
+        """
+        Remove a consumer once the blocks queued for it have been
+        delivered, and close it.
+
+        :param consumer: Consumer passed to :py:meth:`add`
+        :return:
+        """
+        with self._lock:
+            queues = [q for q in self._consumers if q.consumer is consumer]
+            self._consumers = [q for q in self._consumers
+                               if q.consumer is not consumer]
+        for queue in queues:
+            queue.close()
+
+    def _queue(self, consumer):
+        with self._lock:
+            for queue in self._consumers:
+                if (queue.consumer is consumer):
+                    return queue
+
+    def start(self):
+        """
+        Start the I/O thread.
+
+        :return:
+        """
+        if (self._running):
+            return
+        flags = fcntl.fcntl(self.fd, fcntl.F_GETFL)
+        fcntl.fcntl(self.fd, fcntl.F_SETFL, flags | os.O_NONBLOCK)
+        self._running = True
+        self._thread = threading.Thread(target=self._run,
+                                        name='bt-manager-pcm-sink')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _emit(self, size):
+        block = bytes(self._buf[:size])
+        self._buf[:self._fill - size] = self._buf[size:self._fill]
+        self._fill -= size
+        self._blocks += 1
+        self._bytes += size
+        with self._lock:
+            queues = list(self._consumers)
+        for queue in queues:
+            queue.put(block)
+
+    def _run(self):
+        poll = select.poll()
+        poll.register(self.fd, select.POLLIN)
+        view = memoryview(self._buf)
+        try:
+            while (self._running):
+                events = poll.poll(100)
+                if (not events):
+                    continue
+                size = self.codec.decode_into(self.fd, self.mtu,
+                                              view[self._fill:])
+                self._fill += size
+                while (self._fill >= self.block_size):
+                    self._emit(self.block_size)
+                if (not size and
+                        events[0][1] & (select.POLLHUP | select.POLLERR)):
+                    break
+        except Exception as e:
+            self.error = e
+        del view
+        if (self._fill):
+            self._emit(self._fill)
+        self._running = False
+
+    def stop(self):
+        """
+        Stop reading the transport, pass any partial block to the
+        consumers and close each of them once their queued blocks have
+        been delivered.  The pipeline may not be started again.
+
+        :return:
+        """
+        self._running = False
+        if (self._thread is not None and
+                self._thread is not threading.current_thread()):
+            self._thread.join()
+        with self._lock:
+            queues = list(self._consumers)
+        for queue in queues:
+            queue.close()
+
+    def is_running(self):
+        """
+        :return: `True` until the pipeline is stopped or the transport
+            is closed by the remote device
+        :rtype: boolean
+        """
+        return self._running
+
+    def stats(self):
+        """
+        Obtain pipeline counters.
+
+        :return: the number of blocks and PCM bytes handed to the
+            consumers and the number of consumers
+        :rtype: :py:class:`PCMSinkStats`
+        """
+        with self._lock:
+            consumers = len(self._consumers)
+        return PCMSinkStats(self._blocks, self._bytes, consumers)
+
+    def consumer_stats(self, consumer):
+        """
+        Obtain a consumer's counters.
+
+        :param consumer: Consumer passed to :py:meth:`add`
+        :return: the number of blocks queued for the consumer, delivered
+            to it and dropped, either because its queue overflowed or it
+            failed, and whether it failed
+        :rtype: :py:class:`PCMConsumerStats`
+        """
+        return self._queue(consumer).stats()
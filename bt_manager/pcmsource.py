@@ -0,0 +1,409 @@
+from __future__ import unicode_literals
+
+from collections import namedtuple
+import threading
+import time
+
+from codecs import SBCChannelMode
+
+
+PCMSourceStats = namedtuple('PCMSourceStats',
+                            'fill capacity ticks underruns stalled skipped '
+                            'max_lateness')
+"""
+Named tuple collection of PCM source pipeline counters as returned by
+:py:meth:`PCMSourcePipeline.stats`.  ``fill`` and ``capacity`` are in
+bytes of PCM, ``stalled`` counts ticks on which the media transport
+had not accepted the previous packets and ``max_lateness`` is the
+largest number of seconds a tick started after its due time.
+"""
+
+
+class PCMRingBuffer:
+    """
+    Fixed size byte ring buffer carrying PCM from one producer thread
+    to one consumer thread without a lock.
+
+    The producer only ever advances the write count and the consumer
+    the read count, each after copying its data, so with a single
+    thread on either side neither can observe a half-written region.
+    It must not be shared by more than one producer or consumer.
+
+    :param int capacity: Size of the buffer in bytes
+    """
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self._buf = bytearray(capacity)
+        self._view = memoryview(self._buf)
+        self._written = 0
+        self._read = 0
+
+    @property
+    def fill(self):
+        """
+        Number of bytes waiting to be read
+        """
+        return self._written - self._read
+
+    @property
+    def space(self):
+        """
+        Number of bytes which may be written without overwriting
+        unread data
+        """
+        return self.capacity - self.fill
+
+    def write(self, data):
+        """
+        Copy as much of `data` into the buffer as there is space for.
+
+        :param data: Bytes-like object e.g., bytes, bytearray or a
+            memoryview of bytes
+        :return: Number of bytes written
+        :rtype: int
+        """
+        size = min(len(data), self.space)
+        start = self._written % self.capacity
+        first = min(size, self.capacity - start)
+        self._view[start:start + first] = data[:first]
+        self._view[0:size - first] = data[first:size]
+        self._written += size
+        return size
+
+    def readinto(self, buf):
+        """
+        Move as many bytes as are available, up to the size of `buf`,
+        out of the buffer.
+
+        :param buf: Writable bytes-like object e.g., bytearray or a
+            memoryview of one
+        :return: Number of bytes read into `buf`
+        :rtype: int
+        """
+        size = min(len(buf), self.fill)
+        start = self._read % self.capacity
+        first = min(size, self.capacity - start)
+        buf[:first] = self._view[start:start + first]
+        buf[first:size] = self._view[0:size - first]
+        self._read += size
+        return size
+
+
+class FileProducer:
+    """
+    Reads raw PCM from a file.
+
+    :param f: File name, or file object opened for reading in binary
+        mode.  A file opened here is closed at the end of the data.
+    """
+    def __init__(self, f):
+        self._close = not hasattr(f, 'read')
+        self._file = open(f, 'rb') if self._close else f
+
+    def read(self, size):
+        """
+        :param int size: Maximum number of bytes to return
+        :return: PCM data, empty at the end of the file
+        :rtype: bytes
+        """
+        data = self._file.read(size)
+        if (not data and self._close):
+            self._file.close()
+        return data
+
+
+class GeneratorProducer:
+    """
+    Reads PCM from an iterable, e.g., a generator, yielding
+    bytes-like chunks of any size.
+
+    :param iterable: Iterable of PCM chunks
+    """
+    def __init__(self, iterable):
+        self._iter = iter(iterable)
+        self._chunk = b''
+        self._offset = 0
+
+    def read(self, size):
+        """
+        :param int size: Maximum number of bytes to return
+        :return: PCM data, empty once the iterable is exhausted
+        :rtype: bytes
+        """
+        while (self._offset >= len(self._chunk)):
+            try:
+                self._chunk = next(self._iter)
+            except StopIteration:
+                return b''
+            self._offset = 0
+        data = self._chunk[self._offset:self._offset + size]
+        self._offset += len(data)
+        return data
+
+
+class ArrayProducer:
+    """
+    Reads PCM from an array of 16-bit samples, e.g., an
+    ``array.array('h')`` or a NumPy array.  A NumPy array is made
+    contiguous and little endian, and floating point samples in the
+    range -1.0 to 1.0 are scaled to 16-bit integers, in which case
+    NumPy is required.  Multi-channel samples are interleaved, i.e.,
+    a NumPy array has the shape (samples, channels).
+
+    :param array: Array of samples
+    """
+    def __init__(self, array):
+        if (hasattr(array, 'dtype')):
+            import numpy
+            if (array.dtype.kind == 'f'):
+                array = numpy.clip(array, -1.0, 1.0) * 32767
+            array = numpy.ascontiguousarray(array, dtype='<i2')
+        self._array = array
+        self._data = buffer(array)
+        self._offset = 0
+
+    def read(self, size):
+        """
+        :param int size: Maximum number of bytes to return
+        :return: PCM data, empty at the end of the array
+        :rtype: bytes
+        """
+        data = self._data[self._offset:self._offset + size]
+        self._offset += len(data)
+        return data
+
+
+class PCMSourcePipeline:
+    """
+    Feeds an :py:class:`.SBCAudioSource` media transport from a PCM
+    producer at the real time rate of the stream.
+
+    Two threads share a :py:class:`PCMRingBuffer`.  A feeder thread
+    pulls PCM from the producer whenever the ring has space, and a
+    pacing thread wakes once per packet duration, that is the number
+    of SBC frames which fit in one MTU times the frame duration, and
+    encodes exactly one MTU's worth of frames from the ring.  The
+    transport is therefore never flooded, and its latency is bounded
+    by the packets the codec may queue, while the ring absorbs jitter
+    in the producer.  PCM the codec could not take is encoded on the
+    next tick, before any more is read from the ring, and at the end
+    of the stream the pipeline finishes once the transport has taken
+    the last packet.
+
+    On an underrun the packet is completed with silence so that the
+    stream's timing is kept, and the first packet after the underrun
+    carries the RTP marker.  If the pacing thread falls more than
+    `max_burst` packets behind, e.g., when the process was suspended,
+    the missed ticks are skipped rather than sent in a burst.
+
+    A producer is any object with a ``read(size)`` method returning
+    up to `size` bytes of 16-bit little endian PCM in the negotiated
+    format, and an empty result at the end of the stream, such as
+    :py:class:`FileProducer`, :py:class:`GeneratorProducer` or
+    :py:class:`ArrayProducer`.
+
+    A pipeline should be obtained from an endpoint whose media
+    transport has been acquired with
+    :py:meth:`.SBCAudioSource.pcm_source`::
+
+        pipeline = source.pcm_source(buffer_time=0.2)
+        pipeline.start(FileProducer('music.raw'))
+        pipeline.wait()
+
+    :param codec: :py:class:`.SBCCodec` configured for the stream.  It
+        must not be used by anything else while the pipeline runs.
+    :param int fd: Media transport file descriptor
+    :param int mtu: Media transport write MTU
+    :param namedtuple config: Negotiated :py:class:`.SBCCodecConfig`
+    :param float buffer_time: Size of the ring buffer in seconds
+    :param int max_packets: Maximum number of packets queued by the
+        codec for the transport
+    :param int max_burst: Most packets sent back to back to catch up
+        with the clock
+    :param controller: Optional :py:class:`.SBCBitpoolController`
+        updated on every tick
+    """
+    def __init__(self, codec, fd, mtu, config, buffer_time=0.2,
+                 max_packets=4, max_burst=4, controller=None):
+        self.codec = codec
+        self.fd = fd
+        self.mtu = mtu
+        self.max_burst = max_burst
+        self.controller = controller
+        self.error = None
+        payload = mtu - codec.codec.RTP_SBC_HEADER_SIZE
+        # frame_count is a 4-bit field
+        frames = max(min(payload // codec.frame_length, 15), 1)
+        channels = 1 if (config.channel_mode ==
+                         SBCChannelMode.CHANNEL_MODE_MONO) else 2
+        frame_samples = codec.codesize // (2 * channels)
+        self.period = float(frames * frame_samples) / codec._rate
+        self._chunk = bytearray(frames * codec.codesize)
+        # Frames larger than the MTU are sent as several fragments
+        self._packets = max(-(-codec.frame_length // payload), 1)
+        self.max_packets = max(max_packets, self._packets)
+        ticks = max(int(buffer_time / self.period), 2)
+        self.ring = PCMRingBuffer(ticks * len(self._chunk))
+        self._feeder = None
+        self._pacer = None
+        self._running = False
+        self._eof = False
+        self._ready = threading.Event()
+        self._space = threading.Event()
+        self._done = threading.Event()
+        self._ticks = 0
+        self._underruns = 0
+        self._stalled = 0
+        self._skipped = 0
+        self._max_lateness = 0.0
+
+    def start(self, producer):
+        """
+        Start pulling PCM from the producer and, once the ring buffer
+        is half full or the producer has ended, sending it to the media
+        transport.
+
+        :param producer: PCM producer
+        :return:
+        """
+        if (self._running):
+            return
+        self._running = True
+        self._eof = False
+        self._ready.clear()
+        self._done.clear()
+        self._feeder = threading.Thread(target=self._feed, args=(producer,),
+                                        name='bt-manager-pcm-feeder')
+        self._pacer = threading.Thread(target=self._pace,
+                                       name='bt-manager-pcm-pacer')
+        for thread in (self._feeder, self._pacer):
+            thread.daemon = True
+            thread.start()
+
+    def _feed(self, producer):
+        try:
+            while (self._running):
+                space = self.ring.space
+                if (not space):
+                    self._space.clear()
+                    if (not self.ring.space):
+                        self._space.wait(self.period)
+                    continue
+                data = producer.read(space)
+                if (not len(data)):
+                    break
+                self.ring.write(data)
+                if (self.ring.fill >= self.ring.capacity // 2):
+                    self._ready.set()
+        except Exception as e:
+            self.error = e
+        self._eof = True
+        self._ready.set()
+
+    def _pace(self):
+        while (self._running and not self._ready.wait(self.period)):
+            pass
+        due = time.time()
+        underrun = False
+        finished = False
+        # Part of the chunk the codec has yet to consume
+        start = end = 0
+        while (self._running):
+            delay = due - time.time()
+            if (delay > 0):
+                time.sleep(delay)
+            lateness = time.time() - due
+            self._max_lateness = max(self._max_lateness, lateness)
+            if (lateness > self.max_burst * self.period):
+                missed = int(lateness // self.period)
+                self._skipped += missed
+                due += missed * self.period
+            due += self.period
+            self._ticks += 1
+            try:
+                if (self.codec.pending):
+                    self.codec.flush(self.fd)
+                if (self.controller):
+                    self.controller.update()
+                if (finished and start == end):
+                    # Done once the transport has taken every packet
+                    if (not self.codec.pending):
+                        break
+                    continue
+                if (self.max_packets - self.codec.pending < self._packets):
+                    self._stalled += 1
+                    continue
+                if (start < end):
+                    start += self._encode(start, end)
+                    continue
+                eof = self._eof
+                size = self.ring.readinto(self._chunk)
+                self._space.set()
+                if (eof and size < len(self._chunk)):
+                    # The last frame is completed with silence
+                    end = -(-size // self.codec.codesize) * \
+                        self.codec.codesize
+                    self._chunk[size:end] = bytearray(end - size)
+                    finished = True
+                else:
+                    end = len(self._chunk)
+                    if (size < end):
+                        self._chunk[size:] = bytearray(end - size)
+                        self._underruns += 1
+                        underrun = True
+                    elif (underrun):
+                        self.codec.set_marker()
+                        underrun = False
+                start = self._encode(0, end) if end else 0
+                if (finished and start == end and not self.codec.pending):
+                    break
+            except OSError as e:
+                self.error = e
+                break
+        self._running = False
+        self._space.set()
+        self._done.set()
+
+    def _encode(self, start, end):
+        return self.codec.encode_batch(self.fd, self.mtu,
+                                       memoryview(self._chunk)[start:end],
+                                       self.max_packets)
+
+    def stop(self):
+        """
+        Stop the pipeline, discarding any PCM left in the ring buffer.
+
+        :return:
+        """
+        self._running = False
+        self._space.set()
+        self._ready.set()
+        for thread in (self._feeder, self._pacer):
+            if (thread is not None and
+                    thread is not threading.current_thread()):
+                thread.join()
+        self._done.set()
+
+    def wait(self, timeout=None):
+        """
+        Wait for the producer's data to have been accepted by the media
+        transport, or the pipeline to be stopped or fail.
+
+        :param float timeout: Optional time in seconds to wait
+        :return: `True` if the pipeline has finished
+        :rtype: boolean
+        """
+        return self._done.wait(timeout)
+
+    def stats(self):
+        """
+        Obtain pipeline counters.
+
+        :return: the ring buffer fill level and capacity, the number of
+            ticks, underruns, ticks stalled by the transport and ticks
+            skipped, and the largest tick lateness
+        :rtype: :py:class:`PCMSourceStats`
+        """
+        return PCMSourceStats(self.ring.fill, self.ring.capacity,
+                              self._ticks, self._underruns, self._stalled,
+                              self._skipped, self._max_lateness)
@@ -0,0 +1,220 @@
+from __future__ import unicode_literals
+
+import collections
+import threading
+
+
+class BTPendingCall:
+    """
+    Handle for a non-blocking dbus method call, as returned by
+    :py:meth:`.BTSimpleInterface.call_async` and the ``*_async``
+    variants of the wrapper methods.
+
+    Replies and errors are delivered by dbus on the main loop thread,
+    so :py:meth:`wait` must only be used from another thread.  Code
+    running on the main loop should use :py:meth:`add_done_callback`
+    instead.
+
+    :Attributes:
+
+    * **result**: Return value of the method call once it has
+        completed.  Methods returning several values give a tuple.
+    * **exception**: Exception raised by the method call (normally
+        a dbus.DBusException), otherwise `None`.
+    """
+    def __init__(self):
+        self.result = None
+        self.exception = None
+        self._callbacks = []
+        self._done = threading.Event()
+        self._lock = threading.Lock()
+
+    def _complete(self):
+        with self._lock:
+            self._done.set()
+            callbacks = self._callbacks
+            self._callbacks = []
+        for cb in callbacks:
+            cb(self)
+
+    def set_result(self, result):
+        """
+        Complete the call with a return value.
+
+        :param result: Method return value
+        :return:
+        """
+        self.result = result
+        self._complete()
+
+    def set_exception(self, exception):
+        """
+        Complete the call with an error.
+
+        :param exception: Exception raised by the method call
+        :return:
+        """
+        self.exception = exception
+        self._complete()
+
+    def reply_handler(self, *args):
+        """
+        dbus reply handler completing the call with the method's
+        return value(s).
+        """
+        if (len(args) == 0):
+            self.set_result(None)
+        elif (len(args) == 1):
+            self.set_result(args[0])
+        else:
+            self.set_result(args)
+
+    def error_handler(self, exception):
+        """
+        dbus error handler completing the call with an error.
+        """
+        self.set_exception(exception)
+
+    def add_done_callback(self, fn):
+        """
+        Call `fn` with this handle once the call has completed, or
+        straight away if it already has.
+
+        :param func fn: Callback function
+        :return:
+        """
+        with self._lock:
+            if (not self._done.is_set()):
+                self._callbacks.append(fn)
+                return
+        fn(self)
+
+    def done(self):
+        """
+        :return: `True` if the call has completed
+        :rtype: boolean
+        """
+        return self._done.is_set()
+
+    def wait(self, timeout=None):
+        """
+        Block until the call completes.
+
+        :param float timeout: Optional timeout in seconds
+        :return: Return value of the method call, or `None`
+            if the timeout expired.
+        :raises Exception: any exception raised by the method
+            call is re-raised here.
+        """
+        self._done.wait(timeout)
+        if (self.exception):
+            raise self.exception
+        return self.result
+
+
+class BTCallLimiter:
+    """
+    Runs non-blocking method calls with a bounded number of calls
+    in flight at once, starting queued calls as earlier ones complete.
+    For example, to connect many speakers in parallel but no more than
+    eight at a time::
+
+        limiter = BTCallLimiter(8)
+        calls = [limiter.submit(sink.connect_async) for sink in sinks]
+        limiter.gather(calls).add_done_callback(all_connected)
+
+    :param int max_in_flight: Maximum number of calls in flight.
+    """
+    def __init__(self, max_in_flight=4):
+        self.max_in_flight = max_in_flight
+        self._in_flight = 0
+        self._queue = collections.deque()
+        self._lock = threading.Lock()
+
+    def submit(self, fn, *args, **kwargs):
+        """
+        Queue a call to be started when fewer than `max_in_flight`
+        calls are in flight.
+
+        :param func fn: Function starting a non-blocking call and
+            returning its :py:class:`BTPendingCall` e.g.,
+            ``device.discover_services_async``
+        :param args: Arguments passed to `fn`
+        :param kwargs: Keyword arguments passed to `fn`
+        :return: Handle completing with the started call
+        :rtype: :py:class:`BTPendingCall`
+        """
+        call = BTPendingCall()
+        with self._lock:
+            self._queue.append((call, fn, args, kwargs))
+        self._start()
+        return call
+
+    def _start(self):
+        while True:
+            with self._lock:
+                if (self._in_flight >= self.max_in_flight or
+                        not self._queue):
+                    return
+                self._in_flight += 1
+                (call, fn, args, kwargs) = self._queue.popleft()
+            try:
+                fn(*args, **kwargs).add_done_callback(
+                    lambda c, call=call: self._call_done(call, c))
+            except Exception as e:
+                self._call_done(call, None, e)
+
+    def _call_done(self, call, inner, exception=None):
+        with self._lock:
+            self._in_flight -= 1
+        if (inner is not None):
+            exception = inner.exception
+        if (exception is not None):
+            call.set_exception(exception)
+        else:
+            call.set_result(inner.result)
+        self._start()
+
+    def in_flight(self):
+        """
+        :return: number of calls in flight
+        :rtype: int
+        """
+        return self._in_flight
+
+    def pending(self):
+        """
+        :return: number of calls queued but not yet started
+        :rtype: int
+        """
+        return len(self._queue)
+
+    @staticmethod
+    def gather(calls):
+        """
+        Combine several calls into one which completes when all of
+        them have.
+
+        :param list calls: :py:class:`BTPendingCall` handles
+        :return: Handle whose result is the list of each call's
+            result, or its exception if it failed, in order
+        :rtype: :py:class:`BTPendingCall`
+        """
+        combined = BTPendingCall()
+        calls = list(calls)
+        remaining = [len(calls)]
+        lock = threading.Lock()
+
+        def call_done(c):
+            with lock:
+                remaining[0] -= 1
+                last = (remaining[0] == 0)
+            if (last):
+                combined.set_result([x.exception if x.exception else x.result
+                                     for x in calls])
+
+        if (not calls):
+            combined.set_result([])
+        for c in calls:
+            c.add_done_callback(call_done)
+        return combined
@@ -0,0 +1,225 @@
+from __future__ import unicode_literals
+
+from collections import namedtuple
+import dbus
+import weakref
+
+
+RegistryStats = namedtuple('RegistryStats',
+                           'proxies wrappers pinned hits misses evictions')
+"""
+Named tuple collection of registry counters as returned by
+:py:meth:`BTObjectRegistry.stats`
+"""
+
+
+class BTObjectRegistry:
+    """
+    Process-wide registry of the system bus connection, bluez proxy
+    objects and interface wrappers.
+
+    Every :py:class:`.BTSimpleInterface` obtains its bus and proxy
+    object from the registry so that only one proxy is created for
+    each object path.  Interface wrappers may also be shared by
+    looking them up with :py:meth:`get_wrapper` which constructs the
+    wrapper only if no live instance exists for the same (path, class).
+
+    Wrappers are held by weak reference so that their lifetime is
+    controlled by the user, unless they are pinned.  Proxies, wrappers
+    and pins for an object path (and all paths below it) are evicted
+    with :py:meth:`evict`, automatically when
+    :py:meth:`watch_removals` is enabled and bluez removes an adapter
+    or device, and when the system bus connection changes.
+
+    .. note:: A shared wrapper also shares its signal receivers since
+        :py:class:`.BTInterface` keeps one callback per signal name.
+        Only wrappers that are used for method calls and properties
+        should be shared.
+    """
+    def __init__(self):
+        self._bus = None
+        self._proxies = {}
+        self._wrappers = weakref.WeakValueDictionary()
+        self._pinned = {}
+        self._watching = False
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+
+    def get_bus(self):
+        """
+        Obtain the shared system bus connection.
+
+        dbus-python hands back its shared connection from
+        :py:func:`dbus.SystemBus` so this is cheap, but should the
+        connection ever change (e.g., after the bus was restarted)
+        all cached proxies and wrappers are discarded.
+
+        :return: system bus connection
+        :rtype: dbus.Bus
+        """
+        bus = dbus.SystemBus()
+        if (bus is not self._bus):
+            watching = self._watching
+            self.clear()
+            self._bus = bus
+            if (watching):
+                self.watch_removals()
+        return bus
+
+    def get_object(self, path):
+        """
+        Obtain the bluez proxy object for the given object path,
+        creating it only on first use.
+
+        :param str path: Object path e.g., '/org/bluez/985/hci0'
+        :return: proxy object
+        """
+        bus = self.get_bus()
+        proxy = self._proxies.get(path)
+        if (proxy is None):
+            proxy = bus.get_object('org.bluez', path)
+            self._proxies[path] = proxy
+        return proxy
+
+    def get_wrapper(self, cls, object_path, pinned=False, **kwargs):
+        """
+        Obtain a live interface wrapper of the given class for the
+        given object path.  If there is none, one is created by calling
+        ``cls(**kwargs)``.
+
+        :param class cls: Wrapper class e.g., :py:class:`.BTAdapter`
+        :param str object_path: Object path that the wrapper is opened on
+        :param bool pinned: Keep a strong reference to the wrapper
+            until it is evicted.  This suits long-lived objects such
+            as the manager and adapters.
+        :param kwargs: Arguments used to construct the wrapper
+        :return: interface wrapper instance
+        """
+        self.get_bus()
+        key = (object_path, cls)
+        wrapper = self._wrappers.get(key)
+        if (wrapper is None):
+            self._misses += 1
+            wrapper = cls(**kwargs)
+            self._wrappers[key] = wrapper
+        else:
+            self._hits += 1
+        if (pinned):
+            self._pinned[key] = wrapper
+        return wrapper
+
+    def lookup(self, cls, object_path):
+        """
+        Obtain the live wrapper of the given class for an object path
+        without creating one.
+
+        :param class cls: Wrapper class e.g., :py:class:`.BTAdapter`
+        :param str object_path: Object path that the wrapper is opened on
+        :return: interface wrapper instance or None
+        """
+        return self._wrappers.get((object_path, cls))
+
+    def get_wrappers(self, cls):
+        """
+        Obtain all live wrappers of the given class.
+
+        :param class cls: Wrapper class e.g., :py:class:`.BTAdapter`
+        :return: list of wrapper instances
+        :rtype: list
+        """
+        return [w for (k, w) in self._wrappers.items() if k[1] is cls]
+
+    def evict(self, path):
+        """
+        Discard the proxy, wrappers and pins for an object path and for
+        all object paths below it.
+
+        :param str path: Object path e.g.,
+            '/org/bluez/985/hci0/dev_00_11_67_D2_AB_EE'
+        :return:
+        """
+        prefix = path + '/'
+        for p in self._proxies.keys():
+            if (p == path or p.startswith(prefix)):
+                del self._proxies[p]
+                self._evictions += 1
+        for cache in (self._wrappers, self._pinned):
+            for key in cache.keys():
+                if (key[0] == path or key[0].startswith(prefix)):
+                    cache.pop(key, None)
+
+    def forget(self, object_path, cls):
+        """
+        Drop the wrapper of the given class for an object path, leaving
+        the proxy and any other wrappers in place.
+
+        :param str object_path: Object path that the wrapper is opened on
+        :param class cls: Wrapper class e.g., :py:class:`.BTAdapter`
+        :return:
+        """
+        self._wrappers.pop((object_path, cls), None)
+        self._pinned.pop((object_path, cls), None)
+
+    def _removed_handler(self, path):
+        self.evict(path)
+
+    def watch_removals(self):
+        """
+        Evict objects automatically when bluez signals that an adapter
+        (AdapterRemoved) or a device (DeviceRemoved) has been removed.
+        Two match rules are installed on the shared bus.
+
+        :return:
+        """
+        bus = self.get_bus()
+        if (not self._watching):
+            bus.add_signal_receiver(self._removed_handler,
+                                    'AdapterRemoved',
+                                    dbus_interface='org.bluez.Manager')
+            bus.add_signal_receiver(self._removed_handler,
+                                    'DeviceRemoved',
+                                    dbus_interface='org.bluez.Adapter')
+            self._watching = True
+
+    def clear(self):
+        """
+        Discard all cached proxies, wrappers and pins and stop
+        watching for removals.
+
+        :return:
+        """
+        if (self._watching and self._bus is not None):
+            try:
+                self._bus.remove_signal_receiver(self._removed_handler,
+                                                 'AdapterRemoved',
+                                                 dbus_interface='org.bluez.Manager')  # noqa
+                self._bus.remove_signal_receiver(self._removed_handler,
+                                                 'DeviceRemoved',
+                                                 dbus_interface='org.bluez.Adapter')  # noqa
+            except dbus.DBusException:
+                pass
+        self._watching = False
+        self._bus = None
+        self._proxies.clear()
+        self._wrappers.clear()
+        self._pinned.clear()
+
+    def stats(self):
+        """
+        Obtain registry counters.
+
+        :return: the number of cached proxies, live wrappers and pinned
+            wrappers, wrapper look-up hits and misses, and the number of
+            evicted proxies
+        :rtype: :py:class:`RegistryStats`
+        """
+        return RegistryStats(len(self._proxies), len(self._wrappers),
+                             len(self._pinned), self._hits, self._misses,
+                             self._evictions)
+
+
+registry = BTObjectRegistry()
+"""
+The process-wide :py:class:`BTObjectRegistry` instance
+"""
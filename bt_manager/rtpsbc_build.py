@@ -0,0 +1,30 @@
+"""
+CFFI build script for the out-of-line ``bt_manager._rtpsbc`` extension
+module.  This is invoked by setup.py through ``cffi_modules`` so that the
+RTP/SBC codec bindings are compiled once at install time rather than
+every time an :py:class:`.SBCCodec` is created.
+
+The extension links against ``librtpsbc`` which must first be installed
+using ``sudo make -C codecs install``.
+"""
+from __future__ import unicode_literals
+
+import os
+
+import cffi
+
+cwd = os.path.dirname(os.path.abspath(__file__))
+header_file = os.path.join(cwd, 'rtpsbc.h')
+
+ffibuilder = cffi.FFI()
+with open(header_file) as fh:
+    ffibuilder.cdef(fh.read())
+
+ffibuilder.set_source(str('bt_manager._rtpsbc'),
+                      str('#include <sys/types.h>\n'
+                          '#include <stdint.h>\n'
+                          '#include "rtpsbc.h"\n'),
+                      libraries=[str('rtpsbc')])
+
+if __name__ == '__main__':
+    ffibuilder.compile(verbose=True)
@@ -0,0 +1,238 @@
+from __future__ import unicode_literals
+
+from collections import namedtuple, deque
+import threading
+import time
+import traceback
+
+
+SignalQueueStats = namedtuple('SignalQueueStats',
+                              'depth max_depth delivered dropped coalesced '
+                              'blocked max_latency mean_latency')
+"""
+Named tuple collection of signal queue counters as returned by
+:py:meth:`SignalQueue.stats`.  Latencies are the number of seconds
+between a signal being queued and its callback starting.
+"""
+
+
+class QueuedSignal(object):
+    """
+    Compact record of a signal waiting in a :py:class:`SignalQueue`
+    """
+    __slots__ = ('handler', 'args', 'key', 'queued')
+
+    def __init__(self, handler, args, key, queued):
+        self.handler = handler
+        self.args = args
+        self.key = key
+        self.queued = queued
+
+
+def _default_key(handler, signal, args):
+    # e.g., PropertyChanged is coalesced per property name
+    return (handler, signal, args[0] if args else None)
+
+
+class SignalQueue:
+    """
+    Bounded queue through which signals are handed from the dbus main
+    loop to a worker thread that calls the user callbacks.  A slow
+    callback then only delays its own queue, rather than every other
+    signal and media transport event on the main loop.
+
+    A queue is attached to a signal receiver with the `queue` argument
+    of :py:meth:`.BTInterface.add_signal_receiver` and should normally
+    serve a single subscriber.  When the queue is full the `policy`
+    decides what happens to a new signal:
+
+    * :py:attr:`DROP_OLDEST`: the oldest queued signal is discarded.
+    * :py:attr:`COALESCE`: a queued signal with the same key (by
+      default the same callback, signal name and first argument, such
+      as the property name of PropertyChanged) is replaced in place by
+      the new one.  This is done whether or not the queue is full.
+      Otherwise the oldest is discarded.
+    * :py:attr:`BLOCK`: the main loop waits for the worker to make
+      room, for at most `timeout` seconds, after which the oldest is
+      discarded.
+
+    For example, to keep a slow UI callback off the audio path::
+
+        queue = bt_manager.SignalQueue(maxsize=32,
+                                       policy=bt_manager.SignalQueue.COALESCE)
+        sink.add_signal_receiver(update_ui,
+                                 BTAudioSink.SIGNAL_PROPERTY_CHANGED,
+                                 None, queue=queue)
+
+    :param int maxsize: Maximum number of queued signals
+    :param str policy: Overflow policy
+    :param float timeout: Longest wait in seconds under the
+        :py:attr:`BLOCK` policy, or `None` to wait indefinitely
+    :param func key: Optional function of (handler, signal, args)
+        returning the key by which signals are coalesced
+    """
+
+    DROP_OLDEST = 'drop-oldest'
+    """Discard the oldest queued signal when full"""
+    COALESCE = 'coalesce'
+    """Replace a queued signal with the same key, else drop the oldest"""
+    BLOCK = 'block'
+    """Wait for room when full"""
+
+    def __init__(self, maxsize=64, policy=DROP_OLDEST, timeout=None,
+                 key=None):
+        self.maxsize = maxsize
+        self.policy = policy
+        self.timeout = timeout
+        self._key = key or _default_key
+        self._queue = deque()
+        self._pending = {}
+        self._cond = threading.Condition()
+        self._thread = None
+        self._closed = False
+        self._max_depth = 0
+        self._started = 0
+        self._delivered = 0
+        self._dropped = 0
+        self._coalesced = 0
+        self._blocked = 0
+        self._total_latency = 0.0
+        self._max_latency = 0.0
+
+    def _drop_oldest(self):
+        record = self._queue.popleft()
+        if (self._pending.get(record.key) is record):
+            del self._pending[record.key]
+        self._dropped += 1
+
+    def put(self, handler, signal, args):
+        """
+        Queue a signal for the worker thread, which then calls
+        ``handler(*args)``.  The worker is started on first use.
+
+        :param func handler: Function to call with the signal arguments
+        :param str signal: Signal name
+        :param tuple args: Signal arguments
+        :return:
+        """
+        with self._cond:
+            if (self._closed):
+                return
+            if (self._thread is None):
+                self._thread = threading.Thread(target=self._run,
+                                                name='bt-manager-signals')
+                self._thread.daemon = True
+                self._thread.start()
+            now = time.time()
+            key = None
+            if (self.policy == SignalQueue.COALESCE):
+                key = self._key(handler, signal, args)
+                record = self._pending.get(key)
+                if (record is not None):
+                    record.handler = handler
+                    record.args = args
+                    self._coalesced += 1
+                    return
+            if (len(self._queue) >= self.maxsize and
+                    self.policy == SignalQueue.BLOCK and
+                    threading.current_thread() is not self._thread):
+                self._blocked += 1
+                deadline = None
+                if (self.timeout is not None):
+                    deadline = now + self.timeout
+                while (len(self._queue) >= self.maxsize and
+                       not self._closed):
+                    remaining = None
+                    if (deadline is not None):
+                        remaining = deadline - time.time()
+                        if (remaining <= 0):
+                            break
+                    self._cond.wait(remaining)
+            if (len(self._queue) >= self.maxsize):
+                self._drop_oldest()
+            record = QueuedSignal(handler, args, key, now)
+            self._queue.append(record)
+            if (key is not None):
+                self._pending[key] = record
+            self._max_depth = max(self._max_depth, len(self._queue))
+            self._cond.notify_all()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while (not self._queue and not self._closed):
+                    self._cond.wait()
+                if (not self._queue):
+                    return
+                record = self._queue.popleft()
+                if (self._pending.get(record.key) is record):
+                    del self._pending[record.key]
+                latency = time.time() - record.queued
+                self._started += 1
+                self._total_latency += latency
+                self._max_latency = max(self._max_latency, latency)
+                self._cond.notify_all()
+            try:
+                record.handler(*record.args)
+            except Exception:
+                # Report as dbus-python would, and carry on
+                traceback.print_exc()
+            with self._cond:
+                self._delivered += 1
+                self._cond.notify_all()
+
+    def join(self, timeout=None):
+        """
+        Wait until every queued signal has been delivered.
+
+        :param float timeout: Optional time in seconds to wait
+        :return: `True` if the queue was drained
+        :rtype: boolean
+        """
+        deadline = None
+        if (timeout is not None):
+            deadline = time.time() + timeout
+        with self._cond:
+            while (self._queue or self._started > self._delivered):
+                remaining = None
+                if (deadline is not None):
+                    remaining = deadline - time.time()
+                    if (remaining <= 0):
+                        return False
+                self._cond.wait(remaining)
+            return True
+
+    def close(self):
+        """
+        Stop the worker thread once the signals already queued have been
+        delivered.  Signals queued afterwards are ignored.
+
+        :return:
+        """
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+            thread = self._thread
+        if (thread is not None and
+                thread is not threading.current_thread()):
+            thread.join()
+
+    def stats(self):
+        """
+        Obtain signal queue counters.
+
+        :return: the current and maximum queue depth, the number of
+            signals delivered, dropped because the queue was full and
+            coalesced into a queued signal, the number of times the
+            main loop blocked on a full queue and the maximum and mean
+            queueing latency
+        :rtype: :py:class:`SignalQueueStats`
+        """
+        with self._cond:
+            mean = 0.0
+            if (self._started):
+                mean = self._total_latency / self._started
+            return SignalQueueStats(len(self._queue), self._max_depth,
+                                    self._delivered, self._dropped,
+                                    self._coalesced, self._blocked,
+                                    self._max_latency, mean)
@@ -74,3 +74,29 @@ struct rtp_payload {
 #else
 #error "Unknown byte order"
 #endif
+
+/* State and counters of one RTP/SBC stream, see rtpsbc.h */
+struct rtp_sbc_stream {
+	uint32_t ssrc;
+	uint16_t seq_num;
+	uint32_t ts;
+	uint8_t marker;
+
+	uint64_t packets;
+	uint64_t frames;
+	uint64_t bytes;
+	uint64_t samples;
+	uint64_t fragments;
+	uint64_t lost;
+	uint64_t dropped;
+	uint64_t frame_count_errors;
+	uint64_t bitpool_changes;
+
+	uint8_t started;
+	uint8_t frag_count;
+	size_t frag_len;
+	size_t frag_offset;
+	uint8_t frag[1024];
+};
+
+typedef struct rtp_sbc_stream rtp_sbc_stream_t;
@@ -1,107 +1,505 @@
+#ifndef _GNU_SOURCE
+#define _GNU_SOURCE
+#endif
+#include <errno.h>
+#include <stdlib.h>
 #include <string.h>
 #include <stdio.h>
 #include <unistd.h>
 #include <arpa/inet.h>
+#include <sys/socket.h>
+#include <sys/uio.h>
 #include "sbc.h"
 #include "rtp.h"
 
+#define RTP_SBC_HEADER_SIZE \
+	(sizeof(struct rtp_header) + sizeof(struct rtp_payload))
 
-size_t rtp_sbc_encode_to_fd(sbc_t *sbc, char *ip, size_t ip_size, size_t mtu,
-                            unsigned int *ts, unsigned int *seq_num, int fd)
+/* Most packets handed to the kernel by one rtp_sbc_send_packets() call */
+#define RTP_SBC_MAX_BATCH	64
+
+
+/* Samples per channel in one SBC frame, the RTP timestamp unit */
+static size_t rtp_sbc_frame_samples(sbc_t *sbc)
+{
+	return (sbc->subbands ? 8 : 4) * (4 + sbc->blocks * 4);
+}
+
+
+/*
+ * Fills in the RTP and SBC payload headers for the next packet of the
+ * stream and advances its sequence number.
+ */
+static void rtp_sbc_write_header(struct rtp_sbc_stream *stream, char *op,
+				unsigned frame_count, int is_fragmented,
+				int is_first, int is_last)
+{
+	struct rtp_header *rtp_header = (struct rtp_header *)op;
+	struct rtp_payload *rtp_payload =
+			(struct rtp_payload *)(op + sizeof(*rtp_header));
+
+	memset(op, 0, RTP_SBC_HEADER_SIZE);
+	rtp_header->v = 2;
+	rtp_header->pt = 1;
+	rtp_header->m = stream->marker ? 1 : 0;
+	rtp_header->sequence_number = htons(stream->seq_num);
+	rtp_header->timestamp = htonl(stream->ts);
+	rtp_header->ssrc = htonl(stream->ssrc);
+	rtp_payload->frame_count = frame_count;
+	rtp_payload->is_fragmented = is_fragmented;
+	rtp_payload->is_first_fragment = is_first;
+	rtp_payload->is_last_fragment = is_last;
+
+	stream->marker = 0;
+	stream->seq_num++;
+	stream->packets++;
+}
+
+
+/*
+ * Sends the next fragment of a frame too large for the MTU.  The frame
+ * count of each fragment is the number of fragments left, including
+ * itself, and every fragment carries the timestamp of the frame.
+ */
+static size_t rtp_sbc_encode_fragment(sbc_t *sbc,
+				struct rtp_sbc_stream *stream,
+				char *op, size_t op_size, size_t mtu)
 {
-    char buf[512];
-    struct rtp_header *rtp_header = (struct rtp_header *)buf;
-	struct rtp_payload *rtp_payload = (struct rtp_payload *)(buf + sizeof(*rtp_header));
-    const size_t codesize = sbc_get_codesize(sbc);
-    const size_t rtp_size = sizeof(*rtp_header) + sizeof(*rtp_payload);
-    size_t index = 0;
-
-    while (ip_size >= codesize) {
-
-        char *op = &buf[rtp_size];
-        size_t buf_size = mtu - rtp_size;
-        size_t nbytes = rtp_size;
-        size_t nframes = 0;
-
-        memset(buf, 0, rtp_size);
-
-        rtp_header->v = 2;
-		rtp_header->pt = 1;
-		rtp_header->sequence_number = *seq_num;
-		rtp_header->timestamp = htonl(*ts);
-		rtp_header->ssrc = htonl(1);
-
-		while (ip_size >= codesize) {
-			ssize_t encoded;
-			ssize_t sz = sbc_encode(sbc,
-									(void *)&ip[index],
-									codesize,
-									(void *)op,
-									buf_size,
-									&encoded);
+	const size_t payload = mtu - RTP_SBC_HEADER_SIZE;
+	const size_t remaining = stream->frag_len - stream->frag_offset;
+	const size_t chunk = remaining < payload ? remaining : payload;
+
+	if (RTP_SBC_HEADER_SIZE + chunk > op_size)
+		return 0;
+
+	rtp_sbc_write_header(stream, op, (remaining + payload - 1) / payload,
+				1, stream->frag_offset == 0, chunk == remaining);
+	memcpy(&op[RTP_SBC_HEADER_SIZE], &stream->frag[stream->frag_offset],
+									chunk);
+
+	stream->frag_offset += chunk;
+	stream->fragments++;
+	stream->bytes += RTP_SBC_HEADER_SIZE + chunk;
+	if (stream->frag_offset == stream->frag_len) {
+		stream->frag_len = stream->frag_offset = 0;
+		stream->ts += rtp_sbc_frame_samples(sbc);
+	}
+
+	return RTP_SBC_HEADER_SIZE + chunk;
+}
+
+
+/*
+ * Encodes as many whole frames of the input as fit into a single RTP
+ * packet of at most mtu bytes, within the op_size bytes available.
+ * Frames larger than the MTU are sent as a series of fragments, in which
+ * case the frame is encoded with the first fragment and the following
+ * ones consume no input.  Returns the packet length, or 0 if no packet
+ * could be produced, and the number of input bytes encoded in *consumed.
+ */
+static size_t rtp_sbc_encode_packet(sbc_t *sbc, struct rtp_sbc_stream *stream,
+				const char *ip, size_t ip_size,
+				char *op, size_t op_size, size_t mtu,
+				size_t *consumed)
+{
+	const size_t codesize = sbc_get_codesize(sbc);
+	const size_t frame_samples = rtp_sbc_frame_samples(sbc);
+	size_t buf_size, nbytes = RTP_SBC_HEADER_SIZE;
+	size_t index = 0;
+	size_t nframes = 0;
+
+	*consumed = 0;
+	if (mtu <= RTP_SBC_HEADER_SIZE)
+		return 0;
+
+	if (stream->frag_offset < stream->frag_len)
+		return rtp_sbc_encode_fragment(sbc, stream, op, op_size, mtu);
+
+	if (RTP_SBC_HEADER_SIZE + sbc_get_frame_length(sbc) > mtu) {
+		const size_t payload = mtu - RTP_SBC_HEADER_SIZE;
+		ssize_t encoded;
+		ssize_t sz;
+
+		/* The first fragment must fit before the frame is queued */
+		if (ip_size < codesize ||
+				RTP_SBC_HEADER_SIZE + payload > op_size)
+			return 0;
+
+		sz = sbc_encode(sbc, (void *)ip, codesize, stream->frag,
+					sizeof(stream->frag), &encoded);
+		if (sz <= 0 || encoded <= 0)
+			return 0;
+
+		*consumed = sz;
+		stream->frag_len = encoded;
+		stream->frag_offset = 0;
+		stream->frames++;
+		stream->samples += frame_samples;
+		return rtp_sbc_encode_fragment(sbc, stream, op, op_size, mtu);
+	}
+
+	if (op_size > mtu)
+		op_size = mtu;
+	if (op_size <= RTP_SBC_HEADER_SIZE)
+		return 0;
+	buf_size = op_size - RTP_SBC_HEADER_SIZE;
+
+	/* frame_count is a 4-bit field */
+	while (ip_size - index >= codesize && nframes < 15) {
+		ssize_t encoded;
+		ssize_t sz = sbc_encode(sbc,
+					(void *)&ip[index],
+					codesize,
+					(void *)&op[nbytes],
+					buf_size,
+					&encoded);
+		if (sz <= 0)
+			break;
+
+		index += sz;
+		buf_size -= encoded;
+		nbytes += encoded;
+		nframes++;
+	}
+
+	if (nframes == 0)
+		return 0;
+
+	rtp_sbc_write_header(stream, op, nframes, 0, 0, 0);
+
+	stream->ts += frame_samples * nframes;
+	stream->frames += nframes;
+	stream->samples += frame_samples * nframes;
+	stream->bytes += nbytes;
+
+	*consumed = index;
+	return nbytes;
+}
+
+
+/*
+ * Decodes the frames in the payload of a packet, or of a reassembled
+ * fragmented frame, following any change of bitpool from one frame to
+ * the next.  Frames there is no room to decode are still parsed so that
+ * every frame is counted in *nframes.  Returns the number of decoded
+ * bytes.
+ */
+static size_t rtp_sbc_decode_frames(sbc_t *sbc, struct rtp_sbc_stream *stream,
+				const char *ip, size_t ip_size,
+				char *op, size_t op_size, unsigned *nframes)
+{
+	size_t index = 0;
+
+	*nframes = 0;
+	while (ip_size > 0) {
+		const uint8_t bitpool = sbc->bitpool;
+		size_t decoded = 0;
+		ssize_t sz;
+
+		if (op_size - index < sbc_get_codesize(sbc)) {
+			sz = sbc_parse(sbc, (void *)ip, ip_size);
 			if (sz <= 0)
 				break;
+			stream->dropped++;
+		} else {
+			sz = sbc_decode(sbc,
+					(void *)ip,
+					ip_size,
+					(void *)&op[index],
+					op_size - index,
+					&decoded);
+			if (sz <= 0 || decoded == 0)
+				break;
+			stream->frames++;
+			stream->samples += rtp_sbc_frame_samples(sbc);
+		}
+
+		if (sbc->bitpool != bitpool && (stream->frames > 1 ||
+							stream->dropped))
+			stream->bitpool_changes++;
+
+		ip += sz;
+		ip_size -= sz;
+		index += decoded;
+		(*nframes)++;
+	}
+
+	return index;
+}
+
+
+/*
+ * Decodes a single RTP packet, counting the packets lost before it from
+ * the gap in sequence numbers and reassembling fragmented frames.
+ * Returns the number of decoded bytes written to op.
+ */
+static size_t rtp_sbc_decode_packet(sbc_t *sbc, struct rtp_sbc_stream *stream,
+				const char *ip, size_t ip_size,
+				char *op, size_t op_size)
+{
+	const struct rtp_header *rtp_header = (const struct rtp_header *)ip;
+	const struct rtp_payload *rtp_payload =
+		(const struct rtp_payload *)(ip + sizeof(*rtp_header));
+	uint16_t seq_num, gap = 0;
+	unsigned nframes;
+	size_t index;
 
-			ip_size -= sz;
-			index += sz;
-			buf_size -= encoded;
-			nbytes += encoded;
-			op += encoded;
-			nframes++;
+	if (ip_size <= RTP_SBC_HEADER_SIZE)
+		return 0;
+
+	seq_num = ntohs(rtp_header->sequence_number);
+	if (stream->started) {
+		gap = seq_num - stream->seq_num;
+		/*
+		 * a step back is a late or duplicate packet, not a loss, and
+		 * leaves the next expected sequence number alone
+		 */
+		if (gap < 0x8000) {
+			stream->lost += gap;
+			stream->seq_num = seq_num + 1;
+		} else {
+			gap = 0;
 		}
+	} else {
+		stream->seq_num = seq_num + 1;
+	}
+	stream->started = 1;
+	stream->ts = ntohl(rtp_header->timestamp);
+	stream->ssrc = ntohl(rtp_header->ssrc);
+	stream->marker = rtp_header->m;
+	stream->packets++;
+	stream->bytes += ip_size;
+
+	ip += RTP_SBC_HEADER_SIZE;
+	ip_size -= RTP_SBC_HEADER_SIZE;
+
+	if (!rtp_payload->is_fragmented) {
+		stream->frag_len = 0;
+		index = rtp_sbc_decode_frames(sbc, stream, ip, ip_size,
+						op, op_size, &nframes);
+		if (nframes != rtp_payload->frame_count)
+			stream->frame_count_errors++;
+		return index;
+	}
+
+	stream->fragments++;
+
+	/* drop a frame if any of its fragments went missing */
+	if (rtp_payload->is_first_fragment)
+		stream->frag_len = 0;
+	else if (gap || stream->frag_len == 0 ||
+			rtp_payload->frame_count != stream->frag_count)
+		goto drop;
+
+	if (stream->frag_len + ip_size > sizeof(stream->frag))
+		goto drop;
+
+	memcpy(&stream->frag[stream->frag_len], ip, ip_size);
+	stream->frag_len += ip_size;
+	stream->frag_count = rtp_payload->frame_count - 1;
+
+	if (!rtp_payload->is_last_fragment)
+		return 0;
+
+	ip_size = stream->frag_len;
+	stream->frag_len = 0;
+	index = rtp_sbc_decode_frames(sbc, stream, (const char *)stream->frag,
+					ip_size, op, op_size, &nframes);
+	if (nframes != 1)
+		stream->frame_count_errors++;
+	return index;
+
+drop:
+	stream->frag_len = 0;
+	return 0;
+}
+
 
-		rtp_payload->frame_count = nframes;
-		*ts += sbc_get_frame_duration(sbc) * nframes;
-		(*seq_num)++;
+size_t rtp_sbc_encode_to_fd(sbc_t *sbc, char *ip, size_t ip_size, size_t mtu,
+                            rtp_sbc_stream_t *stream, int fd)
+{
+	char *buf = malloc(mtu);
+	size_t index = 0;
+
+	if (!buf)
+		return 0;
 
+	while (stream->frag_offset < stream->frag_len ||
+				ip_size - index >= sbc_get_codesize(sbc)) {
+		size_t consumed;
+		size_t nbytes = rtp_sbc_encode_packet(sbc, stream, &ip[index],
+						ip_size - index, buf, mtu,
+						mtu, &consumed);
+		if (nbytes == 0)
+			break;
+
+		index += consumed;
 		write(fd, buf, nbytes);
-    }
+	}
 
-    return index;
+	free(buf);
+	return index;
 }
 
 
 size_t rtp_sbc_decode_from_fd(sbc_t *sbc, char *op, size_t op_size, size_t mtu,
-                              int fd)
+                              rtp_sbc_stream_t *stream, int fd)
 {
-    char buf[1024];
-    struct rtp_header *rtp_header = (struct rtp_header *)buf;
-	struct rtp_payload *rtp_payload = (struct rtp_payload *)(buf + sizeof(*rtp_header));
-    const size_t codesize = sbc_get_codesize(sbc);
-    const size_t frame_len = sbc_get_frame_length(sbc);
-    const size_t rtp_size = sizeof(*rtp_header) + sizeof(*rtp_payload);
-    const size_t mtu_round = ((mtu - rtp_size) / frame_len) * frame_len + rtp_size;
-    size_t index = 0;
+	const size_t codesize = sbc_get_codesize(sbc);
+	char *buf = malloc(mtu);
+	size_t index = 0;
 
-    while (op_size >= codesize) {
+	if (!buf)
+		return 0;
 
-        char *ip = &buf[rtp_size];
-        size_t nframes;
-        ssize_t buf_size = read(fd, buf, mtu_round);
+	while (op_size - index >= codesize) {
+		ssize_t buf_size;
 
-		if (buf_size <= 0)
-        	break;
-
-        nframes = rtp_payload->frame_count;
-		buf_size -= rtp_size;
-
-		while (buf_size > 0) {
-			ssize_t decoded;
-			ssize_t sz = sbc_decode(sbc,
-									(void *)ip,
-									buf_size,
-									(void *)&op[index],
-									op_size,
-									&decoded);
-			if (decoded <= 0)
+		/*
+		 * Once something has been decoded, leave a packet that will
+		 * not fit in the socket for the next call rather than
+		 * dropping some of its frames
+		 */
+		if (index > 0) {
+			char hdr[RTP_SBC_HEADER_SIZE];
+			const struct rtp_payload *rtp_payload =
+				(const struct rtp_payload *)(hdr +
+						sizeof(struct rtp_header));
+
+			/* nor wait for a packet that has not arrived yet */
+			if (recv(fd, hdr, sizeof(hdr), MSG_PEEK | MSG_DONTWAIT) !=
+							(ssize_t)sizeof(hdr))
 				break;
+			if (!rtp_payload->is_fragmented &&
+					rtp_payload->frame_count * codesize >
+							op_size - index)
+				break;
+		}
+
+		/* datagrams are read whole, whatever the bitpool */
+		buf_size = read(fd, buf, mtu);
+		if (buf_size <= 0)
+			break;
+
+		index += rtp_sbc_decode_packet(sbc, stream, buf, buf_size,
+						&op[index], op_size - index);
+	}
+
+	free(buf);
+	return index;
+}
+
+
+size_t rtp_sbc_encode_to_buffer(sbc_t *sbc, const char *ip, size_t ip_size,
+				size_t mtu, rtp_sbc_stream_t *stream,
+				char *op, size_t op_size,
+				size_t *packet_lens, size_t max_packets,
+				size_t *npackets)
+{
+	size_t index = 0, used = 0;
+
+	*npackets = 0;
+	while (*npackets < max_packets && used < op_size &&
+			(stream->frag_offset < stream->frag_len ||
+				ip_size - index >= sbc_get_codesize(sbc))) {
+		size_t consumed;
+		size_t nbytes = rtp_sbc_encode_packet(sbc, stream, &ip[index],
+						ip_size - index, &op[used],
+						op_size - used, mtu,
+						&consumed);
+		if (nbytes == 0)
+			break;
+
+		index += consumed;
+		used += nbytes;
+		packet_lens[(*npackets)++] = nbytes;
+	}
+
+	return index;
+}
+
+
+size_t rtp_sbc_decode_from_buffer(sbc_t *sbc, rtp_sbc_stream_t *stream,
+				const char *ip,
+				const size_t *packet_lens, size_t npackets,
+				char *op, size_t op_size,
+				size_t *packets_decoded)
+{
+	const size_t codesize = sbc_get_codesize(sbc);
+	size_t index = 0, offset = 0;
+
+	*packets_decoded = 0;
+	while (*packets_decoded < npackets) {
+		const size_t len = packet_lens[*packets_decoded];
+		const struct rtp_payload *rtp_payload =
+			(const struct rtp_payload *)(&ip[offset] +
+						sizeof(struct rtp_header));
+		size_t needed = 0;
 
-			ip += sz;
-			buf_size -= sz;
-			index += decoded;
-			op_size -= decoded;
+		if (len > RTP_SBC_HEADER_SIZE) {
+			if (!rtp_payload->is_fragmented)
+				needed = rtp_payload->frame_count * codesize;
+			else if (rtp_payload->is_last_fragment)
+				needed = codesize;
 		}
-    }
 
-    return index;
+		/* never split a packet, leave it for the next call instead */
+		if (needed > op_size - index)
+			break;
+
+		index += rtp_sbc_decode_packet(sbc, stream, &ip[offset], len,
+						&op[index], op_size - index);
+		offset += len;
+		(*packets_decoded)++;
+	}
+
+	return index;
+}
+
+
+/*
+ * Sends up to RTP_SBC_MAX_BATCH packets, held back-to-back in buf, with a
+ * single system call.  Sockets use sendmmsg() so that every packet keeps
+ * its own boundary and the call never blocks.  Anything else, e.g., a
+ * pipe, falls back to writev().  Returns the number of bytes sent, which
+ * for writev() may end part way through a packet, 0 if the descriptor is
+ * not ready, or -errno on error.
+ */
+ssize_t rtp_sbc_send_packets(int fd, const char *buf,
+				const size_t *packet_lens, size_t npackets)
+{
+	struct mmsghdr msgs[RTP_SBC_MAX_BATCH];
+	struct iovec iov[RTP_SBC_MAX_BATCH];
+	size_t i, offset = 0;
+	ssize_t sent = 0;
+	int n;
+
+	if (npackets > RTP_SBC_MAX_BATCH)
+		npackets = RTP_SBC_MAX_BATCH;
+
+	memset(msgs, 0, sizeof(msgs[0]) * npackets);
+	for (i = 0; i < npackets; i++) {
+		iov[i].iov_base = (void *)&buf[offset];
+		iov[i].iov_len = packet_lens[i];
+		msgs[i].msg_hdr.msg_iov = &iov[i];
+		msgs[i].msg_hdr.msg_iovlen = 1;
+		offset += packet_lens[i];
+	}
+
+	n = sendmmsg(fd, msgs, npackets, MSG_DONTWAIT | MSG_NOSIGNAL);
+	if (n < 0 && errno == ENOTSOCK) {
+		sent = writev(fd, iov, npackets);
+		n = sent < 0 ? -1 : 0;
+	}
+
+	if (n < 0) {
+		if (errno == EAGAIN || errno == EWOULDBLOCK || errno == EINTR)
+			return 0;
+		return -errno;
+	}
+
+	for (i = 0; i < (size_t)n; i++)
+		sent += msgs[i].msg_len;
+
+	return sent;
 }
@@ -71,7 +71,56 @@ size_t sbc_get_codesize(sbc_t *sbc);
 const char *sbc_get_implementation_info(sbc_t *sbc);
 void sbc_finish(sbc_t *sbc);
 
+/*
+ * State and counters of one RTP/SBC stream.  Only ssrc, seq_num, ts and
+ * marker (set for the next packet sent) are meant to be written by the
+ * user.  When decoding they are taken from the last packet received,
+ * except for seq_num which is the next one expected.  Samples are counted
+ * per channel, the RTP timestamp advancing by one for every sample.
+ */
+struct rtp_sbc_stream {
+	uint32_t ssrc;
+	uint16_t seq_num;
+	uint32_t ts;
+	uint8_t marker;
+
+	uint64_t packets;
+	uint64_t frames;
+	uint64_t bytes;
+	uint64_t samples;
+	uint64_t fragments;
+	uint64_t lost;
+	uint64_t dropped;
+	uint64_t frame_count_errors;
+	uint64_t bitpool_changes;
+
+	uint8_t started;
+	uint8_t frag_count;
+	size_t frag_len;
+	size_t frag_offset;
+	uint8_t frag[1024];
+};
+
+typedef struct rtp_sbc_stream rtp_sbc_stream_t;
+
+/* Size of the RTP and SBC payload headers at the start of every packet */
+enum {
+RTP_SBC_HEADER_SIZE = 13
+};
+
 size_t rtp_sbc_encode_to_fd(sbc_t *sbc, char *ip, size_t ip_size, size_t mtu,
-                            unsigned int *ts, unsigned int *seq_num, int fd);
+                            rtp_sbc_stream_t *stream, int fd);
 size_t rtp_sbc_decode_from_fd(sbc_t *sbc, char *op, size_t op_size, size_t mtu,
-                              int fd);
+                              rtp_sbc_stream_t *stream, int fd);
+size_t rtp_sbc_encode_to_buffer(sbc_t *sbc, const char *ip, size_t ip_size,
+                                size_t mtu, rtp_sbc_stream_t *stream,
+                                char *op, size_t op_size,
+                                size_t *packet_lens, size_t max_packets,
+                                size_t *npackets);
+size_t rtp_sbc_decode_from_buffer(sbc_t *sbc, rtp_sbc_stream_t *stream,
+                                  const char *ip,
+                                  const size_t *packet_lens, size_t npackets,
+                                  char *op, size_t op_size,
+                                  size_t *packets_decoded);
+ssize_t rtp_sbc_send_packets(int fd, const char *buf,
+                             const size_t *packet_lens, size_t npackets);
@@ -64,6 +64,15 @@ extern "C" {
 #define SBC_LE			0x00
 #define SBC_BE			0x01
 
+/* sbc_init() flags selecting the encoder primitives, 0 picks the best
+ * implementation supported by the running CPU, otherwise the best one
+ * not above the requested level is used */
+#define SBC_FLAG_IMPL_MASK	0xF0
+#define SBC_FLAG_IMPL_GENERIC	0x10
+#define SBC_FLAG_IMPL_MMX	0x20
+#define SBC_FLAG_IMPL_SSE2	0x30
+#define SBC_FLAG_IMPL_AVX2	0x40
+
 struct sbc_struct {
 	unsigned long flags;
 
@@ -0,0 +1,200 @@
+/*
+ * Micro-benchmark for the SBC encoder primitives.
+ *
+ * Encodes a fixed, deterministic PCM corpus with every implementation
+ * that can be requested through the sbc_init() flags and checks that
+ * the output is bit-exact against the generic C implementation.
+ *
+ * Usage: make -C codecs bench
+ */
+
+#include <stdint.h>
+#include <stdio.h>
+#include <stdlib.h>
+#include <string.h>
+#include <math.h>
+#include <time.h>
+#include "sbc.h"
+
+#define CORPUS_SECONDS	10
+#define CORPUS_RATE	44100
+#define CORPUS_SIZE	(CORPUS_SECONDS * CORPUS_RATE * 2 * 2)
+
+struct bench_impl {
+	const char *name;
+	unsigned long flags;
+};
+
+static const struct bench_impl impls[] = {
+	{ "Generic C",	SBC_FLAG_IMPL_GENERIC },
+	{ "MMX",	SBC_FLAG_IMPL_MMX },
+	{ "SSE2",	SBC_FLAG_IMPL_SSE2 },
+	{ "AVX2",	SBC_FLAG_IMPL_AVX2 },
+};
+
+struct bench_config {
+	const char *name;
+	uint8_t mode;
+	uint8_t subbands;
+	uint8_t allocation;
+	uint8_t bitpool;
+};
+
+static const struct bench_config configs[] = {
+	{ "joint 8sb",	SBC_MODE_JOINT_STEREO,	SBC_SB_8, SBC_AM_LOUDNESS, 53 },
+	{ "joint 4sb",	SBC_MODE_JOINT_STEREO,	SBC_SB_4, SBC_AM_LOUDNESS, 53 },
+	{ "stereo 8sb",	SBC_MODE_STEREO,	SBC_SB_8, SBC_AM_SNR,	   35 },
+	{ "stereo 4sb",	SBC_MODE_STEREO,	SBC_SB_4, SBC_AM_SNR,	   35 },
+	{ "dual 8sb",	SBC_MODE_DUAL_CHANNEL,	SBC_SB_8, SBC_AM_LOUDNESS, 32 },
+	{ "mono 8sb",	SBC_MODE_MONO,		SBC_SB_8, SBC_AM_LOUDNESS, 31 },
+	{ "mono 4sb",	SBC_MODE_MONO,		SBC_SB_4, SBC_AM_LOUDNESS, 31 },
+};
+
+#define ARRAY_SIZE(a) (sizeof(a) / sizeof((a)[0]))
+
+/*
+ * Two slightly detuned tones with a different noise floor on each
+ * channel, so that both the left/right and mid/side paths of the joint
+ * stereo decision get exercised.
+ */
+static void make_corpus(int16_t *pcm, size_t samples)
+{
+	uint32_t lcg = 0x12345678;
+	size_t i;
+
+	for (i = 0; i < samples / 2; i++) {
+		double t = (double) i / CORPUS_RATE;
+		int32_t noise;
+
+		lcg = lcg * 1664525 + 1013904223;
+		noise = (int32_t) (lcg >> 20) - 2048;
+
+		pcm[2 * i] = (int16_t) (12000 * sin(2 * M_PI * 440 * t) +
+								noise);
+		pcm[2 * i + 1] = (int16_t) (11000 * sin(2 * M_PI * 443 * t) +
+							4 * noise);
+	}
+}
+
+static double now(void)
+{
+	struct timespec ts;
+
+	clock_gettime(CLOCK_MONOTONIC, &ts);
+	return ts.tv_sec + ts.tv_nsec / 1e9;
+}
+
+/*
+ * Encodes the whole corpus, returning the number of output bytes or -1.
+ * The implementation actually chosen is returned through "info".
+ */
+static ssize_t encode_corpus(const struct bench_config *config,
+				unsigned long flags, const uint8_t *pcm,
+				uint8_t *out, size_t out_size,
+				const char **info, double *elapsed)
+{
+	size_t codesize, index = 0, total = 0;
+	double start;
+	sbc_t sbc;
+
+	if (sbc_init(&sbc, flags) < 0)
+		return -1;
+
+	sbc.frequency = SBC_FREQ_44100;
+	sbc.blocks = SBC_BLK_16;
+	sbc.mode = config->mode;
+	sbc.subbands = config->subbands;
+	sbc.allocation = config->allocation;
+	sbc.bitpool = config->bitpool;
+	sbc.endian = SBC_LE;
+
+	codesize = sbc_get_codesize(&sbc);
+
+	start = now();
+	while (index + codesize <= CORPUS_SIZE) {
+		ssize_t written;
+		ssize_t sz = sbc_encode(&sbc, pcm + index, codesize,
+					out + total, out_size - total,
+					&written);
+		if (sz <= 0) {
+			sbc_finish(&sbc);
+			return -1;
+		}
+
+		index += sz;
+		total += written;
+	}
+	*elapsed = now() - start;
+
+	*info = sbc_get_implementation_info(&sbc);
+	sbc_finish(&sbc);
+
+	return total;
+}
+
+int main(void)
+{
+	size_t out_size = CORPUS_SIZE;
+	uint8_t *pcm, *ref, *out;
+	unsigned int c, i;
+	int failed = 0;
+
+	pcm = malloc(CORPUS_SIZE);
+	ref = malloc(out_size);
+	out = malloc(out_size);
+	if (!pcm || !ref || !out) {
+		fprintf(stderr, "out of memory\n");
+		return 1;
+	}
+
+	make_corpus((int16_t *) pcm, CORPUS_SIZE / 2);
+
+	for (c = 0; c < ARRAY_SIZE(configs); c++) {
+		const struct bench_config *config = &configs[c];
+		const char *info;
+		ssize_t ref_len;
+		double elapsed, ref_elapsed;
+
+		ref_len = encode_corpus(config, SBC_FLAG_IMPL_GENERIC, pcm,
+					ref, out_size, &info, &ref_elapsed);
+		if (ref_len < 0) {
+			fprintf(stderr, "%s: encoding failed\n", config->name);
+			return 1;
+		}
+
+		encode_corpus(config, 0, pcm, out, out_size, &info, &elapsed);
+		printf("%s (bitpool %d, runtime choice %s)\n",
+				config->name, config->bitpool, info);
+
+		for (i = 0; i < ARRAY_SIZE(impls); i++) {
+			ssize_t len;
+
+			len = encode_corpus(config, impls[i].flags, pcm, out,
+						out_size, &info, &elapsed);
+
+			if (strcmp(info, impls[i].name) != 0) {
+				printf("  %-10s skipped (not supported, "
+					"falls back to %s)\n",
+					impls[i].name, info);
+				continue;
+			}
+
+			if (len != ref_len || memcmp(ref, out, len) != 0) {
+				printf("  %-10s %8.2f ms  MISMATCH\n",
+					impls[i].name, elapsed * 1000);
+				failed = 1;
+				continue;
+			}
+
+			printf("  %-10s %8.2f ms  %5.2fx  bit-exact\n",
+					impls[i].name, elapsed * 1000,
+					ref_elapsed / elapsed);
+		}
+	}
+
+	free(pcm);
+	free(ref);
+	free(out);
+
+	return failed;
+}
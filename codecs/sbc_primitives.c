@@ -33,6 +33,7 @@
 
 #include "sbc_primitives.h"
 #include "sbc_primitives_mmx.h"
+#include "sbc_primitives_sse.h"
 #include "sbc_primitives_iwmmxt.h"
 #include "sbc_primitives_neon.h"
 #include "sbc_primitives_armv6.h"
@@ -519,8 +520,10 @@ static int sbc_calc_scalefactors_j(
 /*
  * Detect CPU features and setup function pointers
  */
-void sbc_init_primitives(struct sbc_encoder_state *state)
+void sbc_init_primitives(struct sbc_encoder_state *state, unsigned long flags)
 {
+	unsigned long impl = flags & SBC_FLAG_IMPL_MASK;
+
 	/* Default implementation for analyze functions */
 	state->sbc_analyze_4b_4s = sbc_analyze_4b_4s_simd;
 	state->sbc_analyze_4b_8s = sbc_analyze_4b_8s_simd;
@@ -536,10 +539,17 @@ void sbc_init_primitives(struct sbc_encoder_state *state)
 	state->sbc_calc_scalefactors_j = sbc_calc_scalefactors_j;
 	state->implementation_info = "Generic C";
 
-	/* X86/AMD64 optimizations */
+	if (impl == SBC_FLAG_IMPL_GENERIC)
+		return;
+
+	/* X86/AMD64 optimizations, the widest supported vectors win */
 #ifdef SBC_BUILD_WITH_MMX_SUPPORT
 	sbc_init_primitives_mmx(state);
 #endif
+#ifdef SBC_BUILD_WITH_SSE_SUPPORT
+	if (impl != SBC_FLAG_IMPL_MMX)
+		sbc_init_primitives_sse(state, flags);
+#endif
 
 	/* ARM optimizations */
 #ifdef SBC_BUILD_WITH_ARMV6_SUPPORT
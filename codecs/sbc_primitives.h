@@ -75,6 +75,7 @@ struct sbc_encoder_state {
  * of SBC codec. Best implementation is selected based on target CPU
  * capabilities.
  */
-void sbc_init_primitives(struct sbc_encoder_state *encoder_state);
+void sbc_init_primitives(struct sbc_encoder_state *encoder_state,
+							unsigned long flags);
 
 #endif
@@ -0,0 +1,496 @@
+/*
+ *
+ *  Bluetooth low-complexity, subband codec (SBC) library
+ *
+ *
+ *  This library is free software; you can redistribute it and/or
+ *  modify it under the terms of the GNU Lesser General Public
+ *  License as published by the Free Software Foundation; either
+ *  version 2.1 of the License, or (at your option) any later version.
+ *
+ *  This library is distributed in the hope that it will be useful,
+ *  but WITHOUT ANY WARRANTY; without even the implied warranty of
+ *  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+ *  Lesser General Public License for more details.
+ *
+ *  You should have received a copy of the GNU Lesser General Public
+ *  License along with this library; if not, write to the Free Software
+ *  Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+ *
+ */
+
+#include <stdint.h>
+#include <limits.h>
+#include "sbc.h"
+#include "sbc_math.h"
+#include "sbc_tables.h"
+
+#include "sbc_primitives_sse.h"
+
+/*
+ * SSE2 and AVX2 optimizations
+ *
+ * These follow the same arithmetic as the MMX code (pairwise 16x16->32
+ * multiply-accumulate with saturating packing between the two filter
+ * stages) and therefore produce bit-exact output, just with wider
+ * vectors.  The AVX2 functions are compiled with a target attribute so
+ * that the rest of the library does not require AVX2 support; they are
+ * only selected after checking the CPU at runtime.
+ */
+
+#ifdef SBC_BUILD_WITH_SSE_SUPPORT
+
+#include <emmintrin.h>
+#include <immintrin.h>
+
+#define SSE2_TARGET __attribute__((target("sse2")))
+#define AVX2_TARGET __attribute__((target("avx2")))
+
+#define LOADU(p) _mm_loadu_si128((const __m128i *) (p))
+#define STOREU(p, v) _mm_storeu_si128((__m128i *) (p), (v))
+#define LOADU256(p) _mm256_loadu_si256((const __m256i *) (p))
+#define STOREU256(p, v) _mm256_storeu_si256((__m256i *) (p), (v))
+
+/*
+ * Analysis filter
+ */
+
+static inline SSE2_TARGET void sbc_analyze_four_sse2(const int16_t *in,
+					int32_t *out, const FIXED_T *consts)
+{
+	__m128i t1, t2;
+	int hop;
+
+	/* rounding coefficient */
+	t1 = _mm_set1_epi32(1 << (SBC_PROTO_FIXED4_SCALE - 1));
+
+	/* low pass polyphase filter */
+	for (hop = 0; hop < 40; hop += 8)
+		t1 = _mm_add_epi32(t1, _mm_madd_epi16(LOADU(in + hop),
+						LOADU(consts + hop)));
+
+	/* scaling */
+	t1 = _mm_srai_epi32(t1, SBC_PROTO_FIXED4_SCALE);
+	t2 = _mm_packs_epi32(t1, t1);
+
+	/* do the cos transform */
+	t1 = _mm_add_epi32(
+		_mm_madd_epi16(_mm_shuffle_epi32(t2, 0x00), LOADU(consts + 40)),
+		_mm_madd_epi16(_mm_shuffle_epi32(t2, 0x55), LOADU(consts + 48)));
+
+	STOREU(out, t1);
+}
+
+static inline SSE2_TARGET void sbc_analyze_eight_sse2(const int16_t *in,
+					int32_t *out, const FIXED_T *consts)
+{
+	__m128i t1a, t1b, t2;
+	int hop;
+
+	/* rounding coefficient */
+	t1a = t1b = _mm_set1_epi32(1 << (SBC_PROTO_FIXED8_SCALE - 1));
+
+	/* low pass polyphase filter */
+	for (hop = 0; hop < 80; hop += 16) {
+		t1a = _mm_add_epi32(t1a, _mm_madd_epi16(LOADU(in + hop),
+						LOADU(consts + hop)));
+		t1b = _mm_add_epi32(t1b, _mm_madd_epi16(LOADU(in + hop + 8),
+						LOADU(consts + hop + 8)));
+	}
+
+	/* scaling */
+	t1a = _mm_srai_epi32(t1a, SBC_PROTO_FIXED8_SCALE);
+	t1b = _mm_srai_epi32(t1b, SBC_PROTO_FIXED8_SCALE);
+	t2 = _mm_packs_epi32(t1a, t1b);
+
+	/* do the cos transform, one pair of scaled samples at a time */
+#define COS8_PAIR(i, shuf) do {						\
+		__m128i p = _mm_shuffle_epi32(t2, shuf);		\
+		t1a = _mm_add_epi32(t1a, _mm_madd_epi16(p,		\
+					LOADU(consts + 80 + (i) * 16)));	\
+		t1b = _mm_add_epi32(t1b, _mm_madd_epi16(p,		\
+					LOADU(consts + 88 + (i) * 16)));	\
+	} while (0)
+
+	t1a = t1b = _mm_setzero_si128();
+	COS8_PAIR(0, 0x00);
+	COS8_PAIR(1, 0x55);
+	COS8_PAIR(2, 0xaa);
+	COS8_PAIR(3, 0xff);
+#undef COS8_PAIR
+
+	STOREU(out, t1a);
+	STOREU(out + 4, t1b);
+}
+
+static SSE2_TARGET void sbc_analyze_4b_4s_sse2(int16_t *x, int32_t *out,
+						int out_stride)
+{
+	/* Analyze blocks */
+	sbc_analyze_four_sse2(x + 12, out, analysis_consts_fixed4_simd_odd);
+	out += out_stride;
+	sbc_analyze_four_sse2(x + 8, out, analysis_consts_fixed4_simd_even);
+	out += out_stride;
+	sbc_analyze_four_sse2(x + 4, out, analysis_consts_fixed4_simd_odd);
+	out += out_stride;
+	sbc_analyze_four_sse2(x + 0, out, analysis_consts_fixed4_simd_even);
+}
+
+static SSE2_TARGET void sbc_analyze_4b_8s_sse2(int16_t *x, int32_t *out,
+						int out_stride)
+{
+	/* Analyze blocks */
+	sbc_analyze_eight_sse2(x + 24, out, analysis_consts_fixed8_simd_odd);
+	out += out_stride;
+	sbc_analyze_eight_sse2(x + 16, out, analysis_consts_fixed8_simd_even);
+	out += out_stride;
+	sbc_analyze_eight_sse2(x + 8, out, analysis_consts_fixed8_simd_odd);
+	out += out_stride;
+	sbc_analyze_eight_sse2(x + 0, out, analysis_consts_fixed8_simd_even);
+}
+
+/*
+ * With 4 subbands, two blocks (an odd and an even one) are filtered at
+ * once in the two 128-bit lanes of an AVX2 register.
+ */
+static inline AVX2_TARGET void sbc_analyze_four_x2_avx2(const int16_t *in_odd,
+				const int16_t *in_even, int32_t *out_odd,
+				int32_t *out_even)
+{
+	const FIXED_T *c_odd = analysis_consts_fixed4_simd_odd;
+	const FIXED_T *c_even = analysis_consts_fixed4_simd_even;
+	__m256i t1, t2;
+	int hop;
+
+#define LOAD_X2(lo, hi) _mm256_inserti128_si256(			\
+		_mm256_castsi128_si256(LOADU(lo)), LOADU(hi), 1)
+
+	/* rounding coefficient */
+	t1 = _mm256_set1_epi32(1 << (SBC_PROTO_FIXED4_SCALE - 1));
+
+	/* low pass polyphase filter */
+	for (hop = 0; hop < 40; hop += 8)
+		t1 = _mm256_add_epi32(t1, _mm256_madd_epi16(
+				LOAD_X2(in_odd + hop, in_even + hop),
+				LOAD_X2(c_odd + hop, c_even + hop)));
+
+	/* scaling */
+	t1 = _mm256_srai_epi32(t1, SBC_PROTO_FIXED4_SCALE);
+	t2 = _mm256_packs_epi32(t1, t1);
+
+	/* do the cos transform */
+	t1 = _mm256_add_epi32(
+		_mm256_madd_epi16(_mm256_shuffle_epi32(t2, 0x00),
+				LOAD_X2(c_odd + 40, c_even + 40)),
+		_mm256_madd_epi16(_mm256_shuffle_epi32(t2, 0x55),
+				LOAD_X2(c_odd + 48, c_even + 48)));
+#undef LOAD_X2
+
+	STOREU(out_odd, _mm256_castsi256_si128(t1));
+	STOREU(out_even, _mm256_extracti128_si256(t1, 1));
+}
+
+static inline AVX2_TARGET void sbc_analyze_eight_avx2(const int16_t *in,
+					int32_t *out, const FIXED_T *consts)
+{
+	__m256i t1;
+	__m128i t2;
+	int hop;
+
+	/* rounding coefficient */
+	t1 = _mm256_set1_epi32(1 << (SBC_PROTO_FIXED8_SCALE - 1));
+
+	/* low pass polyphase filter */
+	for (hop = 0; hop < 80; hop += 16)
+		t1 = _mm256_add_epi32(t1, _mm256_madd_epi16(
+				LOADU256(in + hop), LOADU256(consts + hop)));
+
+	/* scaling */
+	t1 = _mm256_srai_epi32(t1, SBC_PROTO_FIXED8_SCALE);
+	t2 = _mm_packs_epi32(_mm256_castsi256_si128(t1),
+				_mm256_extracti128_si256(t1, 1));
+
+	/* do the cos transform, one pair of scaled samples at a time */
+#define COS8_PAIR(i, shuf) _mm256_madd_epi16(				\
+		_mm256_broadcastd_epi32(_mm_shuffle_epi32(t2, shuf)),	\
+		LOADU256(consts + 80 + (i) * 16))
+
+	t1 = _mm256_add_epi32(_mm256_add_epi32(COS8_PAIR(0, 0x00),
+						COS8_PAIR(1, 0x55)),
+				_mm256_add_epi32(COS8_PAIR(2, 0xaa),
+						COS8_PAIR(3, 0xff)));
+#undef COS8_PAIR
+
+	STOREU256(out, t1);
+}
+
+static AVX2_TARGET void sbc_analyze_4b_4s_avx2(int16_t *x, int32_t *out,
+						int out_stride)
+{
+	/* Analyze blocks */
+	sbc_analyze_four_x2_avx2(x + 12, x + 8, out, out + out_stride);
+	out += 2 * out_stride;
+	sbc_analyze_four_x2_avx2(x + 4, x + 0, out, out + out_stride);
+}
+
+static AVX2_TARGET void sbc_analyze_4b_8s_avx2(int16_t *x, int32_t *out,
+						int out_stride)
+{
+	/* Analyze blocks */
+	sbc_analyze_eight_avx2(x + 24, out, analysis_consts_fixed8_simd_odd);
+	out += out_stride;
+	sbc_analyze_eight_avx2(x + 16, out, analysis_consts_fixed8_simd_even);
+	out += out_stride;
+	sbc_analyze_eight_avx2(x + 8, out, analysis_consts_fixed8_simd_odd);
+	out += out_stride;
+	sbc_analyze_eight_avx2(x + 0, out, analysis_consts_fixed8_simd_even);
+}
+
+/*
+ * Scale factors
+ *
+ * For every sample the value (|x| - 1) is OR'ed into an accumulator
+ * seeded with (1 << SCALE_OUT_BITS), exactly as in the C version, using
+ * the same compare/add/xor sequence as the MMX code since SSE2 has no
+ * packed absolute value instruction.
+ */
+
+static inline SSE2_TARGET __m128i abs_minus_one_sse2(__m128i v)
+{
+	const __m128i zero = _mm_setzero_si128();
+	v = _mm_add_epi32(v, _mm_cmpgt_epi32(v, zero));
+	return _mm_xor_si128(v, _mm_cmpgt_epi32(zero, v));
+}
+
+static inline AVX2_TARGET __m256i abs_minus_one_avx2(__m256i v)
+{
+	const __m256i zero = _mm256_setzero_si256();
+	v = _mm256_add_epi32(v, _mm256_cmpgt_epi32(v, zero));
+	return _mm256_xor_si256(v, _mm256_cmpgt_epi32(zero, v));
+}
+
+static inline uint32_t scale_factor_of(uint32_t x)
+{
+	return (31 - SCALE_OUT_BITS) - __builtin_clz(x);
+}
+
+static SSE2_TARGET void sbc_calc_scalefactors_sse2(
+	int32_t sb_sample_f[16][2][8],
+	uint32_t scale_factor[2][8],
+	int blocks, int channels, int subbands)
+{
+	uint32_t SBC_ALIGNED x[4];
+	int ch, sb, blk, i;
+
+	for (ch = 0; ch < channels; ch++) {
+		for (sb = 0; sb < subbands; sb += 4) {
+			__m128i acc = _mm_set1_epi32(1 << SCALE_OUT_BITS);
+			for (blk = 0; blk < blocks; blk++)
+				acc = _mm_or_si128(acc, abs_minus_one_sse2(
+					LOADU(&sb_sample_f[blk][ch][sb])));
+			_mm_store_si128((__m128i *) x, acc);
+			for (i = 0; i < 4; i++)
+				scale_factor[ch][sb + i] = scale_factor_of(x[i]);
+		}
+	}
+}
+
+static AVX2_TARGET void sbc_calc_scalefactors_avx2(
+	int32_t sb_sample_f[16][2][8],
+	uint32_t scale_factor[2][8],
+	int blocks, int channels, int subbands)
+{
+	uint32_t SBC_ALIGNED x[8];
+	int ch, blk, i;
+
+	if (subbands != 8) {
+		sbc_calc_scalefactors_sse2(sb_sample_f, scale_factor,
+						blocks, channels, subbands);
+		return;
+	}
+
+	for (ch = 0; ch < channels; ch++) {
+		__m256i acc = _mm256_set1_epi32(1 << SCALE_OUT_BITS);
+		for (blk = 0; blk < blocks; blk++)
+			acc = _mm256_or_si256(acc, abs_minus_one_avx2(
+				LOADU256(&sb_sample_f[blk][ch][0])));
+		STOREU256(x, acc);
+		for (i = 0; i < 8; i++)
+			scale_factor[ch][i] = scale_factor_of(x[i]);
+	}
+}
+
+/*
+ * Decide, for every subband but the last, whether to use joint stereo,
+ * given the accumulated (|x| - 1) values for the left/right and the
+ * mid/side samples.  Returns the joint stereo bits for the subbands
+ * handled and flags in "use_joint" which of them switched to mid/side.
+ */
+static inline int sbc_joint_decide(uint32_t scale_factor[2][8],
+				int subbands, int sb, int n,
+				const uint32_t *x, const uint32_t *y,
+				const uint32_t *xj, const uint32_t *yj,
+				int32_t *use_joint)
+{
+	int i, joint = 0;
+
+	for (i = 0; i < n; i++) {
+		uint32_t sj0, sj1;
+
+		scale_factor[0][sb + i] = scale_factor_of(x[i]);
+		scale_factor[1][sb + i] = scale_factor_of(y[i]);
+		use_joint[i] = 0;
+
+		/* last subband does not use joint stereo */
+		if (sb + i == subbands - 1)
+			continue;
+
+		sj0 = scale_factor_of(xj[i]);
+		sj1 = scale_factor_of(yj[i]);
+		if ((scale_factor[0][sb + i] + scale_factor[1][sb + i]) >
+								sj0 + sj1) {
+			joint |= 1 << (subbands - 1 - (sb + i));
+			scale_factor[0][sb + i] = sj0;
+			scale_factor[1][sb + i] = sj1;
+			use_joint[i] = -1;
+		}
+	}
+
+	return joint;
+}
+
+static SSE2_TARGET int sbc_calc_scalefactors_j_sse2(
+	int32_t sb_sample_f[16][2][8],
+	uint32_t scale_factor[2][8],
+	int blocks, int subbands)
+{
+	uint32_t SBC_ALIGNED x[4], y[4], xj[4], yj[4];
+	int32_t SBC_ALIGNED use_joint[4];
+	int sb, blk, joint = 0;
+
+	for (sb = 0; sb < subbands; sb += 4) {
+		__m128i ax, ay, axj, ayj, mask;
+
+		ax = ay = axj = ayj = _mm_set1_epi32(1 << SCALE_OUT_BITS);
+		for (blk = 0; blk < blocks; blk++) {
+			__m128i l = LOADU(&sb_sample_f[blk][0][sb]);
+			__m128i r = LOADU(&sb_sample_f[blk][1][sb]);
+			__m128i hl = _mm_srai_epi32(l, 1);
+			__m128i hr = _mm_srai_epi32(r, 1);
+			ax = _mm_or_si128(ax, abs_minus_one_sse2(l));
+			ay = _mm_or_si128(ay, abs_minus_one_sse2(r));
+			axj = _mm_or_si128(axj, abs_minus_one_sse2(
+						_mm_add_epi32(hl, hr)));
+			ayj = _mm_or_si128(ayj, abs_minus_one_sse2(
+						_mm_sub_epi32(hl, hr)));
+		}
+		_mm_store_si128((__m128i *) x, ax);
+		_mm_store_si128((__m128i *) y, ay);
+		_mm_store_si128((__m128i *) xj, axj);
+		_mm_store_si128((__m128i *) yj, ayj);
+
+		joint |= sbc_joint_decide(scale_factor, subbands, sb, 4,
+						x, y, xj, yj, use_joint);
+		if (!(use_joint[0] | use_joint[1] | use_joint[2] |
+								use_joint[3]))
+			continue;
+
+		/* replace left/right with mid/side where selected */
+		mask = _mm_load_si128((const __m128i *) use_joint);
+		for (blk = 0; blk < blocks; blk++) {
+			__m128i l = LOADU(&sb_sample_f[blk][0][sb]);
+			__m128i r = LOADU(&sb_sample_f[blk][1][sb]);
+			__m128i hl = _mm_srai_epi32(l, 1);
+			__m128i hr = _mm_srai_epi32(r, 1);
+			STOREU(&sb_sample_f[blk][0][sb], _mm_or_si128(
+				_mm_and_si128(mask, _mm_add_epi32(hl, hr)),
+				_mm_andnot_si128(mask, l)));
+			STOREU(&sb_sample_f[blk][1][sb], _mm_or_si128(
+				_mm_and_si128(mask, _mm_sub_epi32(hl, hr)),
+				_mm_andnot_si128(mask, r)));
+		}
+	}
+
+	return joint;
+}
+
+static AVX2_TARGET int sbc_calc_scalefactors_j_avx2(
+	int32_t sb_sample_f[16][2][8],
+	uint32_t scale_factor[2][8],
+	int blocks, int subbands)
+{
+	uint32_t SBC_ALIGNED x[8], y[8], xj[8], yj[8];
+	int32_t SBC_ALIGNED use_joint[8];
+	__m256i ax, ay, axj, ayj, mask;
+	int blk, i, joint, any = 0;
+
+	if (subbands != 8)
+		return sbc_calc_scalefactors_j_sse2(sb_sample_f, scale_factor,
+							blocks, subbands);
+
+	ax = ay = axj = ayj = _mm256_set1_epi32(1 << SCALE_OUT_BITS);
+	for (blk = 0; blk < blocks; blk++) {
+		__m256i l = LOADU256(&sb_sample_f[blk][0][0]);
+		__m256i r = LOADU256(&sb_sample_f[blk][1][0]);
+		__m256i hl = _mm256_srai_epi32(l, 1);
+		__m256i hr = _mm256_srai_epi32(r, 1);
+		ax = _mm256_or_si256(ax, abs_minus_one_avx2(l));
+		ay = _mm256_or_si256(ay, abs_minus_one_avx2(r));
+		axj = _mm256_or_si256(axj, abs_minus_one_avx2(
+					_mm256_add_epi32(hl, hr)));
+		ayj = _mm256_or_si256(ayj, abs_minus_one_avx2(
+					_mm256_sub_epi32(hl, hr)));
+	}
+	STOREU256(x, ax);
+	STOREU256(y, ay);
+	STOREU256(xj, axj);
+	STOREU256(yj, ayj);
+
+	joint = sbc_joint_decide(scale_factor, 8, 0, 8, x, y, xj, yj,
+								use_joint);
+	for (i = 0; i < 8; i++)
+		any |= use_joint[i];
+	if (!any)
+		return joint;
+
+	/* replace left/right with mid/side where selected */
+	mask = LOADU256(use_joint);
+	for (blk = 0; blk < blocks; blk++) {
+		__m256i l = LOADU256(&sb_sample_f[blk][0][0]);
+		__m256i r = LOADU256(&sb_sample_f[blk][1][0]);
+		__m256i hl = _mm256_srai_epi32(l, 1);
+		__m256i hr = _mm256_srai_epi32(r, 1);
+		STOREU256(&sb_sample_f[blk][0][0], _mm256_blendv_epi8(l,
+				_mm256_add_epi32(hl, hr), mask));
+		STOREU256(&sb_sample_f[blk][1][0], _mm256_blendv_epi8(r,
+				_mm256_sub_epi32(hl, hr), mask));
+	}
+
+	return joint;
+}
+
+void sbc_init_primitives_sse(struct sbc_encoder_state *state,
+							unsigned long flags)
+{
+	unsigned long impl = flags & SBC_FLAG_IMPL_MASK;
+
+	__builtin_cpu_init();
+
+	if ((impl == 0 || impl >= SBC_FLAG_IMPL_AVX2) &&
+					__builtin_cpu_supports("avx2")) {
+		state->sbc_analyze_4b_4s = sbc_analyze_4b_4s_avx2;
+		state->sbc_analyze_4b_8s = sbc_analyze_4b_8s_avx2;
+		state->sbc_calc_scalefactors = sbc_calc_scalefactors_avx2;
+		state->sbc_calc_scalefactors_j = sbc_calc_scalefactors_j_avx2;
+		state->implementation_info = "AVX2";
+	} else if ((impl == 0 || impl >= SBC_FLAG_IMPL_SSE2) &&
+					__builtin_cpu_supports("sse2")) {
+		state->sbc_analyze_4b_4s = sbc_analyze_4b_4s_sse2;
+		state->sbc_analyze_4b_8s = sbc_analyze_4b_8s_sse2;
+		state->sbc_calc_scalefactors = sbc_calc_scalefactors_sse2;
+		state->sbc_calc_scalefactors_j = sbc_calc_scalefactors_j_sse2;
+		state->implementation_info = "SSE2";
+	}
+}
+
+#endif
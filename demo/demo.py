@@ -4,9 +4,6 @@ import readline  # noqa
 import bt_manager
 import sys
 import dbus
-import dbus.mainloop.glib
-import gobject
-import signal
 from collections import namedtuple
 
 
@@ -761,15 +758,10 @@ def invoke_bt_command(text):
         print 'Error: Command "%s" was not recognized.' % cmd
 
 
-def timeout_handler(signum, frame):
-    while gobject.MainLoop().get_context().pending():
-        gobject.MainLoop().get_context().iteration(False)
-
-
-dbus.mainloop.glib.DBusGMainLoop(set_as_default=True)
-gobject.threads_init()
-signal.signal(signal.SIGALRM, timeout_handler)
-signal.setitimer(signal.ITIMER_REAL, 0.01, 0.01)
+# Run the GLib main loop on its own thread and hand each command over
+# to it, so that it sleeps until there is something to do.
+runner = bt_manager.runner
+runner.start()
 
 try:
     adapter = bt_manager.BTAdapter()
@@ -796,4 +788,4 @@ services = {}
 # Main command processing loop
 while True:
     text = raw_input("BT> ")
-    invoke_bt_command(text)
+    runner.call(invoke_bt_command, text)
@@ -25,9 +25,10 @@ setup(
     include_package_data=True,
     install_requires=[
         'setuptools',
-        'cffi >= 0.7',
+        'cffi >= 1.12',
     ],
-    setup_requires=['cffi >= 0.7'],
+    setup_requires=['cffi >= 1.12'],
+    cffi_modules=['bt_manager/rtpsbc_build.py:ffibuilder'],
     test_suite='nose.collector',
     tests_require=[
         'nose',
@@ -0,0 +1,80 @@
+"""
+Generator for the variable-bitpool regression corpus used by
+SBCCodecTest.  Each capture holds the RTP packets of one stream whose
+source changes bitpool mid-stream, stored back-to-back with a 16-bit
+big-endian length prefix per packet.
+
+The captures are checked in, so this only needs running again if the
+corpus itself is to change:
+
+    python tests/make_vbp_vectors.py
+"""
+from __future__ import unicode_literals
+
+import math
+import os
+import struct
+
+import bt_manager
+
+VECTORS = {
+    'vbp_joint_44k.dat': {
+        'config': bt_manager.SBCCodecConfig(
+            bt_manager.SBCChannelMode.CHANNEL_MODE_JOINT_STEREO,
+            bt_manager.SBCSamplingFrequency.FREQ_44_1KHZ,
+            bt_manager.SBCAllocationMethod.LOUDNESS,
+            bt_manager.SBCSubbands.SUBBANDS_8,
+            bt_manager.SBCBlocks.BLOCKS_16,
+            2,
+            53),
+        'mtu': 1500,
+        'bitpools': [53, 53, 45, 45, 35, 35, 29, 29, 35, 45],
+        'frames': 150,
+    },
+    'vbp_mono_48k.dat': {
+        'config': bt_manager.SBCCodecConfig(
+            bt_manager.SBCChannelMode.CHANNEL_MODE_MONO,
+            bt_manager.SBCSamplingFrequency.FREQ_48KHZ,
+            bt_manager.SBCAllocationMethod.SNR,
+            bt_manager.SBCSubbands.SUBBANDS_4,
+            bt_manager.SBCBlocks.BLOCKS_8,
+            2,
+            31),
+        'mtu': 672,
+        'bitpools': [31, 18, 64, 8, 24],
+        'frames': 120,
+    },
+}
+
+
+def pcm(codec, frames, channels):
+    samples = codec.codesize * frames // (2 * channels)
+    return b''.join(struct.pack(str('<h'),
+                                int(8000 * math.sin(i * (0.01 + i * 1e-5))))
+                    * channels for i in range(samples))
+
+
+def generate(name, config, mtu, bitpools, frames):
+    codec = bt_manager.SBCCodec(config, ssrc=0x5bc, seq_num=0xFFF0,
+                                timestamp=0)
+    channels = 1 if (config.channel_mode ==
+                     bt_manager.SBCChannelMode.CHANNEL_MODE_MONO) else 2
+    data = pcm(codec, frames, channels)
+    buf = bytearray(mtu)
+    packets = []
+    while (data):
+        codec.config.bitpool = bitpools[len(packets) % len(bitpools)]
+        (consumed, lengths) = codec.encode_to_buffer(mtu, data, buf, 1)
+        if (not lengths):
+            break
+        packets.append(bytes(buf[:lengths[0]]))
+        data = data[consumed:]
+    with open(name, 'wb') as fh:
+        for packet in packets:
+            fh.write(struct.pack(str('!H'), len(packet)) + packet)
+
+
+if __name__ == '__main__':
+    directory = os.path.dirname(os.path.abspath(__file__))
+    for (name, vector) in VECTORS.items():
+        generate(os.path.join(directory, name), **vector)
@@ -6,6 +6,16 @@ import bt_manager
 import mock
 import dbus
 import os
+import sys
+import Queue
+import struct
+import threading
+import time
+
+try:
+    import trollius
+except ImportError:
+    trollius = None
 
 
 class MockDBusInterface:
@@ -579,13 +589,25 @@ class MockDBusInterface:
     def FindAdapter(self, *args):
         return '/org/bluez/985/hci0'
 
-    def DefaultAdapter(self, *args):
+    def DefaultAdapter(self, *args, **kwargs):
+        if ('reply_handler' in kwargs):
+            kwargs['reply_handler']('/org/bluez/985/hci0')
+            return
         return '/org/bluez/985/hci0'
 
-    def SetProperty(self, name, value):
+    def SetProperty(self, name, value, reply_handler=None,
+                    error_handler=None):
+        if (name not in self._props and error_handler):
+            error_handler(dbus.DBusException('org.bluez.Error.DoesNotExist'))  # noqa
+            return
         self._props[name] = value
+        if (reply_handler):
+            reply_handler()
 
-    def GetProperties(self):
+    def GetProperties(self, reply_handler=None, error_handler=None):
+        if (reply_handler):
+            reply_handler(self._props)
+            return
         return self._props
 
     def FindDevice(self, *args):
@@ -600,8 +622,9 @@ class MockDBusInterface:
         self._cb_notify_device = reply_handler
         self._cb_notify_error = error_handler
 
-    def RemoveDevice(self, dev_obj):
-        pass
+    def RemoveDevice(self, dev_obj, reply_handler=None, error_handler=None):
+        if (reply_handler):
+            reply_handler()
 
     def RegisterAgent(self, path, caps):
         pass
@@ -609,8 +632,13 @@ class MockDBusInterface:
     def UnregisterAgent(self, path):
         pass
 
-    def Connect(self):
+    def Connect(self, reply_handler=None, error_handler=None):
+        if (self._props['Connected'] and error_handler):
+            error_handler(dbus.DBusException('org.bluez.Error.AlreadyConnected'))  # noqa
+            return
         self._props['Connected'] = True
+        if (reply_handler):
+            reply_handler()
 
     def IsConnected(self):
         return self._props['Connected']
@@ -624,7 +652,11 @@ class MockDBusInterface:
     def VolumeDown(self):
         pass
 
-    def DiscoverServices(self, pattern):
+    def DiscoverServices(self, pattern, reply_handler=None,
+                         error_handler=None):
+        if (reply_handler):
+            reply_handler(self._services)
+            return
         return self._services
 
     def RegisterEndpoint(self, path, properties):
@@ -679,6 +711,24 @@ class BTDbusTypeTranslation(unittest.TestCase):
         val = 'False'
         self.assertEqual(bt_manager.interface.translate_to_dbus_type(dbus.Boolean, val),  # noqa
                          dbus.Boolean(False))
+        val = 'yes'
+        self.assertEqual(bt_manager.interface.translate_to_dbus_type(dbus.Boolean, val),  # noqa
+                         dbus.Boolean(True))
+        val = '0x10'
+        self.assertEqual(bt_manager.interface.translate_to_dbus_type(dbus.UInt32, val),  # noqa
+                         dbus.UInt32(16))
+        val = '2.5'
+        self.assertEqual(bt_manager.interface.translate_to_dbus_type(dbus.Double, val),  # noqa
+                         dbus.Double(2.5))
+        val = "['a', 'b']"
+        self.assertEqual(bt_manager.interface.translate_to_dbus_type(dbus.Array, val),  # noqa
+                         dbus.Array(['a', 'b']))
+        self.assertRaises(ValueError,
+                          bt_manager.interface.translate_to_dbus_type,
+                          dbus.Boolean, 'maybe')
+        self.assertRaises(ValueError,
+                          bt_manager.interface.translate_to_dbus_type,
+                          dbus.Array, '__import__("os")')
 
 
 class BTManagerTest(unittest.TestCase):
@@ -705,6 +755,436 @@ class BTManagerTest(unittest.TestCase):
         print 'Default:', manager.default_adapter()
 
 
+class BTRegistryTest(unittest.TestCase):
+
+    def setUp(self):
+        patcher = mock.patch('dbus.Interface', MockDBusInterface)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        patcher = mock.patch('dbus.SystemBus')
+        patched_system_bus = patcher.start()
+        self.addCleanup(patcher.stop)
+        mock_system_bus = mock.MagicMock()
+        patched_system_bus.return_value = mock_system_bus
+        mock_system_bus.get_object.return_value = dbus.ObjectPath('/org/bluez')
+        self.patched_system_bus = patched_system_bus
+        self.mock_system_bus = mock_system_bus
+        self.registry = bt_manager.registry
+        self.addCleanup(self.registry.clear)
+        self.registry.get_bus()
+        self.base = self.registry.stats()
+
+    def test_registry_shared_proxies(self):
+        dev_path = '/org/bluez/985/hci0/dev_00_11_67_D2_AB_EE'
+        adapter = bt_manager.BTAdapter()
+        bt_manager.BTDevice(dev_path=dev_path)
+        bt_manager.BTDevice(dev_path=dev_path)
+        bt_manager.BTAudioSink(dev_path=dev_path)
+        self.assertEqual(self.mock_system_bus.get_object.call_count, 3)
+        stats = self.registry.stats()
+        self.assertEqual(stats.proxies, 3)
+        self.assertTrue(adapter._bus is self.mock_system_bus)
+
+    def test_registry_wrappers(self):
+        dev_path = '/org/bluez/985/hci0/dev_00_11_67_D2_AB_EE'
+        device = self.registry.get_wrapper(bt_manager.BTDevice, dev_path,
+                                           dev_path=dev_path)
+        self.assertTrue(self.registry.get_wrapper(bt_manager.BTDevice,
+                                                  dev_path,
+                                                  dev_path=dev_path)
+                        is device)
+        self.assertFalse(self.registry.get_wrapper(bt_manager.BTAudioSink,
+                                                   dev_path,
+                                                   dev_path=dev_path)
+                         is device)
+        stats = self.registry.stats()
+        self.assertEqual((stats.hits - self.base.hits,
+                          stats.misses - self.base.misses), (1, 2))
+        del device
+        self.assertEqual(self.registry.stats().wrappers, 0)
+
+    def test_registry_device_lookups(self):
+        bt_manager.BTDevice(dev_id='00:11:67:D2:AB:EE')
+        bt_manager.BTDevice(dev_id='00:11:67:D2:AB:EE')
+        bt_manager.BTControl(dev_id='00:11:67:D2:AB:EE')
+        stats = self.registry.stats()
+        self.assertEqual(stats.pinned, 2)
+        self.assertEqual(stats.misses - self.base.misses, 2)
+
+    def test_registry_eviction(self):
+        adapter = bt_manager.BTAdapter()
+        dev_path = '/org/bluez/985/hci0/dev_00_11_67_D2_AB_EE'
+        device = self.registry.get_wrapper(bt_manager.BTDevice, dev_path,
+                                           pinned=True, dev_path=dev_path)
+        self.registry.get_object(dev_path + '/fd0')
+        self.assertEqual(self.registry.stats().proxies, 4)
+        adapter.remove_device(dev_path)
+        stats = self.registry.stats()
+        self.assertEqual(stats.proxies, 2)
+        self.assertEqual(stats.pinned, 1)
+        self.assertEqual(stats.evictions - self.base.evictions, 2)
+        self.assertFalse(self.registry.get_wrapper(bt_manager.BTDevice,
+                                                   dev_path,
+                                                   dev_path=dev_path)
+                         is device)
+
+    def test_registry_watch_removals(self):
+        self.registry.watch_removals()
+        self.registry.watch_removals()
+        calls = self.mock_system_bus.add_signal_receiver.call_args_list
+        self.assertEqual(len(calls), 2)
+        bt_manager.BTAdapter()
+        self.assertEqual(self.registry.stats().proxies, 2)
+        calls[0][0][0]('/org/bluez/985/hci0')
+        self.assertEqual(self.registry.stats().proxies, 1)
+
+    def test_registry_bus_change(self):
+        bt_manager.BTAdapter()
+        self.assertEqual(self.registry.stats().pinned, 1)
+        self.patched_system_bus.return_value = mock.MagicMock()
+        self.registry.get_bus()
+        stats = self.registry.stats()
+        self.assertEqual((stats.proxies, stats.pinned), (0, 0))
+
+
+class BTCallLimiterTest(unittest.TestCase):
+
+    def test_call_limiter(self):
+        started = []
+
+        def start(n):
+            call = bt_manager.BTPendingCall()
+            started.append((n, call))
+            return call
+
+        def fail():
+            raise ValueError
+
+        limiter = bt_manager.BTCallLimiter(2)
+        calls = [limiter.submit(start, n) for n in range(5)]
+        calls.append(limiter.submit(fail))
+        combined = limiter.gather(calls)
+        self.assertEqual([n for (n, c) in started], [0, 1])
+        self.assertEqual((limiter.in_flight(), limiter.pending()), (2, 4))
+        started[1][1].reply_handler('one')
+        self.assertEqual(calls[1].result, 'one')
+        self.assertEqual([n for (n, c) in started], [0, 1, 2])
+        started[0][1].error_handler(dbus.DBusException('failed'))
+        self.assertTrue(isinstance(calls[0].exception, dbus.DBusException))
+        started[2][1].reply_handler()
+        started[3][1].reply_handler(1, 2)
+        self.assertEqual(len(started), 5)
+        self.assertFalse(combined.done())
+        self.assertEqual(limiter.pending(), 0)
+        started[4][1].reply_handler(4)
+        self.assertEqual(limiter.in_flight(), 0)
+        self.assertTrue(combined.done())
+        results = combined.wait()
+        self.assertEqual(results[1:5], ['one', None, (1, 2), 4])
+        self.assertTrue(isinstance(results[0], dbus.DBusException))
+        self.assertTrue(isinstance(results[5], ValueError))
+        self.assertEqual(limiter.gather([]).wait(), [])
+
+
+class SignalQueueTest(unittest.TestCase):
+
+    def setUp(self):
+        self.gate = threading.Event()
+        self.received = []
+
+    def handler(self, *args):
+        self.gate.wait(1)
+        self.received.append(args)
+
+    def fill(self, queue, names):
+        # The first signal is taken by the worker, which then waits
+        queue.put(self.handler, 'PropertyChanged', ('Busy', 0))
+        while (queue.stats().depth):
+            pass
+        for (n, name) in enumerate(names):
+            queue.put(self.handler, 'PropertyChanged', (name, n))
+
+    def test_drop_oldest(self):
+        queue = bt_manager.SignalQueue(maxsize=2)
+        self.addCleanup(queue.close)
+        self.fill(queue, ['A', 'B', 'C'])
+        self.assertEqual(queue.stats().depth, 2)
+        self.gate.set()
+        self.assertTrue(queue.join(1))
+        self.assertEqual(self.received, [('Busy', 0), ('B', 1), ('C', 2)])
+        stats = queue.stats()
+        self.assertEqual((stats.depth, stats.max_depth, stats.delivered,
+                          stats.dropped, stats.coalesced), (0, 2, 3, 1, 0))
+        self.assertTrue(stats.max_latency >= stats.mean_latency > 0)
+
+    def test_coalesce(self):
+        queue = bt_manager.SignalQueue(maxsize=3,
+                                       policy=bt_manager.SignalQueue.COALESCE)
+        self.addCleanup(queue.close)
+        self.fill(queue, ['A', 'B', 'A', 'C'])
+        self.gate.set()
+        self.assertTrue(queue.join(1))
+        # 'A' keeps its place in the queue but has the latest value
+        self.assertEqual(self.received,
+                         [('Busy', 0), ('A', 2), ('B', 1), ('C', 3)])
+        stats = queue.stats()
+        self.assertEqual((stats.dropped, stats.coalesced), (0, 1))
+
+    def test_block(self):
+        queue = bt_manager.SignalQueue(maxsize=1,
+                                       policy=bt_manager.SignalQueue.BLOCK,
+                                       timeout=0.01)
+        self.addCleanup(queue.close)
+        self.fill(queue, ['A', 'B'])
+        # Timed out waiting for room, so 'A' made way for 'B'
+        self.assertEqual(queue.stats().blocked, 1)
+        threading.Timer(0.01, self.gate.set).start()
+        queue.timeout = None
+        queue.put(self.handler, 'PropertyChanged', ('C', 2))
+        self.assertTrue(queue.join(1))
+        self.assertEqual(self.received, [('Busy', 0), ('B', 1), ('C', 2)])
+        self.assertEqual(queue.stats().blocked, 2)
+        queue.close()
+        queue.put(self.handler, 'PropertyChanged', ('D', 3))
+        self.assertEqual(queue.stats().depth, 0)
+
+    @mock.patch('dbus.SystemBus')
+    @mock.patch('dbus.Interface', MockDBusInterface)
+    def test_queued_signal_receiver(self, patched_system_bus):
+        mock_system_bus = mock.MagicMock()
+        patched_system_bus.return_value = mock_system_bus
+        mock_system_bus.get_object.return_value = dbus.ObjectPath('/org/bluez')
+        self.addCleanup(bt_manager.registry.clear)
+        queue = bt_manager.SignalQueue()
+        self.addCleanup(queue.close)
+        user = mock.MagicMock()
+        adapter = bt_manager.BTAdapter()
+        adapter.add_signal_receiver(user.callback_fn,
+                                    bt_manager.BTAdapter.SIGNAL_PROPERTY_CHANGED,  # noqa
+                                    'arg', queue=queue)
+        cb = mock_system_bus.add_signal_receiver.call_args_list[0][0][0]
+        cb('Powered', False)
+        self.assertTrue(queue.join(1))
+        user.callback_fn.assert_called_once_with(
+            bt_manager.BTAdapter.SIGNAL_PROPERTY_CHANGED, 'arg', 'Powered',
+            False)
+
+
+class MockGLibMainLoop:
+    """Mock gobject main loop running idle callbacks from a queue"""
+    def __init__(self):
+        self._queue = Queue.Queue()
+        self._running = False
+
+    def idle_add(self, fn, *args):
+        self._queue.put((fn, args))
+        return 1
+
+    def run(self):
+        self._running = True
+        while self._running:
+            (fn, args) = self._queue.get()
+            fn(*args)
+
+    def quit(self):
+        self._running = False
+
+
+class BTMainLoopRunnerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.glib = MockGLibMainLoop()
+        patcher = mock.patch('bt_manager.mainloop.gobject')
+        gobject = patcher.start()
+        self.addCleanup(patcher.stop)
+        gobject.MainLoop.return_value = self.glib
+        gobject.idle_add.side_effect = self.glib.idle_add
+        patcher = mock.patch('bt_manager.mainloop.dbus')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_runner_calls(self):
+        runner = bt_manager.BTMainLoopRunner()
+        self.assertEqual(runner.call(threading.current_thread),
+                         threading.current_thread())
+        runner.start()
+        self.addCleanup(runner.stop, 1)
+        self.assertTrue(runner.is_running())
+        self.assertFalse(runner.in_loop_thread())
+        thread = runner.call(threading.current_thread)
+        self.assertNotEqual(thread, threading.current_thread())
+        self.assertTrue(runner.call(runner.in_loop_thread))
+        # Nested calls from the loop thread run straight away
+        self.assertEqual(runner.call(runner.call, lambda x: x * 2, 21), 42)
+        self.assertRaises(ValueError, runner.call, int, 'x')
+        self.assertRaises(SystemExit, runner.call, sys.exit, 0)
+        done = threading.Event()
+        call = runner.call_soon(done.wait)
+        self.assertFalse(call.done())
+        done.set()
+        self.assertTrue(call.wait(1))
+        stats = runner.stats()
+        self.assertTrue(stats.running)
+        self.assertEqual(stats.calls, 8)
+        self.assertTrue(stats.max_latency >= stats.mean_latency >= 0)
+        runner.stop(1)
+        self.assertFalse(runner.is_running())
+        self.assertFalse(runner.stats().running)
+
+
+@unittest.skipIf(trollius is None, 'trollius is not installed')
+class AioTest(unittest.TestCase):
+
+    def setUp(self):
+        patcher = mock.patch('dbus.Interface', MockDBusInterface)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        patcher = mock.patch('dbus.SystemBus')
+        patched_system_bus = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.mock_system_bus = mock.MagicMock()
+        patched_system_bus.return_value = self.mock_system_bus
+        self.mock_system_bus.get_object.return_value = \
+            dbus.ObjectPath('/org/bluez')
+        self.addCleanup(bt_manager.registry.clear)
+        self.loop = trollius.new_event_loop()
+        self.addCleanup(self.loop.close)
+
+    def test_aio_method_calls(self):
+        from bt_manager import aio
+        manager = aio.AioBTManager(loop=self.loop)
+        path = self.loop.run_until_complete(manager.default_adapter())
+        self.assertEqual(path, '/org/bluez/985/hci0')
+        adapter = aio.AioBTAdapter(loop=self.loop)
+        name = self.loop.run_until_complete(adapter.get_property('Name'))
+        self.assertEqual(name, 'new-name')
+        device = aio.AioBTDevice(loop=self.loop, dev_path=path + '/dev_00')
+        services = self.loop.run_until_complete(device.discover_services())
+        self.assertEqual(len(services), 7)
+        self.assertRaises(KeyError, self.loop.run_until_complete,
+                          adapter.get_property('Missing'))
+
+    def test_aio_pending_call_from_thread(self):
+        from bt_manager import aio
+        call = bt_manager.BTPendingCall()
+        future = aio.wrap_pending_call(call, self.loop)
+        threading.Timer(0.01, call.reply_handler, ('done',)).start()
+        self.assertEqual(self.loop.run_until_complete(future), 'done')
+
+    def test_aio_signal_stream(self):
+        from bt_manager import aio
+        adapter = aio.AioBTAdapter(loop=self.loop)
+        self.assertRaises(bt_manager.BTSignalNameNotRecognisedException,
+                          adapter.signals, 'NoSuchSignal')
+        stream = adapter.signals(bt_manager.BTAdapter.SIGNAL_DEVICE_FOUND,
+                                 maxsize=2)
+        handler = self.mock_system_bus.add_signal_receiver.call_args[0][0]
+        for n in range(3):
+            handler('00:11:22:33:44:%02d' % n, {})
+        self.loop.run_until_complete(trollius.sleep(0, loop=self.loop))
+        self.assertEqual((stream.qsize(), stream.dropped), (2, 1))
+        (address, _) = self.loop.run_until_complete(stream.get())
+        self.assertEqual(address, '00:11:22:33:44:01')
+        stream.close()
+        self.assertTrue(self.mock_system_bus.remove_signal_receiver.called)
+
+    def test_aio_transport_ready(self):
+        codec = bt_manager.SBCAudioCodec(uuid='uuid', path='/endpoint/test')
+        (rfd, wfd) = os.pipe()
+        self.addCleanup(os.close, rfd)
+        self.addCleanup(os.close, wfd)
+        ready = []
+        codec.fd = wfd
+        codec.access_type = 'w'
+        codec.register_transport_ready_event(ready.append, 'arg')
+        codec.set_event_loop(self.loop)
+        codec._install_transport_ready()
+        self.loop.run_until_complete(trollius.sleep(0.01, loop=self.loop))
+        self.assertTrue(ready and ready[0] == 'arg')
+        codec._uninstall_transport_ready()
+        self.loop.run_until_complete(trollius.sleep(0, loop=self.loop))
+        count = len(ready)
+        self.loop.run_until_complete(trollius.sleep(0.01, loop=self.loop))
+        self.assertEqual(len(ready), count)
+
+
+class SignalDispatcherTest(unittest.TestCase):
+
+    def setUp(self):
+        patcher = mock.patch('dbus.Interface', MockDBusInterface)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        patcher = mock.patch('dbus.SystemBus')
+        patched_system_bus = patcher.start()
+        self.addCleanup(patcher.stop)
+        mock_system_bus = mock.MagicMock()
+        patched_system_bus.return_value = mock_system_bus
+        mock_system_bus.get_object.return_value = dbus.ObjectPath('/org/bluez')
+        self.mock_system_bus = mock_system_bus
+        bt_manager.dispatcher.enable()
+        self.addCleanup(bt_manager.dispatcher.disable)
+
+    def test_dispatcher_single_rule(self):
+        signal = bt_manager.BTAdapter.SIGNAL_PROPERTY_CHANGED
+        user1 = mock.MagicMock()
+        user2 = mock.MagicMock()
+        adapter1 = bt_manager.BTAdapter()
+        adapter2 = bt_manager.BTAdapter()
+        adapter1.add_signal_receiver(user1.callback_fn, signal, 1)
+        adapter2.add_signal_receiver(user2.callback_fn, signal, 2)
+        adapter2.add_signal_receiver(user2.callback_fn,
+                                     bt_manager.BTAdapter.SIGNAL_DEVICE_FOUND,
+                                     3)
+        adapter2.enable_property_cache()
+        calls = self.mock_system_bus.add_signal_receiver.call_args_list
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(calls[0][1]['dbus_interface'], 'org.bluez.Adapter')
+        stats = bt_manager.dispatcher.stats()
+        self.assertEqual((stats.rules, stats.routes, stats.subscribers),
+                         (1, 2, 4))
+
+        dispatch = calls[0][0][0]
+        dispatch('Name', 'changed', interface='org.bluez.Adapter',
+                 member=signal, path=adapter1._path)
+        user1.callback_fn.assert_called_once_with(signal, 1, 'Name',
+                                                  'changed')
+        user2.callback_fn.assert_called_once_with(signal, 2, 'Name',
+                                                  'changed')
+        self.assertEqual(adapter2.Name, 'changed')
+        dispatch('Name', 'other', interface='org.bluez.Adapter',
+                 member=signal, path='/org/bluez/985/hci1')
+        self.assertEqual(bt_manager.dispatcher.stats().unrouted, 1)
+
+        adapter1.remove_signal_receiver(signal)
+        dispatch('Name', 'again', interface='org.bluez.Adapter',
+                 member=signal, path=adapter1._path)
+        self.assertEqual(user1.callback_fn.call_count, 1)
+        user2.callback_fn.assert_called_with(signal, 2, 'Name', 'again')
+        self.assertEqual(bt_manager.dispatcher.stats().dispatched, 2)
+
+        adapter2.remove_signal_receiver(signal)
+        adapter2.remove_signal_receiver(
+            bt_manager.BTAdapter.SIGNAL_DEVICE_FOUND)
+        self.mock_system_bus.remove_signal_receiver.assert_not_called()
+        adapter2.disable_property_cache()
+        self.mock_system_bus.remove_signal_receiver.assert_called_once_with(
+            dispatch, dbus_interface='org.bluez.Adapter')
+        self.assertEqual(bt_manager.dispatcher.stats().rules, 0)
+
+    def test_dispatcher_path_keyword(self):
+        dev_path = '/org/bluez/985/hci0/dev_00_11_67_D2_AB_EE'
+        adapter = bt_manager.BTAdapter()
+        index = adapter.device_index()
+        calls = self.mock_system_bus.add_signal_receiver.call_args_list
+        self.assertEqual(len(calls), 2)
+        dispatch = calls[0][0][0]
+        dispatch('Alias', 'Speaker', interface='org.bluez.Device',
+                 member='PropertyChanged', path=dev_path)
+        self.assertEqual(index.find('Speaker'), dev_path)
+        index.close()
+        self.assertEqual(bt_manager.dispatcher.stats().rules, 0)
+
+
 class BTAdapterTest(unittest.TestCase):
 
     def setUp(self):
@@ -748,6 +1228,79 @@ class BTAdapterTest(unittest.TestCase):
         adapter.Name = new_name
         self.assertEqual(adapter.Name, new_name)
 
+    def test_set_adapter_properties(self):
+        adapter = bt_manager.BTAdapter()
+        with mock.patch.object(adapter._interface, 'GetProperties',
+                               wraps=adapter._interface.GetProperties) as get:
+            adapter.set_properties({'Name': 'Bulk',
+                                    'Discoverable': 'false',
+                                    'PairableTimeout': '180'})
+            self.assertFalse(get.called)
+        props = adapter.get_property()
+        self.assertEqual(props['Name'], 'Bulk')
+        self.assertTrue(isinstance(props['Discoverable'], dbus.Boolean))
+        self.assertFalse(props['Discoverable'])
+        self.assertEqual(props['PairableTimeout'], dbus.UInt32(180))
+        # Nothing is set unless every value converts
+        self.assertRaises(ValueError, adapter.set_properties,
+                          [('Name', 'Partial'), ('Powered', 'maybe')])
+        self.assertEqual(adapter.Name, 'Bulk')
+        # Properties missing from the schema take the current value's type
+        adapter._interface._props['Custom'] = dbus.UInt32(0)
+        adapter.set_property('Custom', '7')
+        self.assertTrue(isinstance(adapter.get_property('Custom'),
+                                   dbus.UInt32))
+        adapter.enable_property_cache()
+        call = adapter.set_properties_async([('Powered', 'off'),
+                                             ('Alias', 'alias')])
+        results = call.wait()
+        self.assertIsNone(results[0])
+        self.assertTrue(isinstance(results[1], dbus.DBusException))
+        self.assertFalse(adapter.Powered)
+
+    @mock.patch('bt_manager.discoverysession.gobject')
+    def test_adapter_discovery_session(self, gobject):
+        deltas = []
+        adapter = bt_manager.BTAdapter()
+        session = adapter.discovery_session(deltas.append, window=0.25)
+        session.start()
+        self.assertTrue(adapter.Discovering)
+        handlers = dict((c[0][1], c[0][0]) for c in
+                        self.mock_system_bus.add_signal_receiver.call_args_list)  # noqa
+        found = handlers['DeviceFound']
+        disappeared = handlers['DeviceDisappeared']
+        changed = handlers['PropertyChanged']
+        found('00:11:22:33:44:55', {'Name': 'a', 'RSSI': -60})
+        found('00:11:22:33:44:55', {'Name': 'a', 'RSSI': -58})
+        found('66:77:88:99:aa:bb', {'Name': 'b'})
+        disappeared('66:77:88:99:AA:BB')
+        gobject.timeout_add.assert_called_once_with(250, mock.ANY)
+        self.assertEqual(deltas, [])
+        gobject.timeout_add.call_args[0][1]()
+        self.assertEqual(len(deltas), 1)
+        self.assertEqual(deltas[0].added,
+                         {'00:11:22:33:44:55': {'Name': 'a', 'RSSI': -58}})
+        self.assertEqual((deltas[0].updated, deltas[0].lost), ({}, []))
+        # Repeats are dropped and updates merged per device
+        found('00:11:22:33:44:55', {'Name': 'a', 'RSSI': -58})
+        session.flush()
+        self.assertEqual(len(deltas), 1)
+        found('00:11:22:33:44:55', {'Name': 'a', 'RSSI': -50})
+        changed('Alias', 'alias',
+                path=adapter._path + '/dev_00_11_22_33_44_55')
+        changed('Alias', 'other', path=adapter._path + '/dev_00_00_00_00_00_00')  # noqa
+        session.flush()
+        self.assertEqual(deltas[1].updated,
+                         {'00:11:22:33:44:55': {'RSSI': -50, 'Alias': 'alias'}})  # noqa
+        disappeared('00:11:22:33:44:55')
+        session.stop()
+        self.assertFalse(adapter.Discovering)
+        self.assertEqual(deltas[2].lost, ['00:11:22:33:44:55'])
+        self.assertEqual(session.devices(), {})
+        stats = session.stats()
+        self.assertEqual(stats, bt_manager.DiscoveryStats(8, 3, 3, 1, 3, 0))
+        self.mock_system_bus.remove_signal_receiver.assert_called()
+
     def test_adapter_list_devices(self):
         adapter = bt_manager.BTAdapter()
         print adapter.list_devices()
@@ -790,6 +1343,115 @@ class BTAdapterTest(unittest.TestCase):
         adapter.remove_signal_receiver(signal)
         self.mock_system_bus.remove_signal_receiver.assert_called()
 
+    def test_adapter_property_cache(self):
+        adapter = bt_manager.BTAdapter()
+        adapter.enable_property_cache()
+        self.mock_system_bus.add_signal_receiver.assert_called()
+        cb = self.mock_system_bus.add_signal_receiver.call_args_list[0][0][0]
+        with mock.patch.object(adapter._interface, 'GetProperties') as gp:
+            self.assertEqual(adapter.Name, 'new-name')
+            self.assertTrue(adapter.Powered)
+            cb('Name', dbus.String('changed', variant_level=1))
+            self.assertEqual(adapter.Name, 'changed')
+            adapter.Name = 'NewAdapterName-1'
+            self.assertEqual(adapter.Name, 'NewAdapterName-1')
+            cb('Alias', dbus.String('alias', variant_level=1))
+            self.assertEqual(adapter.Alias, 'alias')
+            self.assertRaises(KeyError, adapter.get_property, 'Missing')
+            print adapter
+            gp.assert_not_called()
+        stats = adapter.property_cache_stats()
+        self.assertTrue(stats.enabled)
+        # Setting 'Name' takes its type from the schema, not the cache
+        self.assertEqual(stats.hits, 6)
+        self.assertEqual(stats.updates, 2)
+        self.assertEqual(stats.refreshes, 1)
+        self.assertTrue(stats.age >= 0)
+        adapter.refresh()
+        self.assertEqual(adapter.Name, 'NewAdapterName-1')
+        self.assertIsNone(adapter.Alias)
+        self.assertEqual(adapter.property_cache_stats().refreshes, 2)
+        adapter.disable_property_cache()
+        self.mock_system_bus.remove_signal_receiver.assert_called()
+        self.assertFalse(adapter.property_cache_stats().enabled)
+        self.assertIsNone(adapter.property_cache_stats().age)
+        self.assertEqual(adapter.Name, 'NewAdapterName-1')
+
+    def test_adapter_property_cache_with_user_signal(self):
+        name = 'Discoverable'
+        value = dbus.Boolean(False, variant_level=1)
+        signal = bt_manager.BTAdapter.SIGNAL_PROPERTY_CHANGED
+
+        user = mock.MagicMock()
+        adapter = bt_manager.BTAdapter()
+        adapter.add_signal_receiver(user.callback_fn, signal, self)
+        adapter.enable_property_cache()
+        calls = self.mock_system_bus.add_signal_receiver.call_args_list
+        self.assertEqual(len(calls), 2)
+        calls[0][0][0](name, value)
+        calls[1][0][0](name, value)
+        user.callback_fn.assert_called_with(signal, self, name, value)
+        self.assertFalse(adapter.Discoverable)
+
+    def test_adapter_device_index(self):
+        dev_path = '/org/bluez/985/hci0/dev_00_11_67_D2_AB_EE'
+        adapter = bt_manager.BTAdapter()
+        index = adapter.device_index()
+        self.assertTrue(adapter.device_index() is index)
+        handlers = {}
+        for c in self.mock_system_bus.add_signal_receiver.call_args_list:
+            handlers[(c[1]['dbus_interface'], c[0][1])] = c[0][0]
+        self.assertEqual(len(index), 1)
+        self.assertEqual(index.find('00:11:67:d2:ab:ee'), dev_path)
+        self.assertEqual(index.find('BTS-06'), dev_path)
+        self.assertEqual(index.address(dev_path), '00:11:67:D2:AB:EE')
+        self.assertEqual(index.alias(dev_path), 'BTS-06')
+        self.assertTrue('BTS-06' in index)
+        self.assertTrue(dev_path in index)
+
+        handlers[('org.bluez.Device', 'PropertyChanged')]('Alias', 'Speaker',
+                                                          path=dev_path)
+        handlers[('org.bluez.Device', 'PropertyChanged')]('Alias', 'Other',
+                                                          path='/other')
+        self.assertIsNone(index.find('BTS-06'))
+        self.assertEqual(index.find('Speaker'), dev_path)
+        self.assertIsNone(index.find('Other'))
+
+        with mock.patch.object(MockDBusInterface, 'FindDevice') as fd:
+            device = bt_manager.BTDevice(dev_id='00:11:67:D2:AB:EE')
+            self.assertEqual(device._path, dev_path)
+            device = bt_manager.BTDevice(dev_id='Speaker',
+                                         adapter_id='hci0')
+            self.assertEqual(device._path, dev_path)
+            self.assertEqual(adapter.find_device('Speaker'), dev_path)
+            fd.assert_not_called()
+
+        handlers[('org.bluez.Adapter', 'DeviceRemoved')](dev_path)
+        self.assertEqual(len(index), 0)
+        self.assertIsNone(index.find('Speaker'))
+        handlers[('org.bluez.Adapter', 'DeviceCreated')](dev_path)
+        self.assertEqual(index.find('BTS-06'), dev_path)
+        handlers[('org.bluez.Adapter', 'PropertyChanged')]('Devices', [])
+        self.assertEqual(index.paths(), [])
+        handlers[('org.bluez.Adapter', 'PropertyChanged')]('Devices',
+                                                           [dev_path])
+        self.assertEqual(index.paths(), [dev_path])
+
+        index.close()
+        self.assertEqual(
+            self.mock_system_bus.remove_signal_receiver.call_count, 4)
+        self.assertIsNone(bt_manager.registry.lookup(bt_manager.DeviceIndex,
+                                                     adapter._path))
+
+    def test_adapter_remove_device_async(self):
+        dev_path = '/org/bluez/985/hci0/dev_00_11_67_D2_AB_EE'
+        adapter = bt_manager.BTAdapter()
+        bt_manager.registry.get_object(dev_path)
+        proxies = bt_manager.registry.stats().proxies
+        call = adapter.remove_device_async(dev_path)
+        self.assertTrue(call.done())
+        self.assertEqual(bt_manager.registry.stats().proxies, proxies - 1)
+
     def test_adapter_signal_name_exception(self):
         adapter = bt_manager.BTAdapter()
         try:
@@ -893,6 +1555,14 @@ class BTDeviceTest(unittest.TestCase):
             print bt_manager.BTDiscoveryInfo(services[rec])
         print '========================================================='
 
+    def test_discover_services_async(self):
+        device = bt_manager.BTDevice(dev_id='00:11:67:D2:AB:EE')
+        user = mock.MagicMock()
+        call = device.discover_services_async(reply_handler=user.reply)
+        self.assertTrue(call.done())
+        self.assertEqual(call.wait(), device.discover_services())
+        user.reply.assert_called_once_with(call.result)
+
 
 class BTAudioSinkTest(unittest.TestCase):
 
@@ -914,6 +1584,18 @@ class BTAudioSinkTest(unittest.TestCase):
         print repr(sink)
         print '========================================================='
 
+    def test_audio_sink_connect_async(self):
+        sink = bt_manager.BTAudioSink(dev_id='00:11:67:D2:AB:EE')
+        user = mock.MagicMock()
+        call = sink.connect_async(error_handler=user.error)
+        self.assertIsNone(call.wait())
+        self.assertTrue(sink.is_connected())
+        user.error.assert_not_called()
+        call = sink.connect_async(error_handler=user.error)
+        self.assertTrue(isinstance(call.exception, dbus.DBusException))
+        user.error.assert_called_once_with(call.exception)
+        self.assertRaises(dbus.DBusException, call.wait)
+
     def test_audio_sink_connectivity(self):
         sink = bt_manager.BTAudioSink(dev_id='00:11:67:D2:AB:EE')
         sink.connect()
@@ -1257,13 +1939,14 @@ class SBCAudioTest(unittest.TestCase):
                                          bt_manager.codecs.SBCBlocks.BLOCKS_12,
                                          2,
                                          64)
+        # The frequency is one the device supports
         expected = bt_manager.SBCCodecConfig(bt_manager.codecs.SBCChannelMode.CHANNEL_MODE_MONO,  # noqa
-                                             bt_manager.codecs.SBCSamplingFrequency.FREQ_44_1KHZ,  # noqa
+                                             bt_manager.codecs.SBCSamplingFrequency.FREQ_48KHZ,  # noqa
                                              bt_manager.codecs.SBCAllocationMethod.SNR,  # noqa
                                              bt_manager.codecs.SBCSubbands.SUBBANDS_4,  # noqa
                                              bt_manager.codecs.SBCBlocks.BLOCKS_12,  # noqa
                                              2,
-                                             31)
+                                             29)
         dbus_caps = media._make_config(caps)
         expected_dbus = media._make_config(expected)
         actual_dbus = media.SelectConfiguration(dbus_caps)
@@ -1296,7 +1979,7 @@ class SBCAudioTest(unittest.TestCase):
                                          2,
                                          64)
         expected = bt_manager.SBCCodecConfig(bt_manager.codecs.SBCChannelMode.CHANNEL_MODE_STEREO,  # noqa
-                                             bt_manager.codecs.SBCSamplingFrequency.FREQ_44_1KHZ,  # noqa
+                                             bt_manager.codecs.SBCSamplingFrequency.FREQ_32KHZ,  # noqa
                                              bt_manager.codecs.SBCAllocationMethod.LOUDNESS,  # noqa
                                              bt_manager.codecs.SBCSubbands.SUBBANDS_8,  # noqa
                                              bt_manager.codecs.SBCBlocks.BLOCKS_4,  # noqa
@@ -1307,6 +1990,60 @@ class SBCAudioTest(unittest.TestCase):
         actual_dbus = media.SelectConfiguration(dbus_caps)
         self.assertEqual(actual_dbus, expected_dbus)
 
+    @mock.patch('dbus.SystemBus')
+    def test_sbc_negotiation_policy(self, patched_system_bus):
+        mock_system_bus = mock.MagicMock()
+        patched_system_bus.return_value = mock_system_bus
+        mock_system_bus.get_object.return_value = dbus.ObjectPath('/org/bluez')
+
+        caps = bt_manager.SBCCodecConfig(bt_manager.SBCChannelMode.ALL,
+                                         bt_manager.SBCSamplingFrequency.ALL,
+                                         bt_manager.SBCAllocationMethod.ALL,
+                                         bt_manager.SBCSubbands.ALL,
+                                         bt_manager.SBCBlocks.ALL,
+                                         2,
+                                         64)
+        policy = bt_manager.SBCNegotiationPolicy(
+            bt_manager.SBCNegotiationPolicy.CPU)
+        media = bt_manager.SBCAudioSink(policy=policy)
+        expected = bt_manager.SBCCodecConfig(bt_manager.SBCChannelMode.CHANNEL_MODE_STEREO,  # noqa
+                                             bt_manager.SBCSamplingFrequency.FREQ_32KHZ,  # noqa
+                                             bt_manager.SBCAllocationMethod.LOUDNESS,  # noqa
+                                             bt_manager.SBCSubbands.SUBBANDS_4,  # noqa
+                                             bt_manager.SBCBlocks.BLOCKS_8,
+                                             2,
+                                             53)
+        actual_dbus = media.SelectConfiguration(media._make_config(caps))
+        self.assertEqual(actual_dbus, media._make_config(expected))
+        self.assertEqual(media.config, expected)
+        self.assertEqual([r.parameter for r in policy.reasons],
+                         ['frequency', 'channel_mode', 'block_length',
+                          'subbands', 'allocation_method', 'min_bitpool',
+                          'max_bitpool'])
+        self.assertEqual(policy.reasons[3].value,
+                         bt_manager.SBCSubbands.SUBBANDS_4)
+
+        policy = bt_manager.SBCNegotiationPolicy(
+            bt_manager.SBCNegotiationPolicy.LATENCY, max_bitpool=40)
+        caps = caps._replace(frequency=bt_manager.SBCSamplingFrequency.FREQ_44_1KHZ |  # noqa
+                             bt_manager.SBCSamplingFrequency.FREQ_16KHZ)
+        config = policy.select(caps, caps)
+        self.assertEqual(config.frequency,
+                         bt_manager.SBCSamplingFrequency.FREQ_44_1KHZ)
+        self.assertEqual(config.block_length, bt_manager.SBCBlocks.BLOCKS_4)
+        self.assertEqual(config.max_bitpool, 40)
+        self.assertTrue('48 kHz not common' in policy.reasons[0].reason)
+        self.assertEqual(policy.reasons[-1].reason, 'capped by the policy')
+
+        policy = bt_manager.SBCNegotiationPolicy(
+            frequencies=[bt_manager.SBCSamplingFrequency.FREQ_48KHZ])
+        try:
+            exception_caught = False
+            policy.select(caps, caps)
+        except bt_manager.BTInvalidConfiguration:
+            exception_caught = True
+        self.assertTrue(exception_caught)
+
     @mock.patch('os.close')
     @mock.patch('dbus.SystemBus')
     @mock.patch('bt_manager.audio.BTAudioSink')
@@ -1464,6 +2201,866 @@ class SBCAudioTest(unittest.TestCase):
         media.Release()
 
 
+class SBCCodecTest(unittest.TestCase):
+
+    def setUp(self):
+        config = bt_manager.SBCCodecConfig(bt_manager.SBCChannelMode.CHANNEL_MODE_JOINT_STEREO,  # noqa
+                                           bt_manager.SBCSamplingFrequency.FREQ_44_1KHZ,  # noqa
+                                           bt_manager.SBCAllocationMethod.LOUDNESS,  # noqa
+                                           bt_manager.SBCSubbands.SUBBANDS_8,
+                                           bt_manager.SBCBlocks.BLOCKS_16,
+                                           2,
+                                           53)
+        self.config = config
+        self.rtp = {'ssrc': 1, 'seq_num': 0, 'timestamp': 0}
+        self.codec = bt_manager.SBCCodec(config, **self.rtp)
+        (self.rd, self.wr) = os.pipe()
+        self.addCleanup(os.close, self.rd)
+        self.addCleanup(os.close, self.wr)
+
+    def test_sbc_codec_codesize(self):
+        self.assertEqual(self.codec.codesize, 512)
+
+    def test_sbc_codec_encode_buffers(self):
+        import array
+        codesize = self.codec.codesize
+        for data in [b'\x00' * (codesize * 2 + 10),
+                     bytearray(codesize * 2 + 10),
+                     memoryview(bytearray(codesize * 2 + 10)),
+                     array.array(str('h'), [0] * (codesize + 5))]:
+            consumed = self.codec.encode(self.wr, 503, data)
+            self.assertEqual(consumed, codesize * 2)
+            self.assertTrue(len(os.read(self.rd, 4096)) > 0)
+
+    def test_sbc_codec_encode_partial(self):
+        consumed = self.codec.encode(self.wr, 503,
+                                     b'\x00' * (self.codec.codesize - 1))
+        self.assertEqual(consumed, 0)
+
+    def test_sbc_codec_decode_into(self):
+        fd = os.open('tests/vector.dat', os.O_RDONLY)
+        self.addCleanup(os.close, fd)
+        buf = bytearray(1024)
+        sz = self.codec.decode_into(fd, 503, memoryview(buf)[512:])
+        self.assertEqual(sz, 512)
+        self.assertEqual(buf[:512], bytearray(512))
+
+    def test_sbc_codec_decode_into_readonly(self):
+        try:
+            exception_caught = False
+            self.codec.decode_into(self.rd, 503, b'\x00' * 512)
+        except TypeError:
+            exception_caught = True
+        self.assertTrue(exception_caught)
+
+    def test_sbc_codec_encode_to_buffer(self):
+        data = b'\x00' * (self.codec.codesize * 8)
+        buf = bytearray(4096)
+        (consumed, lengths) = self.codec.encode_to_buffer(503, data, buf)
+        self.assertEqual(consumed, len(data))
+        self.assertTrue(len(lengths) > 1)
+        self.assertTrue(max(lengths) <= 503)
+        other = bt_manager.SBCCodec(self.config, **self.rtp)
+        other.encode(self.wr, 503, data)
+        self.assertEqual(bytes(buf[:sum(lengths)]),
+                         os.read(self.rd, 4096))
+
+    def test_sbc_codec_encode_large_mtu(self):
+        data = b'\x00' * (self.codec.codesize * 8)
+        buf = bytearray(4096)
+        (consumed, lengths) = self.codec.encode_to_buffer(2048, data, buf)
+        self.assertEqual(consumed, len(data))
+        self.assertEqual(len(lengths), 1)
+        self.assertEqual(self.codec.encode(self.wr, 2048, data), len(data))
+
+    def test_sbc_codec_decode_from_buffer(self):
+        data = b'\x00' * (self.codec.codesize * 8)
+        packets = bytearray(4096)
+        (_, lengths) = self.codec.encode_to_buffer(503, data, packets)
+        decoder = bt_manager.SBCCodec(self.config)
+        out = bytearray(len(data))
+        (written, decoded) = decoder.decode_from_buffer(packets, out,
+                                                        lengths)
+        self.assertEqual(written, len(data))
+        self.assertEqual(decoded, len(lengths))
+        (written, decoded) = decoder.decode_from_buffer(packets,
+                                                        bytearray(600),
+                                                        lengths)
+        self.assertEqual(decoded, 0)
+
+    def test_sbc_codec_encode_batch(self):
+        import socket
+        (tx, rx) = socket.socketpair(socket.AF_UNIX, socket.SOCK_SEQPACKET)
+        self.addCleanup(tx.close)
+        self.addCleanup(rx.close)
+        tx.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, 4096)
+        data = b'\x00' * (self.codec.codesize * 256)
+        consumed = 0
+        while (consumed < len(data)):
+            n = self.codec.encode_batch(tx.fileno(), 503, data[consumed:])
+            if (n == 0 and self.codec.pending):
+                break
+            consumed += n
+        self.assertTrue(self.codec.pending > 0)
+        self.assertEqual(consumed % self.codec.codesize, 0)
+        packets = []
+        while (self.codec.pending):
+            try:
+                while True:
+                    packets.append(rx.recv(4096, socket.MSG_DONTWAIT))
+            except socket.error:
+                pass
+            self.codec.flush(tx.fileno())
+        try:
+            while True:
+                packets.append(rx.recv(4096, socket.MSG_DONTWAIT))
+        except socket.error:
+            pass
+        other = bt_manager.SBCCodec(self.config, **self.rtp)
+        buf = bytearray(len(packets) * 503)
+        (_, lengths) = other.encode_to_buffer(503, data[:consumed], buf)
+        self.assertEqual([len(p) for p in packets], lengths)
+        self.assertEqual(b''.join(packets), bytes(buf[:sum(lengths)]))
+
+    def test_sbc_codec_encode_batch_stream(self):
+        data = b'\x00' * (self.codec.codesize * 8)
+        self.assertEqual(self.codec.encode_batch(self.wr, 503, data),
+                         len(data))
+        self.assertEqual(self.codec.pending, 0)
+        other = bt_manager.SBCCodec(self.config, **self.rtp)
+        other.encode(self.wr, 503, data)
+        stream = os.read(self.rd, 8192)
+        self.assertEqual(stream[:len(stream) // 2], stream[len(stream) // 2:])
+
+    def test_sbc_codec_rtp_header(self):
+        import struct
+        codec = bt_manager.SBCCodec(self.config, ssrc=0x11223344,
+                                    seq_num=0xFFFF, timestamp=1000)
+        codec.set_marker()
+        buf = bytearray(4096)
+        (_, lengths) = codec.encode_to_buffer(503,
+                                              b'\x00' * (codec.codesize * 8),
+                                              buf)
+        first = struct.unpack(str('!BBHIIB'), bytes(buf[:13]))
+        second = struct.unpack(str('!BBHIIB'),
+                               bytes(buf[lengths[0]:lengths[0] + 13]))
+        self.assertEqual(first[:5], (0x80, 0x81, 0xFFFF, 1000, 0x11223344))
+        self.assertEqual(second[:5], (0x80, 0x01, 0, 1000 + 128 * first[5],
+                                      0x11223344))
+        stats = codec.stats()
+        self.assertEqual(stats.packets, len(lengths))
+        self.assertEqual(stats.frames, 8)
+        self.assertEqual(stats.bytes, sum(lengths))
+        self.assertEqual(stats.timestamp, 1000 + 128 * 8)
+
+    def test_sbc_codec_rtp_fragmentation(self):
+        data = b'\x00' * (self.codec.codesize * 2)
+        buf = bytearray(4096)
+        (consumed, lengths) = self.codec.encode_to_buffer(100, data, buf)
+        self.assertEqual(consumed, len(data))
+        self.assertEqual(len(lengths), 4)
+        self.assertTrue(max(lengths) <= 100)
+        headers = [buf[sum(lengths[:i]) + 12] for i in range(4)]
+        self.assertEqual(headers, [0x80 | 0x40 | 2, 0x80 | 0x20 | 1,
+                                   0x80 | 0x40 | 2, 0x80 | 0x20 | 1])
+        self.assertEqual(self.codec.stats().fragments, 4)
+        decoder = bt_manager.SBCCodec(self.config)
+        out = bytearray(len(data))
+        (written, decoded) = decoder.decode_from_buffer(buf, out, lengths)
+        self.assertEqual((written, decoded), (len(data), 4))
+        self.assertEqual(decoder.stats().frames, 2)
+
+    def test_sbc_codec_rtp_fragmentation_short_buffer(self):
+        data = b'\x00' * (self.codec.codesize * 2)
+        (consumed, lengths) = self.codec.encode_to_buffer(100, data,
+                                                          bytearray(50))
+        self.assertEqual((consumed, lengths), (0, []))
+        self.assertEqual(self.codec.stats().frames, 0)
+        buf = bytearray(4096)
+        (consumed, lengths) = self.codec.encode_to_buffer(100, data, buf)
+        self.assertEqual((consumed, len(lengths)), (len(data), 4))
+        self.assertEqual(self.codec.stats().frames, 2)
+
+    def test_sbc_codec_rtp_loss(self):
+        data = b'\x00' * (self.codec.codesize * 16)
+        buf = bytearray(8192)
+        (_, lengths) = self.codec.encode_to_buffer(503, data, buf)
+        self.assertTrue(len(lengths) > 2)
+        first = lengths[0]
+        dropped = bytes(buf[:first]) + \
+            bytes(buf[first + lengths[1]:sum(lengths)])
+        decoder = bt_manager.SBCCodec(self.config)
+        decoder.decode_from_buffer(dropped, bytearray(len(data)),
+                                   [first] + lengths[2:])
+        stats = decoder.stats()
+        self.assertEqual(stats.lost, 1)
+        self.assertEqual(stats.packets, len(lengths) - 1)
+        self.assertEqual(stats.ssrc, 1)
+        self.assertEqual(stats.seq_num, len(lengths) - 1)
+
+    def test_sbc_codec_rtp_late_packet(self):
+        data = b'\x00' * (self.codec.codesize * 16)
+        buf = bytearray(8192)
+        (_, lengths) = self.codec.encode_to_buffer(503, data, buf)
+        offsets = [sum(lengths[:i]) for i in range(len(lengths))]
+        packets = [bytes(buf[o:o + n]) for (o, n) in zip(offsets, lengths)]
+        order = [1, 2, 0, 3]
+        decoder = bt_manager.SBCCodec(self.config)
+        decoder.decode_from_buffer(b''.join(packets[i] for i in order),
+                                   bytearray(len(data)),
+                                   [lengths[i] for i in order])
+        stats = decoder.stats()
+        self.assertEqual(stats.lost, 0)
+        self.assertEqual(stats.packets, 4)
+        self.assertEqual(stats.seq_num, 3)
+
+    def _encode_packets(self, frames, mtu=140):
+        data = b''.join(chr(i % 256) * 2 for i in range(frames * 256))
+        buf = bytearray(frames * mtu)
+        (_, lengths) = self.codec.encode_to_buffer(mtu, data, buf)
+        offsets = [sum(lengths[:i]) for i in range(len(lengths))]
+        return [bytes(buf[o:o + n]) for (o, n) in zip(offsets, lengths)]
+
+    def test_sbc_jitter_buffer_reorder(self):
+        packets = self._encode_packets(8)
+        reference = bt_manager.SBCCodec(self.config)
+        out = bytearray(512)
+        expected = []
+        for p in packets:
+            (written, _) = reference.decode_from_buffer(p, out)
+            expected.append(bytes(out[:written]))
+        jb = bt_manager.SBCJitterBuffer(bt_manager.SBCCodec(self.config),
+                                        depth=3)
+        order = [1, 0, 2, 4, 3, 5, 7, 6]
+        result = []
+        for i in order:
+            jb.put(packets[i])
+            if (jb.stats().depth >= 3):
+                result.append(jb.get())
+        while (jb.stats().depth):
+            result.append(jb.get())
+        self.assertEqual([r for r in result if r], expected)
+        self.assertEqual(jb.stats().late, 0)
+        self.assertEqual(jb.stats().concealed, 0)
+
+    def test_sbc_jitter_buffer_concealment(self):
+        packets = self._encode_packets(8)
+        jb = bt_manager.SBCJitterBuffer(bt_manager.SBCCodec(self.config),
+                                        depth=2,
+                                        concealment=bt_manager.SBCConcealment.REPEAT)  # noqa
+        for i in [0, 1, 3, 4]:
+            jb.put(packets[i])
+        first = jb.get()
+        second = jb.get()
+        concealed = jb.get()
+        self.assertEqual(concealed, second)
+        self.assertEqual(len(jb.get()), len(first))
+        self.assertFalse(jb.put(packets[2]))
+        self.assertEqual(jb.stats().late, 1)
+        self.assertEqual(jb.stats().concealed, 1)
+        self.assertFalse(jb.put(packets[4]))
+        self.assertEqual(jb.stats().duplicates, 1)
+        self.assertFalse(jb.put(packets[3]))
+        self.assertEqual(jb.stats().late, 2)
+        jb.get()
+        self.assertEqual(jb.stats().underruns, 0)
+        self.assertEqual(len(jb.get()), len(first))
+        self.assertEqual(jb.stats().underruns, 1)
+
+    def test_sbc_jitter_buffer_overflow(self):
+        packets = self._encode_packets(1)
+        self.codec = bt_manager.SBCCodec(self.config, seq_num=0x4000)
+        jumped = self._encode_packets(3)
+        jb = bt_manager.SBCJitterBuffer(bt_manager.SBCCodec(self.config),
+                                        depth=1, max_depth=2)
+        jb.put(packets[0])
+        self.assertTrue(jb.get())
+        for p in jumped:
+            self.assertTrue(jb.put(p))
+        self.assertEqual(jb.stats().overflows, 1)
+        self.assertEqual(jb.stats().depth, 2)
+        self.assertTrue(jb.get())
+        self.assertEqual(jb.stats().concealed, 0)
+
+    def test_sbc_jitter_buffer_fade(self):
+        packets = self._encode_packets(4)
+        jb = bt_manager.SBCJitterBuffer(bt_manager.SBCCodec(self.config),
+                                        depth=1, fade_packets=2)
+        jb.put(packets[0])
+        last = jb.get()
+        faded = [jb.get() for _ in range(3)]
+        self.assertEqual([len(f) for f in faded], [len(last)] * 3)
+        self.assertNotEqual(faded[0], last)
+        self.assertEqual(faded[1][-512:], b'\x00' * 512)
+        self.assertEqual(faded[2], b'\x00' * len(last))
+
+    def _decode_vector(self, name, max_len=65536, corrupt=()):
+        import hashlib
+        import socket
+        import struct
+        from tests.make_vbp_vectors import VECTORS
+        (tx, rx) = socket.socketpair(socket.AF_UNIX, socket.SOCK_SEQPACKET)
+        self.addCleanup(tx.close)
+        self.addCleanup(rx.close)
+        with open(os.path.join('tests', name), 'rb') as fh:
+            data = fh.read()
+        index = 0
+        while (index < len(data)):
+            length = struct.unpack_from(str('!H'), data, index)[0]
+            packet = bytearray(data[index + 2:index + 2 + length])
+            if (index in corrupt):
+                packet[12] += 1
+            tx.send(bytes(packet))
+            index += 2 + length
+        rx.setblocking(False)
+        codec = bt_manager.SBCCodec(VECTORS[name]['config'])
+        pcm = b''
+        while True:
+            out = codec.decode(rx.fileno(), VECTORS[name]['mtu'], max_len)
+            if (not out):
+                break
+            pcm += out
+        return (hashlib.md5(pcm).hexdigest(), codec.stats())
+
+    def test_sbc_codec_decode_variable_bitpool(self):
+        (digest, stats) = self._decode_vector('vbp_joint_44k.dat')
+        self.assertEqual(digest, '90da4c438435ffc9bf25c8c5459311f8')
+        self.assertEqual((stats.packets, stats.frames), (11, 150))
+        self.assertEqual(stats.bitpool_changes, 6)
+        self.assertEqual(stats.frame_count_errors, 0)
+        (digest, stats) = self._decode_vector('vbp_mono_48k.dat')
+        self.assertEqual(digest, '19ddb266cce778eb9029a164f82888c8')
+        self.assertEqual((stats.packets, stats.frames), (9, 120))
+        self.assertEqual(stats.bitpool_changes, 8)
+
+    def test_sbc_codec_decode_whole_packets(self):
+        (digest, stats) = self._decode_vector('vbp_joint_44k.dat',
+                                              max_len=8192)
+        self.assertEqual(digest, '90da4c438435ffc9bf25c8c5459311f8')
+        self.assertEqual(stats.dropped, 0)
+
+    def test_sbc_codec_decode_leaves_packet(self):
+        import socket
+        import struct
+        import time
+        (tx, rx) = socket.socketpair(socket.AF_UNIX, socket.SOCK_SEQPACKET)
+        self.addCleanup(tx.close)
+        self.addCleanup(rx.close)
+        # A blocking read would fail after a second instead of hanging
+        rx.setsockopt(socket.SOL_SOCKET, socket.SO_RCVTIMEO,
+                      struct.pack(str('ll'), 1, 0))
+        data = b'\x00' * (self.codec.codesize * 8)
+        buf = bytearray(4096)
+        (_, lengths) = self.codec.encode_to_buffer(503, data, buf)
+        self.assertEqual(len(lengths), 2)
+        decoder = bt_manager.SBCCodec(self.config)
+        tx.send(bytes(buf[:lengths[0]]))
+        start = time.time()
+        out = decoder.decode(rx.fileno(), 503)
+        self.assertTrue(time.time() - start < 0.5)
+        self.assertEqual(len(out), self.codec.codesize * 4)
+        tx.send(bytes(buf[lengths[0]:sum(lengths)]))
+        out = decoder.decode(rx.fileno(), 503)
+        self.assertEqual(len(out), self.codec.codesize * 4)
+        self.assertEqual(decoder.stats().dropped, 0)
+
+    def test_sbc_codec_decode_frame_count_errors(self):
+        (_, stats) = self._decode_vector('vbp_joint_44k.dat',
+                                         corrupt=(0, 1443))
+        self.assertEqual(stats.frames, 150)
+        self.assertEqual(stats.frame_count_errors, 2)
+
+    def test_sbc_codec_pool(self):
+        pool = bt_manager.SBCCodecPool(num_workers=2)
+        self.addCleanup(pool.shutdown)
+        other = bt_manager.SBCCodec(self.config)
+        completed = []
+        jobs = [pool.encode(codec, self.wr, 503,
+                            b'\x00' * (codec.codesize * 2),
+                            user_cb=lambda arg, job: completed.append(arg),
+                            user_arg=i)
+                for i, codec in enumerate([self.codec, other] * 2)]
+        for job in jobs:
+            self.assertEqual(job.wait(1), self.codec.codesize * 2)
+        self.assertEqual(sorted(completed), [0, 1, 2, 3])
+        self.assertTrue(len(os.read(self.rd, 65536)) > 0)
+
+    @mock.patch('bt_manager.codecs.traceback.print_exc')
+    def test_sbc_codec_pool_callback_error(self, print_exc):
+        pool = bt_manager.SBCCodecPool(num_workers=1)
+        self.addCleanup(pool.shutdown)
+
+        def fail(arg, job):
+            raise ValueError(arg)
+        data = b'\x00' * self.codec.codesize
+        first = pool.encode(self.codec, self.wr, 503, data, user_cb=fail,
+                            user_arg='first')
+        second = pool.encode(self.codec, self.wr, 503, data)
+        self.assertEqual(second.wait(1), self.codec.codesize)
+        self.assertEqual(first.result, self.codec.codesize)
+        self.assertTrue(isinstance(first.callback_exception, ValueError))
+        self.assertEqual(print_exc.call_count, 1)
+
+    def test_sbc_codec_pool_shutdown_race(self):
+        pool = bt_manager.SBCCodecPool(num_workers=1)
+        queue = pool._queues[0]
+        put = queue.put
+        threads = []
+
+        def racing_put(item, *args):
+            # Shut down between the check and the put of a job
+            if (item is not None):
+                t = threading.Thread(target=pool.shutdown)
+                t.start()
+                threads.append(t)
+                time.sleep(0.05)
+            put(item, *args)
+        queue.put = racing_put
+        job = pool.encode(self.codec, self.wr, 503,
+                          b'\x00' * self.codec.codesize)
+        self.assertEqual(job.wait(1), self.codec.codesize)
+        threads[0].join()
+        self.assertRaises(RuntimeError, pool.encode, self.codec, self.wr,
+                          503, b'')
+
+
+class SBCBroadcastGroupTest(unittest.TestCase):
+
+    def setUp(self):
+        self.config = bt_manager.SBCCodecConfig(bt_manager.SBCChannelMode.CHANNEL_MODE_JOINT_STEREO,  # noqa
+                                                bt_manager.SBCSamplingFrequency.FREQ_44_1KHZ,  # noqa
+                                                bt_manager.SBCAllocationMethod.LOUDNESS,  # noqa
+                                                bt_manager.SBCSubbands.SUBBANDS_8,  # noqa
+                                                bt_manager.SBCBlocks.BLOCKS_16,  # noqa
+                                                2,
+                                                53)
+        self.group = bt_manager.SBCBroadcastGroup(max_queue=4)
+
+    def socketpair(self):
+        import socket
+        (tx, rx) = socket.socketpair(socket.AF_UNIX, socket.SOCK_SEQPACKET)
+        self.addCleanup(tx.close)
+        self.addCleanup(rx.close)
+        return (tx, rx)
+
+    def receive(self, sock):
+        import socket
+        packets = []
+        try:
+            while True:
+                packets.append(sock.recv(4096, socket.MSG_DONTWAIT))
+        except socket.error:
+            pass
+        return packets
+
+    def test_broadcast_shared_encoder(self):
+        (tx1, rx1) = self.socketpair()
+        (tx2, rx2) = self.socketpair()
+        self.group.add(tx1.fileno(), 503, self.config)
+        self.group.add(tx2.fileno(), 503, self.config)
+        codesize = bt_manager.SBCCodec(self.config).codesize
+        data = b'\x00' * (codesize * 4)
+        # A partial frame is kept until the next write
+        self.assertEqual(self.group.write(data[:codesize * 2 + 10]), 2)
+        self.assertEqual(self.group.write(data[codesize * 2 + 10:]), 2)
+        stats = self.group.stats()
+        self.assertEqual(stats.encoders, 1)
+        self.assertEqual(stats.members, 2)
+        self.assertEqual(stats.consumed, len(data))
+        packets = self.receive(rx1)
+        self.assertEqual(packets, self.receive(rx2))
+        # Compare SBC frames past the RTP and payload headers
+        other = bt_manager.SBCCodec(self.config)
+        buf = bytearray(4096)
+        (_, lengths) = other.encode_to_buffer(503, data, buf)
+        frames = []
+        start = 0
+        for length in lengths:
+            frames.append(bytes(buf[start + 13:start + length]))
+            start += length
+        self.assertEqual(b''.join(p[13:] for p in packets), b''.join(frames))
+
+    def test_broadcast_encoder_per_config(self):
+        (tx1, rx1) = self.socketpair()
+        (tx2, rx2) = self.socketpair()
+        self.group.add(tx1.fileno(), 503, self.config)
+        member = self.group.add(tx2.fileno(), 503,
+                                self.config._replace(max_bitpool=35))
+        self.assertEqual(self.group.stats().encoders, 2)
+        self.group.write(b'\x00' * 2048)
+        self.assertNotEqual(self.receive(rx1), self.receive(rx2))
+        self.group.remove(member)
+        self.assertEqual(self.group.stats().encoders, 1)
+        self.assertEqual(len(self.group.members()), 1)
+
+    def test_broadcast_stalled_member(self):
+        import socket
+        (tx1, rx1) = self.socketpair()
+        (tx2, rx2) = self.socketpair()
+        tx2.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, 4096)
+        fast = self.group.add(tx1.fileno(), 503, self.config)
+        slow = self.group.add(tx2.fileno(), 503, self.config)
+        received = 0
+        for _ in range(64):
+            self.group.write(b'\x00' * 2048)
+            received += len(self.receive(rx1))
+        self.assertEqual(fast.stats().sent, received)
+        self.assertEqual(fast.stats().dropped, 0)
+        stats = slow.stats()
+        self.assertTrue(stats.dropped > 0)
+        self.assertEqual(stats.queued, 4)
+        self.assertFalse(stats.failed)
+        self.assertEqual(stats.sent, len(self.receive(rx2)))
+        self.group.flush()
+        self.assertTrue(slow.stats().sent > stats.sent)
+
+    def test_broadcast_failed_member(self):
+        (tx1, rx1) = self.socketpair()
+        (tx2, rx2) = self.socketpair()
+        self.group.add(tx1.fileno(), 503, self.config)
+        member = self.group.add(tx2.fileno(), 503, self.config)
+        rx2.close()
+        self.group.write(b'\x00' * 2048)
+        self.assertTrue(member.stats().failed)
+        self.assertTrue(isinstance(member.error, OSError))
+        self.group.write(b'\x00' * 2048)
+        self.assertEqual(member.stats().queued, 0)
+        self.assertEqual(len(self.receive(rx1)), 2)
+
+
+class PCMSourcePipelineTest(unittest.TestCase):
+
+    def setUp(self):
+        import socket
+        self.config = bt_manager.SBCCodecConfig(bt_manager.SBCChannelMode.CHANNEL_MODE_JOINT_STEREO,  # noqa
+                                                bt_manager.SBCSamplingFrequency.FREQ_44_1KHZ,  # noqa
+                                                bt_manager.SBCAllocationMethod.LOUDNESS,  # noqa
+                                                bt_manager.SBCSubbands.SUBBANDS_8,  # noqa
+                                                bt_manager.SBCBlocks.BLOCKS_16,  # noqa
+                                                2,
+                                                53)
+        self.codec = bt_manager.SBCCodec(self.config)
+        (self.tx, self.rx) = socket.socketpair(socket.AF_UNIX,
+                                               socket.SOCK_SEQPACKET)
+        self.addCleanup(self.tx.close)
+        self.addCleanup(self.rx.close)
+
+    def receive(self):
+        import socket
+        packets = []
+        try:
+            while True:
+                packets.append(self.rx.recv(4096, socket.MSG_DONTWAIT))
+        except socket.error:
+            pass
+        return packets
+
+    def pipeline(self, buffer_time=0.05):
+        pipeline = bt_manager.PCMSourcePipeline(self.codec, self.tx.fileno(),
+                                                503, self.config,
+                                                buffer_time)
+        self.addCleanup(pipeline.stop)
+        return pipeline
+
+    def test_ring_buffer_wrap(self):
+        ring = bt_manager.PCMRingBuffer(8)
+        self.assertEqual(ring.write(b'abcdef'), 6)
+        buf = bytearray(4)
+        self.assertEqual(ring.readinto(buf), 4)
+        self.assertEqual(buf, bytearray(b'abcd'))
+        self.assertEqual(ring.write(b'ghijklmn'), 6)
+        self.assertEqual(ring.fill, 8)
+        self.assertEqual(ring.space, 0)
+        buf = bytearray(10)
+        self.assertEqual(ring.readinto(buf), 8)
+        self.assertEqual(buf[:8], bytearray(b'efghijkl'))
+        self.assertEqual(ring.fill, 0)
+
+    def test_producers(self):
+        import array
+        producer = bt_manager.GeneratorProducer([b'abc', b'', b'defg'])
+        self.assertEqual(producer.read(2), b'ab')
+        self.assertEqual(producer.read(4), b'c')
+        self.assertEqual(producer.read(4), b'defg')
+        self.assertEqual(producer.read(4), b'')
+        producer = bt_manager.ArrayProducer(array.array(str('h'), [1, -1]))
+        self.assertEqual(bytes(producer.read(3)), b'\x01\x00\xff')
+        self.assertEqual(bytes(producer.read(3)), b'\xff')
+        self.assertEqual(len(producer.read(3)), 0)
+
+    def test_pipeline_paced(self):
+        pipeline = self.pipeline()
+        # 4 frames of 128 samples per 503 byte packet
+        self.assertAlmostEqual(pipeline.period, 512 / 44100.0)
+        data = b'\x00' * (self.codec.codesize * 4 * 20)
+        start = time.time()
+        pipeline.start(bt_manager.GeneratorProducer([data]))
+        self.assertTrue(pipeline.wait(5))
+        self.assertTrue(time.time() - start >= pipeline.period * 19)
+        packets = self.receive()
+        self.assertEqual(len(packets), 20)
+        self.assertEqual(set(len(p) for p in packets),
+                         set([13 + 4 * self.codec.frame_length]))
+        stats = pipeline.stats()
+        self.assertEqual(stats.underruns, 0)
+        self.assertEqual(stats.fill, 0)
+        self.assertEqual(self.codec.stats().frames, 80)
+        self.assertEqual(pipeline.error, None)
+
+    def test_pipeline_underrun(self):
+        def slow():
+            yield b'\x00' * (self.codec.codesize * 8)
+            time.sleep(pipeline.period * 4)
+            yield b'\x00' * (self.codec.codesize * 6)
+
+        pipeline = self.pipeline(buffer_time=0.02)
+        pipeline.start(bt_manager.GeneratorProducer(slow()))
+        self.assertTrue(pipeline.wait(5))
+        stats = pipeline.stats()
+        self.assertTrue(stats.underruns > 0)
+        # The last packet carries the remaining whole frames
+        packets = self.receive()
+        self.assertEqual(len(packets), stats.ticks)
+        self.assertEqual(self.codec.stats().frames,
+                         4 * (stats.ticks - 1) + 2)
+
+    def test_pipeline_drain(self):
+        import fcntl
+        (rd, wr) = os.pipe()
+        self.addCleanup(os.close, rd)
+        self.addCleanup(os.close, wr)
+        # F_SETPIPE_SZ, leaving room for only eight packets
+        fcntl.fcntl(wr, 1031, 4096)
+        for fd in (rd, wr):
+            fcntl.fcntl(fd, fcntl.F_SETFL, os.O_NONBLOCK)
+        pipeline = bt_manager.PCMSourcePipeline(self.codec, wr, 503,
+                                                self.config, 0.05)
+        self.addCleanup(pipeline.stop)
+        data = b'\x00' * (self.codec.codesize * (4 * 11 + 2))
+        pipeline.start(bt_manager.GeneratorProducer([data]))
+        # The last packets wait for the transport to take them
+        self.assertFalse(pipeline.wait(0.5))
+        received = 0
+        while True:
+            done = pipeline.wait(0.02)
+            try:
+                received += len(os.read(rd, 65536))
+            except OSError:
+                if (done):
+                    break
+        self.assertEqual(received, 11 * (13 + 4 * self.codec.frame_length) +
+                         13 + 2 * self.codec.frame_length)
+        self.assertEqual(self.codec.pending, 0)
+        self.assertEqual(pipeline.error, None)
+
+
+class PCMSinkPipelineTest(unittest.TestCase):
+
+    def setUp(self):
+        import socket
+        self.config = bt_manager.SBCCodecConfig(bt_manager.SBCChannelMode.CHANNEL_MODE_JOINT_STEREO,  # noqa
+                                                bt_manager.SBCSamplingFrequency.FREQ_44_1KHZ,  # noqa
+                                                bt_manager.SBCAllocationMethod.LOUDNESS,  # noqa
+                                                bt_manager.SBCSubbands.SUBBANDS_8,  # noqa
+                                                bt_manager.SBCBlocks.BLOCKS_16,  # noqa
+                                                2,
+                                                53)
+        (self.tx, self.rx) = socket.socketpair(socket.AF_UNIX,
+                                               socket.SOCK_SEQPACKET)
+        self.addCleanup(self.tx.close)
+        self.addCleanup(self.rx.close)
+        decoder = bt_manager.SBCCodec(self.config)
+        self.pipeline = bt_manager.PCMSinkPipeline(decoder, self.rx.fileno(),
+                                                   503, self.config,
+                                                   block_time=0.006)
+        self.addCleanup(self.pipeline.stop)
+        # 4 frames per packet and 2 frames per block
+        self.assertEqual(self.pipeline.block_size, decoder.codesize * 2)
+        self.pcm = b''.join(struct.pack(b'<h', (i * 37) % 2000 - 1000)
+                            for i in range(decoder.codesize * 5))
+        encoder = bt_manager.SBCCodec(self.config)
+        packets = bytearray(4096 * 4)
+        (_, self.lengths) = encoder.encode_to_buffer(503, self.pcm, packets)
+        self.packets = packets
+        expected = bytearray(len(self.pcm) * 2)
+        (size, _) = bt_manager.SBCCodec(self.config).decode_from_buffer(
+            packets, expected, self.lengths)
+        self.expected = bytes(expected[:size])
+
+    def play(self):
+        self.pipeline.start()
+        start = 0
+        for length in self.lengths:
+            self.tx.send(bytes(self.packets[start:start + length]))
+            start += length
+        self.tx.close()
+        deadline = time.time() + 5
+        while (self.pipeline.is_running() and time.time() < deadline):
+            time.sleep(0.01)
+        self.assertFalse(self.pipeline.is_running())
+        self.pipeline.stop()
+
+    def test_pcm_sink_consumers(self):
+        import io
+        import tempfile
+        import wave
+        raw = io.BytesIO()
+        self.pipeline.add(bt_manager.RawFileConsumer(raw))
+        blocks = []
+        self.pipeline.add(bt_manager.CallbackConsumer(blocks.append))
+        wav = tempfile.NamedTemporaryFile(suffix='.wav')
+        self.addCleanup(wav.close)
+        self.pipeline.add(bt_manager.WAVConsumer(wav.name))
+        piped = tempfile.TemporaryFile()
+        self.addCleanup(piped.close)
+        self.pipeline.add(bt_manager.PipeConsumer(['cat'], stdout=piped))
+        self.play()
+        self.assertEqual(raw.getvalue(), self.expected)
+        self.assertEqual(len(blocks), 5)
+        self.assertEqual(b''.join(blocks), self.expected)
+        reader = wave.open(wav.name, 'rb')
+        self.assertEqual(reader.getnchannels(), 2)
+        self.assertEqual(reader.getframerate(), 44100)
+        self.assertEqual(reader.readframes(reader.getnframes()),
+                         self.expected)
+        piped.seek(0)
+        self.assertEqual(piped.read(), self.expected)
+        stats = self.pipeline.stats()
+        self.assertEqual(stats.blocks, 5)
+        self.assertEqual(stats.bytes, len(self.expected))
+        self.assertEqual(stats.consumers, 4)
+
+    def test_pcm_sink_slow_consumer(self):
+        release = threading.Event()
+        fast = []
+        slow = []
+        failing = []
+
+        def stall(block):
+            release.wait(5)
+            slow.append(block)
+
+        def fail(block):
+            failing.append(block)
+            raise IOError('Disk full')
+
+        fast_consumer = self.pipeline.add(
+            bt_manager.CallbackConsumer(fast.append))
+        slow_consumer = self.pipeline.add(
+            bt_manager.CallbackConsumer(stall), max_queue=1)
+        fail_consumer = self.pipeline.add(
+            bt_manager.CallbackConsumer(fail))
+        self.pipeline.start()
+        start = 0
+        for length in self.lengths:
+            self.tx.send(bytes(self.packets[start:start + length]))
+            start += length
+        deadline = time.time() + 5
+        while (len(fast) < 5 and time.time() < deadline):
+            time.sleep(0.01)
+        self.assertEqual(b''.join(fast), self.expected)
+        release.set()
+        self.pipeline.stop()
+        stats = self.pipeline.consumer_stats(slow_consumer)
+        self.assertEqual(stats.delivered, len(slow))
+        self.assertEqual(stats.delivered + stats.dropped, 5)
+        self.assertTrue(stats.dropped > 0)
+        self.assertEqual(self.pipeline.consumer_stats(fast_consumer),
+                         bt_manager.PCMConsumerStats(0, 5, 0, False))
+        stats = self.pipeline.consumer_stats(fail_consumer)
+        self.assertTrue(stats.failed)
+        self.assertEqual(len(failing), 1)
+
+
+class SBCBitpoolControllerTest(unittest.TestCase):
+
+    def setUp(self):
+        import socket
+        self.config = bt_manager.SBCCodecConfig(bt_manager.SBCChannelMode.CHANNEL_MODE_JOINT_STEREO,  # noqa
+                                                bt_manager.SBCSamplingFrequency.FREQ_44_1KHZ,  # noqa
+                                                bt_manager.SBCAllocationMethod.LOUDNESS,  # noqa
+                                                bt_manager.SBCSubbands.SUBBANDS_8,  # noqa
+                                                bt_manager.SBCBlocks.BLOCKS_16,  # noqa
+                                                45,
+                                                53)
+        self.codec = bt_manager.SBCCodec(self.config)
+        (self.tx, self.rx) = socket.socketpair(socket.AF_UNIX,
+                                               socket.SOCK_SEQPACKET)
+        self.addCleanup(self.tx.close)
+        self.addCleanup(self.rx.close)
+        self.tx.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, 4096)
+        self.changes = []
+        self.controller = bt_manager.SBCBitpoolController(
+            self.codec, self.tx.fileno(), self.config, hold=2, recover=3)
+        self.controller.register_change_event(
+            lambda arg, change: self.changes.append((arg, change)), 'arg')
+
+    def receive(self):
+        import socket
+        packets = []
+        try:
+            while True:
+                packets.append(self.rx.recv(4096, socket.MSG_DONTWAIT))
+        except socket.error:
+            pass
+        return packets
+
+    def congest(self):
+        data = b'\x00' * (self.codec.codesize * 4)
+        while (not self.codec.pending):
+            self.codec.encode_batch(self.tx.fileno(), 503, data)
+
+    def test_sbc_codec_set_bitpool(self):
+        self.assertAlmostEqual(self.codec.frame_duration, 128 / 44100.0)
+        length = self.codec.frame_length
+        self.codec.set_bitpool(35)
+        self.assertTrue(self.codec.frame_length < length)
+        data = b'\x00' * self.codec.codesize
+        self.codec.encode_batch(self.tx.fileno(), 503, data)
+        packet = self.receive()[0]
+        # Bitpool field of the SBC frame header past the RTP headers
+        self.assertEqual(ord(packet[13 + 2:13 + 3]), 35)
+        self.assertEqual(len(packet), 13 + self.codec.frame_length)
+
+    def test_bitpool_congested(self):
+        self.assertEqual(self.controller.update(), None)
+        self.assertEqual(self.controller.stats().delay, 0.0)
+        self.congest()
+        self.assertEqual(self.controller.update(), None)
+        change = self.controller.update()
+        self.assertEqual((change.old, change.new, change.reason),
+                         (53, 49, bt_manager.SBCBitpoolController.CONGESTED))
+        self.assertTrue(change.delay >= self.controller.high_delay)
+        self.assertEqual(self.codec.config.bitpool, 49)
+        self.assertEqual(self.changes, [('arg', change)])
+        # Hysteresis restarts after each change and stops at the minimum
+        self.assertEqual(self.controller.update(), None)
+        self.controller.update()
+        self.controller.update()
+        self.controller.update()
+        self.assertEqual(self.controller.bitpool, 45)
+        self.assertEqual(self.controller.stats().lowered, 2)
+
+    def test_bitpool_recovered(self):
+        self.congest()
+        self.controller.update()
+        self.controller.update()
+        self.assertEqual(self.controller.bitpool, 49)
+        self.receive()
+        self.codec.flush(self.tx.fileno())
+        self.receive()
+        self.assertEqual(self.controller.update(), None)
+        self.assertEqual(self.controller.update(), None)
+        change = self.controller.update()
+        self.assertEqual((change.old, change.new, change.reason),
+                         (49, 50, bt_manager.SBCBitpoolController.RECOVERED))
+        self.assertEqual([c for (_, c) in self.changes],
+                         self.controller.changes())
+        stats = self.controller.stats()
+        self.assertEqual((stats.bitpool, stats.lowered, stats.raised),
+                         (50, 1, 1))
+
+
 class BTInputTest(unittest.TestCase):
 
     def setUp(self):